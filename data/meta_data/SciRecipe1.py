@@ -1,9 +1,14 @@
 import os
 import json
 import re
-from typing import List, Dict, Tuple, Any, Set
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Any, Set, Iterator
 from tqdm import tqdm
 from openai import OpenAI
+from resume_index import load_existing_ids
 from prompt2 import (
     SYSTEM_PROMPT,
     TYPE_INSTRUCTIONS,
@@ -24,6 +29,13 @@ TEMPERATURE = 0.6
 MAX_REPAIR_TRIES = 2 #retry 
 VERBOSE = False
 
+# Concurrency: all type requests of WINDOW_PROTOCOLS protocols are in flight
+# together on MAX_WORKERS threads; the writer fsyncs at most every FSYNC_INTERVAL_S
+MAX_WORKERS = 16
+WINDOW_PROTOCOLS = 32
+FSYNC_INTERVAL_S = 5.0
+READ_CHUNK_SIZE = 1 << 20
+
 # 🔴 Explicitly specify the types and number of samples to generate
 SELECTED_TYPES: Dict[str, int] = {
     "overview_qa": 2,
@@ -178,115 +190,213 @@ def normalize_protocol_fields(proto: Dict[str, Any]) -> Dict[str, str]:
     }
 
 def load_protocols(input_file: str):
-    with open(input_file, "r", encoding="utf-8") as f:
-        first_char = f.read(1)
-        f.seek(0)
-        if first_char == "[":
-            data = json.load(f)
-            return data
-        else:
-            return [json.loads(line) for line in f if line.strip()]
+    return list(iter_protocols(input_file))
 
-def load_existing_ids(*paths: str) -> Set[Any]:
-    processed: Set[Any] = set()
-    for p in paths:
-        if not p or not os.path.exists(p):
-            continue
-        with open(p, "r", encoding="utf-8") as f:
+def iter_protocols(input_file: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Stream protocols from a JSON array or a JSONL file without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(input_file, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        while buf and not buf.strip():
+            buf = f.read(chunk_size)
+        buf = buf.lstrip()
+        if not buf.startswith("["):
+            f.seek(0)
             for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    pid = obj.get("id")
-                    if pid is not None:
-                        processed.add(pid)
-                except Exception:
-                    continue
-    return processed
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        buf, pos, eof = buf[1:], 0, False
+        while True:
+            # skip whitespace and the separating comma
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield obj
+            pos = end
+
+# ================= Output writer =================
+class RecordWriter:
+    """Single writer thread owning both output files.
+
+    Producers hand over whole per-protocol batches, so a protocol's records
+    land contiguously; files stay open and are fsync'd at most every
+    `fsync_interval` seconds and on close.
+    """
+
+    def __init__(self, ok_path: str, bad_path: str, fsync_interval: float = FSYNC_INTERVAL_S):
+        self.files = {
+            "ok": open(ok_path, "a", encoding="utf-8"),
+            "bad": open(bad_path, "a", encoding="utf-8"),
+        }
+        self.fsync_interval = fsync_interval
+        self.queue: "queue.Queue" = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._loop, name="record-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, records: List[Tuple[str, Dict[str, Any]]]):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(records)
+
+    def _sync(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _loop(self):
+        last_sync = time.monotonic()
+        try:
+            while True:
+                records = self.queue.get()
+                if records is None:
+                    break
+                for kind, rec in records:
+                    self.files[kind].write(json.dumps(rec, ensure_ascii=False) + "\n")
+                if time.monotonic() - last_sync >= self.fsync_interval:
+                    self._sync()
+                    last_sync = time.monotonic()
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._sync()
+        for f in self.files.values():
+            f.close()
+        if self.error is not None:
+            raise self.error
+
 
 # ================= Main Workflow =================
+def generate_type_records(client: OpenAI, rec_id: Any, norm: Dict[str, str],
+                          type_name: str, num: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """One API request for `num` QA items of one type -> [("ok"|"bad", record), ...]."""
+    user_prompt = USER_PROMPT_TEMPLATE_LEVEL2.format(
+        **norm,
+        num_qa=num,
+        type_name=type_name,
+        type_instruction=TYPE_INSTRUCTIONS[type_name],
+    )
+
+    resp = client.chat.completions.create(
+        model=MODEL_NAME,
+        temperature=TEMPERATURE,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+    )
+    text = resp.choices[0].message.content or ""
+    items = extract_qa_blocks(text)
+
+    if len(items) > num:
+        items = items[:num]
+
+    records = []
+    for it in items:
+        ok, msg, key_steps = validate_item(it)
+        actions = extract_actions_from_key_steps(key_steps)
+
+        out = {
+            "id": rec_id,
+            "type": type_name,
+            "question": it["question"],
+            "think": it["think"],
+            "key": it["key"],
+            "orc": it["orc"],
+            "note": it["note"],
+            "action": actions, 
+        }
+
+        if ok:
+            records.append(("ok", out))
+        else:
+            out["error"] = msg
+            records.append(("bad", out))
+    return records
+
+def iter_windows(protocols: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    window = []
+    for idx, proto in enumerate(protocols):
+        window.append((idx, proto))
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
 def main():
     client = OpenAI(base_url=BASE_URL, api_key=OPENAI_API_KEY)
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    os.makedirs(os.path.dirname(UNCHECKED_OUTPUT_FILE), exist_ok=True)
-
-    # 1) Preload input
-    data = load_protocols(INPUT_FILE)
+    os.makedirs(os.path.dirname(OUTPUT_FILE) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(UNCHECKED_OUTPUT_FILE) or ".", exist_ok=True)
 
-    # 2) Load processed IDs (check both ok/failed files)
+    # 1) Load processed IDs (check both ok/failed files)
     processed_ids = load_existing_ids(OUTPUT_FILE, UNCHECKED_OUTPUT_FILE)
     if VERBOSE:
         print(f"[Resume] Found {len(processed_ids)} processed ids. Will skip them.")
 
-    # 3) Iterate over inputs and generate output
+    # 2) Stream inputs; fan out every type request of a window of protocols at once
+    total = 0
     skipped = 0
+    failed = 0
     written_ok = 0
     written_bad = 0
-
-    for idx, proto in enumerate(tqdm(data, total=len(data), desc="Processing protocols")):
-        rec_id = proto.get("id", f"protocol_{idx}") 
-        if rec_id in processed_ids:
-            skipped += 1
-            continue
-
-        norm = normalize_protocol_fields(proto)
-
-        for type_name, num in SELECTED_TYPES.items():
-            if num <= 0:
-                continue
-
-            user_prompt = USER_PROMPT_TEMPLATE_LEVEL2.format(
-                **norm,
-                num_qa=num,
-                type_name=type_name,
-                type_instruction=TYPE_INSTRUCTIONS[type_name],
-            )
-
-            resp = client.chat.completions.create(
-                model=MODEL_NAME,
-                temperature=TEMPERATURE,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-            )
-            text = resp.choices[0].message.content or ""
-            items = extract_qa_blocks(text)
-
-            if len(items) > num:
-                items = items[:num]
-
-            for it in items:
-                ok, msg, key_steps = validate_item(it)
-                actions = extract_actions_from_key_steps(key_steps)
-
-                out = {
-                    "id": rec_id,
-                    "type": type_name,
-                    "question": it["question"],
-                    "think": it["think"],
-                    "key": it["key"],
-                    "orc": it["orc"],
-                    "note": it["note"],
-                    "action": actions, 
-                }
-
-                if ok:
-                    with open(OUTPUT_FILE, "a", encoding="utf-8") as fout_ok:
-                        fout_ok.write(json.dumps(out, ensure_ascii=False) + "\n")
-                    written_ok += 1
-                else:
-                    out["error"] = msg
-                    with open(UNCHECKED_OUTPUT_FILE, "a", encoding="utf-8") as fout_bad:
-                        fout_bad.write(json.dumps(out, ensure_ascii=False) + "\n")
-                    written_bad += 1
-        processed_ids.add(rec_id)
+    active_types = [(t, n) for t, n in SELECTED_TYPES.items() if n > 0]
+
+    writer = RecordWriter(OUTPUT_FILE, UNCHECKED_OUTPUT_FILE)
+    pbar = tqdm(desc="Processing protocols")
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            for window in iter_windows(iter_protocols(INPUT_FILE), WINDOW_PROTOCOLS):
+                jobs = []
+                for idx, proto in window:
+                    total += 1
+                    rec_id = proto.get("id", f"protocol_{idx}")
+                    if rec_id in processed_ids:
+                        skipped += 1
+                        continue
+                    processed_ids.add(rec_id)
+                    norm = normalize_protocol_fields(proto)
+                    futures = [pool.submit(generate_type_records, client, rec_id, norm, t, n)
+                               for t, n in active_types]
+                    jobs.append((rec_id, futures))
+
+                # A protocol is written only once all its types are back, so
+                # resume never sees a half-finished protocol
+                for rec_id, futures in jobs:
+                    try:
+                        records = [r for fut in futures for r in fut.result()]
+                    except Exception as e:
+                        failed += 1
+                        if VERBOSE:
+                            print(f"[Error] {rec_id}: {type(e).__name__}: {e}")
+                        continue
+                    writer.write(records)
+                    written_ok += sum(kind == "ok" for kind, _ in records)
+                    written_bad += sum(kind == "bad" for kind, _ in records)
+                pbar.update(len(window))
+    finally:
+        pbar.close()
+        writer.close()
 
     print("\n========== Summary ==========")
-    print(f"Input protocols:                  {len(data)}")
+    print(f"Input protocols:                  {total}")
     print(f"Skipped by resume (seen ids):     {skipped}")
+    print(f"Failed (API error, will retry):   {failed}")
     print(f"✅ Written OK (format passed):     {written_ok}")
     print(f"❌ Written UNCHECKED (format fail): {written_bad}")
     print(f"Saved OK to:        {OUTPUT_FILE}")
@@ -1,10 +1,14 @@
 import os
 import json
+import time
 import random
 import re
-from typing import List, Dict, Tuple, Any, Set
+import asyncio
+from typing import List, Dict, Tuple, Any, Set, Optional
 from tqdm import tqdm
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+from resume_index import load_existing_ids, reset_index
 from prompt import (
     SYSTEM_PROMPT,
     USER_PROMPT_TEMPLATE_LEVEL1, 
@@ -41,6 +45,16 @@ VALIDATION_TEMPERATURE = 0.2
 NUM_TYPES_PER_PROTOCOL = 3
 
 VERBOSE = False  # True enables additional logs
+
+# Async pipeline: at most MAX_CONCURRENT_REQUESTS API calls in flight across
+# all stages; transient failures (429, 5xx, timeouts, connection errors) are
+# retried with exponential backoff, honouring Retry-After on 429s
+MAX_CONCURRENT_REQUESTS = 16
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0   # seconds, doubled per attempt (with jitter)
+RETRY_MAX_DELAY = 60.0
+REQUEST_TIMEOUT = 600.0
+STAGE_QUEUE_SIZE = 256   # bound on items waiting between stages
 # ================================================
 
 
@@ -184,20 +198,7 @@ def validate_item(item: Dict[str, str]) -> Tuple[bool, str, List[Dict[str, Any]]
     return True, "ok", key_steps
 
 
-def run_secondary_validation(client: OpenAI, qa_pair: Dict[str, str]) -> Dict[str, str]:
-    user_prompt_val = USER_PROMPT_TEMPLATE2.format(
-        question_text=qa_pair["question"],
-        answer_text=qa_pair["answer"]
-    )
-    response = client.chat.completions.create(
-        model=VALIDATION_MODEL_NAME,
-        temperature=VALIDATION_TEMPERATURE,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT2},
-            {"role": "user", "content": user_prompt_val},
-        ],
-    )
-    validation_output_text = response.choices[0].message.content or ""
+def parse_validation_report(validation_output_text: str) -> Dict[str, str]:
     report_match = VALIDATION_REPORT_PATTERN.search(validation_output_text)
     if report_match:
         return {
@@ -220,6 +221,22 @@ def run_secondary_validation(client: OpenAI, qa_pair: Dict[str, str]) -> Dict[st
         }
 
 
+async def run_secondary_validation(api: "RateLimitedClient", qa_pair: Dict[str, str]) -> Dict[str, str]:
+    user_prompt_val = USER_PROMPT_TEMPLATE2.format(
+        question_text=qa_pair["question"],
+        answer_text=qa_pair["answer"]
+    )
+    validation_output_text = await api.chat(
+        model=VALIDATION_MODEL_NAME,
+        temperature=VALIDATION_TEMPERATURE,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT2},
+            {"role": "user", "content": user_prompt_val},
+        ],
+    )
+    return parse_validation_report(validation_output_text)
+
+
 def is_validation_pass(validation_report: Dict[str, str]) -> bool:
     pass_conditions = {
         "accuracy_check": "No significant scientific inaccuracies found.",
@@ -267,25 +284,6 @@ def normalize_protocol_fields(proto: Dict[str, Any]) -> Dict[str, str]:
     }
 
 
-def load_existing_ids(*paths: str) -> Set[Any]:
-    processed: Set[Any] = set()
-    for p in paths:
-        if not p or not os.path.exists(p):
-            continue
-        with open(p, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    pid = obj.get("id")
-                    if pid is not None:
-                        processed.add(pid)
-                except Exception:
-                    continue
-    return processed
-
 
 def extract_actions_from_key(key_block: str) -> List[str]:
     actions: List[str] = []
@@ -310,31 +308,111 @@ def _flush_and_sync(fobj):
         pass
 
 
-def main():
-    api_key = os.getenv("OPENAI_API_KEY", OPENAI_API_KEY)
-    client = OpenAI(base_url=BASE_URL, api_key=api_key)
+# ================= Async API client =================
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
 
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    os.makedirs(os.path.dirname(UNCHECKED_OUTPUT_FILE), exist_ok=True)
-    if CLEAR_OUTPUT_ON_START:
-        open(OUTPUT_FILE, "w", encoding="utf-8").close()
-        open(UNCHECKED_OUTPUT_FILE, "w", encoding="utf-8").close()
-    processed_ids = load_existing_ids(OUTPUT_FILE, UNCHECKED_OUTPUT_FILE) if not CLEAR_OUTPUT_ON_START else set()
-    if VERBOSE:
-        print(f"[Resume] Already processed ids: {len(processed_ids)}")
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        num_lines = sum(1 for _ in f)
 
-    total_items = 0
-    total_passed = 0
-    total_unchecked = 0
-    skipped = 0
+def _retry_after_seconds(err: Exception) -> Optional[float]:
+    response = getattr(err, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimitedClient:
+    """AsyncOpenAI wrapper: bounded concurrency plus retry with backoff.
+
+    A 429 pauses every caller, not just the one that hit it, until the
+    server's Retry-After (or the backoff delay) has passed, so a burst does
+    not keep hammering an exhausted quota.
+    """
+
+    def __init__(self, client: AsyncOpenAI, max_concurrency: int):
+        self.client = client
+        self.sem = asyncio.Semaphore(max_concurrency)
+        self.cooldown_until = 0.0
+        self.retries = 0
+        self.failures = 0
+
+    async def chat(self, model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+        for attempt in range(MAX_RETRIES + 1):
+            wait = self.cooldown_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                async with self.sem:
+                    response = await self.client.chat.completions.create(
+                        model=model, temperature=temperature, messages=messages,
+                    )
+                return response.choices[0].message.content or ""
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if isinstance(e, openai.RateLimitError):
+                    delay = max(delay, _retry_after_seconds(e) or 0.0)
+                    self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+                if VERBOSE:
+                    print(f"[Retry {attempt + 1}/{MAX_RETRIES}] {type(e).__name__}; sleeping {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+# ================= Pipeline stages =================
+def build_user_prompt(norm: Dict[str, str], type_name: str, num_to_generate: int) -> str:
+    return USER_PROMPT_TEMPLATE_LEVEL1.format(
+        exp_name=norm["exp_name"],
+        abstract=norm["abstract"],
+        materials=norm["materials"],
+        equipment=norm["equipment"],
+        procedure=norm["procedure"],
+        notes=norm["notes"],
+        type_name=type_name,
+        type_instruction=TYPE_INSTRUCTIONS[type_name],
+        num_qa=num_to_generate,
+    )
 
-    with open(INPUT_FILE, "r", encoding="utf-8") as fin, \
-         open(OUTPUT_FILE, "a", encoding="utf-8") as fout_ok, \
-         open(UNCHECKED_OUTPUT_FILE, "a", encoding="utf-8") as fout_unchecked:
 
-        for idx, line in enumerate(tqdm(fin, total=num_lines, desc="Processing protocols")):
+def build_repair_block(it: Dict[str, str]) -> str:
+    return (
+        f"<question>{it.get('question','')}</question>\n"
+        f"<think>{it.get('think','')}</think>\n"
+        f"<key>{it.get('key','')}</key>\n"
+        f"<orc>{it.get('orc','')}</orc>\n"
+        f"<note>{it.get('note','')}</note>"
+    )
+
+
+def build_record(rec_id: Any, type_name: str, qa_pair: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "id": rec_id,
+        "type": type_name,
+        "question": qa_pair["question"],
+        "think": qa_pair["think"],
+        "key": qa_pair["key"],
+        "orc": qa_pair["orc"],
+        "note": qa_pair["note"],
+        "action": extract_actions_from_key(qa_pair.get("key", "")),
+    }
+
+
+def iter_protocol_tasks(path: str, processed_ids: Set[Any], stats: Dict[str, int]):
+    """Yield (rec_id, [(type_name, user_prompt), ...]) per protocol still to do, reading lazily."""
+    six_core = ["retrieval", "planning", "troubleshooting", "constraint", "scaling", "safety"]
+    available = [t for t in six_core if t in TYPE_INSTRUCTIONS]
+    with open(path, "r", encoding="utf-8") as fin:
+        for idx, line in enumerate(fin):
+            stats["lines"] += 1
             line = line.strip()
             if not line:
                 continue
@@ -347,7 +425,7 @@ def main():
 
             rec_id = proto.get("id", f"auto_{idx}")
             if rec_id in processed_ids:
-                skipped += 1
+                stats["skipped"] += 1
                 continue
 
             norm = normalize_protocol_fields(proto)
@@ -356,106 +434,192 @@ def main():
                     print("[Skip] missing essential fields (exp_name/procedure).")
                 continue
 
-            six_core = ["retrieval", "planning", "troubleshooting", "constraint", "scaling", "safety"]
-            available = [t for t in six_core if t in TYPE_INSTRUCTIONS]
             k = max(0, min(NUM_TYPES_PER_PROTOCOL, len(available)))
             selected_types = random.sample(available, k=k)
-
+            tasks = []
             for type_name in selected_types:
-                type_instruction = TYPE_INSTRUCTIONS[type_name]
                 num_to_generate = random.randint(PER_TYPE_MIN, PER_TYPE_MAX)
+                tasks.append((type_name, build_user_prompt(norm, type_name, num_to_generate)))
+            processed_ids.add(rec_id)
+            yield rec_id, tasks
+
+
+class ProtocolPipeline:
+    """generate -> validate_item/repair -> run_secondary_validation -> write.
+
+    Each stage is a pool of workers on a bounded asyncio.Queue. Records are
+    held per protocol and appended together, then fsync'd, once its last
+    work unit finishes. Any record written marks its protocol id as
+    processed for load_existing_ids, so a protocol with a failed work unit
+    writes nothing and is retried on the next run, and an interrupted run
+    never leaves a protocol half written.
+    """
+
+    def __init__(self, api: RateLimitedClient, fout_ok, fout_unchecked, pbar):
+        self.api = api
+        self.pbar = pbar
+        self.gen_q: asyncio.Queue = asyncio.Queue(STAGE_QUEUE_SIZE)
+        self.check_q: asyncio.Queue = asyncio.Queue(STAGE_QUEUE_SIZE)
+        self.val_q: asyncio.Queue = asyncio.Queue(STAGE_QUEUE_SIZE)
+        self.write_q: asyncio.Queue = asyncio.Queue(STAGE_QUEUE_SIZE)
+        self.pending: Dict[Any, int] = {}   # unfinished work units per protocol id
+        self.buffers: Dict[Any, List[Tuple[str, str]]] = {}   # (kind, line) held until the protocol is done
+        self.failed: Set[Any] = set()       # protocol ids with a work unit lost to an error
+        self.files = {"passed": fout_ok, "unchecked": fout_unchecked}
+        self.stats = {"lines": 0, "skipped": 0, "items": 0, "passed": 0, "unchecked": 0,
+                      "errors": 0, "retry": 0}
+
+    # ---- per-protocol bookkeeping ----
+    def _spawn(self, rec_id: Any, n: int = 1):
+        self.pending[rec_id] = self.pending.get(rec_id, 0) + n
+
+    def _done(self, rec_id: Any):
+        self.pending[rec_id] -= 1
+        if self.pending[rec_id] == 0:
+            del self.pending[rec_id]
+            lines = self.buffers.pop(rec_id, [])
+            if rec_id in self.failed:
+                self.failed.discard(rec_id)
+                self.stats["retry"] += 1
+            else:
+                self._flush(lines)
+            self.pbar.update(1)
+
+    def _flush(self, lines: List[Tuple[str, str]]):
+        for kind, line in lines:
+            self.files[kind].write(line)
+            self.stats["items"] += 1
+            self.stats[kind] += 1
+        for kind in {kind for kind, _ in lines}:
+            _flush_and_sync(self.files[kind])
+
+    async def _worker(self, q: asyncio.Queue, handle):
+        while True:
+            job = await q.get()
+            try:
+                await handle(*job)
+            except Exception as e:
+                self.stats["errors"] += 1
+                if VERBOSE:
+                    print(f"[Error] {job[0]}: {type(e).__name__}: {e}")
+                self.failed.add(job[0])
+                self._done(job[0])
+            finally:
+                q.task_done()
+
+    # ---- stages ----
+    async def _generate(self, rec_id, type_name: str, user_prompt: str):
+        output_text = await self.api.chat(
+            model=MODEL_NAME,
+            temperature=TEMPERATURE,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt},
+            ],
+        )
+        items = extract_qa_blocks(output_text)
+        self._spawn(rec_id, len(items))
+        for it in items:
+            await self.check_q.put((rec_id, type_name, it))
+        self._done(rec_id)
+
+    async def _check(self, rec_id, type_name: str, it: Dict[str, str]):
+        ok, msg, key_steps = validate_item(it)
+        if not ok and MAX_REPAIR_TRIES > 0:
+            rep_text = await self.api.chat(
+                model=MODEL_NAME,
+                temperature=0.2,
+                messages=[
+                    {"role": "system", "content": REPAIR_PROMPT},
+                    {"role": "user", "content": build_repair_block(it)}
+                ],
+            )
+            cand = extract_qa_blocks(rep_text)
+            it = cand[0] if cand else None
+            ok = it is not None and validate_item(it)[0]
+        if ok:
+            await self.val_q.put((rec_id, type_name, it))
+        else:
+            self._done(rec_id)
+
+    async def _validate(self, rec_id, type_name: str, qa_pair: Dict[str, str]):
+        validation_report = await run_secondary_validation(self.api, qa_pair)
+        await self.write_q.put((rec_id, build_record(rec_id, type_name, qa_pair), validation_report))
+
+    async def _write(self, rec_id, record: Dict[str, Any], validation_report: Dict[str, str]):
+        if is_validation_pass(validation_report):
+            line = ("passed", json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            record_failed = dict(record)
+            err, err1 = count_validation_errors(validation_report)
+            record_failed["check_report"] = validation_report
+            record_failed["error"] = err
+            record_failed["error1"] = err1
+            line = ("unchecked", json.dumps(record_failed, ensure_ascii=False) + "\n")
+        self.buffers.setdefault(rec_id, []).append(line)
+        self._done(rec_id)
+
+    async def run(self, protocols, num_workers: int):
+        workers = [asyncio.create_task(self._worker(self.write_q, self._write))]
+        for q, handle in ((self.gen_q, self._generate), (self.check_q, self._check), (self.val_q, self._validate)):
+            workers += [asyncio.create_task(self._worker(q, handle)) for _ in range(num_workers)]
+
+        for rec_id, tasks in protocols:
+            if not tasks:
+                self.pbar.update(1)
+                continue
+            self._spawn(rec_id, len(tasks))
+            for type_name, user_prompt in tasks:
+                await self.gen_q.put((rec_id, type_name, user_prompt))
+
+        # Each stage only feeds later ones, so draining them in order drains everything
+        for q in (self.gen_q, self.check_q, self.val_q, self.write_q):
+            await q.join()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def run_pipeline(processed_ids: Set[Any]) -> Tuple[Dict[str, int], RateLimitedClient]:
+    api_key = os.getenv("OPENAI_API_KEY", OPENAI_API_KEY)
+    client = AsyncOpenAI(base_url=BASE_URL, api_key=api_key, timeout=REQUEST_TIMEOUT, max_retries=0)
+    api = RateLimitedClient(client, MAX_CONCURRENT_REQUESTS)
+
+    with open(OUTPUT_FILE, "a", encoding="utf-8") as fout_ok, \
+         open(UNCHECKED_OUTPUT_FILE, "a", encoding="utf-8") as fout_unchecked, \
+         tqdm(desc="Processing protocols") as pbar:
+        pipeline = ProtocolPipeline(api, fout_ok, fout_unchecked, pbar)
+        await pipeline.run(iter_protocol_tasks(INPUT_FILE, processed_ids, pipeline.stats),
+                           num_workers=MAX_CONCURRENT_REQUESTS)
+        _flush_and_sync(fout_ok)
+        _flush_and_sync(fout_unchecked)
+    await client.close()
+    return pipeline.stats, api
+
+
+def main():
+    os.makedirs(os.path.dirname(OUTPUT_FILE) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(UNCHECKED_OUTPUT_FILE) or ".", exist_ok=True)
+    if CLEAR_OUTPUT_ON_START:
+        open(OUTPUT_FILE, "w", encoding="utf-8").close()
+        open(UNCHECKED_OUTPUT_FILE, "w", encoding="utf-8").close()
+        reset_index(OUTPUT_FILE)
+        reset_index(UNCHECKED_OUTPUT_FILE)
+    processed_ids = load_existing_ids(OUTPUT_FILE, UNCHECKED_OUTPUT_FILE) if not CLEAR_OUTPUT_ON_START else set()
+    if VERBOSE:
+        print(f"[Resume] Already processed ids: {len(processed_ids)}")
 
-                user_prompt = USER_PROMPT_TEMPLATE_LEVEL1.format(
-                    exp_name=norm["exp_name"],
-                    abstract=norm["abstract"],
-                    materials=norm["materials"],
-                    equipment=norm["equipment"],
-                    procedure=norm["procedure"],
-                    notes=norm["notes"],
-                    type_name=type_name,
-                    type_instruction=type_instruction,
-                    num_qa=num_to_generate,
-                )
-
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    temperature=TEMPERATURE,
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                )
-                output_text = response.choices[0].message.content or ""
-                items = extract_qa_blocks(output_text)
-
-                initially_validated: List[Dict[str, str]] = []
-                for it in items:
-                    ok, msg, key_steps = validate_item(it)
-                    if ok:
-                        initially_validated.append(it)
-                    else:
-                        if MAX_REPAIR_TRIES > 0:
-                            raw_block = (
-                                f"<question>{it.get('question','')}</question>\n"
-                                f"<think>{it.get('think','')}</think>\n"
-                                f"<key>{it.get('key','')}</key>\n"
-                                f"<orc>{it.get('orc','')}</orc>\n"
-                                f"<note>{it.get('note','')}</note>"
-                            )
-                            rep = client.chat.completions.create(
-                                model=MODEL_NAME,
-                                temperature=0.2,
-                                messages=[
-                                    {"role": "system", "content": REPAIR_PROMPT},
-                                    {"role": "user", "content": raw_block}
-                                ],
-                            )
-                            rep_text = rep.choices[0].message.content or ""
-                            cand = extract_qa_blocks(rep_text)
-                            if cand:
-                                ok2, msg2, _ = validate_item(cand[0])
-                                if ok2:
-                                    initially_validated.append(cand[0])
-
-                for qa_pair in initially_validated:
-                    total_items += 1
-                    validation_report = run_secondary_validation(client, qa_pair)
-
-                    record = {
-                        "id": rec_id,
-                        "type": type_name,
-                        "question": qa_pair["question"],
-                        "think": qa_pair["think"],
-                        "key": qa_pair["key"],
-                        "orc": qa_pair["orc"],
-                        "note": qa_pair["note"],
-                        "action": extract_actions_from_key(qa_pair.get("key", "")),
-                    }
-
-                    if is_validation_pass(validation_report):
-                        fout_ok.write(json.dumps(record, ensure_ascii=False) + "\n")
-                        _flush_and_sync(fout_ok)
-                        total_passed += 1
-                    else:
-                        record_failed = dict(record)
-                        err, err1 = count_validation_errors(validation_report)
-                        record_failed["check_report"] = validation_report
-                        record_failed["error"] = err
-                        record_failed["error1"] = err1
-                        fout_unchecked.write(json.dumps(record_failed, ensure_ascii=False) + "\n")
-                        _flush_and_sync(fout_unchecked)
-                        total_unchecked += 1
-
-            processed_ids.add(rec_id) 
-            _flush_and_sync(fout_ok)
-            _flush_and_sync(fout_unchecked)
+    stats, api = asyncio.run(run_pipeline(set(processed_ids)))
 
     print("\n========== Summary ==========")
-    print(f"Input lines:                        {num_lines}")
-    print(f"Skipped by resume (seen ids):       {skipped}")
-    print(f"Generated (post-format-pass) items: {total_items}")
-    print(f"✅ Passed secondary validation:     {total_passed}")
-    print(f"❌ Failed secondary validation:     {total_unchecked}")
+    print(f"Input lines:                        {stats['lines']}")
+    print(f"Skipped by resume (seen ids):       {stats['skipped']}")
+    print(f"Generated (post-format-pass) items: {stats['items']}")
+    print(f"✅ Passed secondary validation:     {stats['passed']}")
+    print(f"❌ Failed secondary validation:     {stats['unchecked']}")
+    print(f"API retries / failed calls:         {api.retries} / {api.failures}")
+    print(f"Work units failed after errors:     {stats['errors']}")
+    print(f"Protocols left for retry on resume: {stats['retry']}")
     print(f"Saved OK to:        {OUTPUT_FILE}")
     print(f"Saved UNCHECKED to: {UNCHECKED_OUTPUT_FILE}")
 
@@ -0,0 +1,348 @@
+import os
+import mmap
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from tqdm import tqdm
+from mineru_convert import discover, iter_blocks
+
+# ================= Configurations =================
+MINERU_DIR = "../mineru_pdf"
+MANIFEST_FILE = "MinerU-Images.sqlite"
+
+NUM_WORKERS = os.cpu_count() or 1
+MAP_CHUNKSIZE = 32
+LINK_DUPLICATES = False      # replace duplicate image files with hard links to one copy
+MAX_OPEN_MAPS = 64           # memory maps kept open by ImageStore
+
+IMAGE_CAPTION_KEYS = ("image_caption", "table_caption")
+
+
+# ================= Header probing =================
+# SOF0-SOF15 carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def jpeg_header(buf) -> Optional[Tuple[int, int, int]]:
+    """(width, height, components) from the first SOF segment, walking markers only."""
+    if buf[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(buf)
+    while i + 4 <= n:
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:                       # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2                               # standalone markers have no length
+            continue
+        if marker == 0xDA:                       # start of scan without a frame header
+            return None
+        length = int.from_bytes(buf[i + 2:i + 4], "big")
+        if marker in _JPEG_SOF:
+            if i + 10 > n:
+                return None
+            height = int.from_bytes(buf[i + 5:i + 7], "big")
+            width = int.from_bytes(buf[i + 7:i + 9], "big")
+            return width, height, buf[i + 9]
+        i += 2 + length
+    return None
+
+
+def image_header(buf) -> Dict[str, Any]:
+    """Format and dimensions of an encoded image without decoding it."""
+    jpeg = jpeg_header(buf)
+    if jpeg is not None:
+        return {"format": "jpeg", "width": jpeg[0], "height": jpeg[1], "components": jpeg[2]}
+    if buf[:8] == _PNG_SIGNATURE and len(buf) >= 24:
+        return {"format": "png", "width": int.from_bytes(buf[16:20], "big"),
+                "height": int.from_bytes(buf[20:24], "big"), "components": None}
+    return {"format": None, "width": None, "height": None, "components": None}
+
+
+# ================= Workers =================
+def scan_document(job: Tuple[str, str]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Image and table blocks of one content list, with their files resolved and stat'ed."""
+    doc_id, path = job
+    base = os.path.dirname(path)
+    refs = []
+    for seq, b in enumerate(iter_blocks(path)):
+        rel = b.get("img_path")
+        if not rel:
+            continue
+        img = os.path.join(base, rel)
+        try:
+            st = os.stat(img)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        except OSError:
+            size = mtime_ns = None
+        caption = " ".join(c for key in IMAGE_CAPTION_KEYS for c in (b.get(key) or []))
+        refs.append({"seq": seq, "page_idx": b.get("page_idx"), "type": b.get("type"),
+                     "path": img, "size": size, "mtime_ns": mtime_ns, "caption": caption.strip()})
+    return doc_id, refs
+
+
+def probe_image(path: str) -> Dict[str, Any]:
+    """sha256 and header fields of one image, read through a memory map."""
+    st = os.stat(path)
+    out = {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if st.st_size == 0:
+        out.update(hash=hashlib.sha256(b"").hexdigest(), **image_header(b""))
+        return out
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        out["hash"] = hashlib.sha256(mm).hexdigest()
+        out.update(image_header(mm))
+    return out
+
+
+# ================= Manifest =================
+class ImageManifest:
+    """SQLite manifest of the images referenced by MinerU documents.
+
+    `images` holds one row per distinct content hash with the canonical file
+    that serves it; `files` maps every image file to its hash (with size and
+    mtime, so unchanged files are not re-hashed); `refs` records each block
+    that references an image. Content lists whose (size, mtime) is unchanged
+    are not re-scanned.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS images ("
+            " hash TEXT PRIMARY KEY, path TEXT NOT NULL, nbytes INTEGER NOT NULL, format TEXT,"
+            " width INTEGER, height INTEGER, components INTEGER);"
+            "CREATE TABLE IF NOT EXISTS refs ("
+            " doc_id TEXT NOT NULL, seq INTEGER NOT NULL, page_idx INTEGER, type TEXT,"
+            " path TEXT NOT NULL, hash TEXT, caption TEXT, PRIMARY KEY (doc_id, seq));"
+            "CREATE INDEX IF NOT EXISTS refs_hash ON refs(hash);"
+            "CREATE INDEX IF NOT EXISTS files_hash ON files(hash);"
+        )
+        self.conn.commit()
+
+    def doc_states(self) -> Dict[str, Tuple[int, int]]:
+        return {d: (s, m) for d, s, m in self.conn.execute("SELECT doc_id, size, mtime_ns FROM docs")}
+
+    def file_states(self) -> Dict[str, Tuple[int, int, str]]:
+        return {p: (s, m, h) for p, s, m, h in self.conn.execute(
+            "SELECT path, size, mtime_ns, hash FROM files")}
+
+    def put_doc(self, doc_id: str, size: int, mtime_ns: int, refs: List[Dict[str, Any]]) -> None:
+        self.conn.execute("DELETE FROM refs WHERE doc_id = ?", (doc_id,))
+        self.conn.executemany(
+            "INSERT INTO refs (doc_id, seq, page_idx, type, path, hash, caption) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(doc_id, r["seq"], r["page_idx"], r["type"], r["path"], r.get("hash"), r["caption"]) for r in refs],
+        )
+        self.conn.execute("INSERT OR REPLACE INTO docs (doc_id, size, mtime_ns) VALUES (?, ?, ?)",
+                          (doc_id, size, mtime_ns))
+
+    def put_file(self, probe: Dict[str, Any]) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                          (probe["path"], probe["size"], probe["mtime_ns"], probe["hash"]))
+        # The first file seen with a hash stays canonical
+        self.conn.execute(
+            "INSERT OR IGNORE INTO images (hash, path, nbytes, format, width, height, components)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (probe["hash"], probe["path"], probe["size"], probe["format"],
+             probe["width"], probe["height"], probe["components"]),
+        )
+
+    def ref_paths(self) -> List[str]:
+        return [p for (p,) in self.conn.execute("SELECT DISTINCT path FROM refs")]
+
+    def set_file_hash(self, path: str, image_hash: Optional[str]) -> None:
+        """Point every reference to `path` at its current hash (None once the file is gone)."""
+        if image_hash is None:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.conn.execute("UPDATE refs SET hash = ? WHERE path = ?", (image_hash, path))
+
+    def drop_missing_docs(self, keep: List[str]) -> int:
+        gone = set(self.doc_states()) - set(keep)
+        for doc_id in gone:
+            self.conn.execute("DELETE FROM refs WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+        return len(gone)
+
+    def prune(self) -> None:
+        """Forget unreferenced files; re-point or drop images whose canonical file is gone or changed."""
+        self.conn.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM refs)")
+        self.conn.execute("DELETE FROM images WHERE hash NOT IN (SELECT hash FROM files)")
+        self.conn.execute(
+            "UPDATE images SET path = (SELECT MIN(path) FROM files WHERE files.hash = images.hash)"
+            " WHERE NOT EXISTS (SELECT 1 FROM files WHERE files.path = images.path AND files.hash = images.hash)"
+        )
+
+    def link_duplicates(self) -> Tuple[int, int]:
+        """Hard-link every duplicate file to its canonical copy; (files linked, bytes freed)."""
+        linked = freed = 0
+        rows = self.conn.execute(
+            "SELECT files.path, images.path, images.nbytes FROM files JOIN images USING (hash)"
+            " WHERE files.path != images.path"
+        ).fetchall()
+        for dup, canonical, nbytes in rows:
+            try:
+                if os.path.samefile(dup, canonical):
+                    continue
+                tmp = dup + ".link"
+                os.link(canonical, tmp)
+                os.replace(tmp, dup)
+            except OSError as e:
+                print(f"⚠️ Could not link {dup}: {e}")
+                continue
+            st = os.stat(dup)
+            self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                              (st.st_size, st.st_mtime_ns, dup))
+            linked += 1
+            freed += nbytes
+        return linked, freed
+
+    def stats(self) -> Dict[str, int]:
+        q = lambda sql: self.conn.execute(sql).fetchone()[0]
+        return {
+            "refs": q("SELECT COUNT(*) FROM refs"),
+            "missing": q("SELECT COUNT(*) FROM refs WHERE hash IS NULL"),
+            "files": q("SELECT COUNT(*) FROM files"),
+            "unique": q("SELECT COUNT(*) FROM images"),
+            "bytes_total": q("SELECT COALESCE(SUM(size), 0) FROM files"),
+            "bytes_unique": q("SELECT COALESCE(SUM(nbytes), 0) FROM images"),
+        }
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+# ================= Lazy accessor =================
+class ImageStore:
+    """Read-side view of a manifest: metadata from SQLite, bytes via on-demand memory maps.
+
+    open() maps the canonical file of a hash read-only and keeps the most
+    recent `max_open` maps; evicted maps are only dereferenced, so a caller
+    still holding one can keep using it. A map is file-like, e.g.
+    PIL.Image.open(store.open(h)).
+    """
+
+    def __init__(self, path: str = MANIFEST_FILE, max_open: int = MAX_OPEN_MAPS):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.max_open = max_open
+        self.maps: "OrderedDict[str, Any]" = OrderedDict()
+
+    def info(self, image_hash: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM images WHERE hash = ?", (image_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def doc_images(self, doc_id: str) -> List[Dict[str, Any]]:
+        """References of one document in block order, joined with their image metadata."""
+        rows = self.conn.execute(
+            "SELECT refs.seq, refs.page_idx, refs.type, refs.caption, refs.hash,"
+            " images.width, images.height, images.format, images.nbytes"
+            " FROM refs LEFT JOIN images USING (hash) WHERE refs.doc_id = ? ORDER BY refs.seq",
+            (doc_id,),
+        )
+        return [dict(r) for r in rows]
+
+    def open(self, image_hash: str):
+        mm = self.maps.get(image_hash)
+        if mm is not None:
+            self.maps.move_to_end(image_hash)
+            return mm
+        meta = self.info(image_hash)
+        if meta is None:
+            raise KeyError(image_hash)
+        if meta["nbytes"] == 0:
+            return b""
+        with open(meta["path"], "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[image_hash] = mm
+        if len(self.maps) > self.max_open:
+            self.maps.popitem(last=False)
+        return mm
+
+    def close(self) -> None:
+        self.maps.clear()
+        self.conn.close()
+
+
+# ================= Main =================
+def main():
+    t0 = time.time()
+    docs = discover(MINERU_DIR)
+    manifest = ImageManifest(MANIFEST_FILE)
+    known_docs = manifest.doc_states()
+    known_files = manifest.file_states()
+
+    todo = []
+    for doc_id, path in docs:
+        st = os.stat(path)
+        if known_docs.get(doc_id) != (st.st_size, st.st_mtime_ns):
+            todo.append((doc_id, path, st.st_size, st.st_mtime_ns))
+    print(f"{len(docs)} documents: {len(docs) - len(todo)} unchanged, {len(todo)} to scan")
+    removed = manifest.drop_missing_docs([d for d, _ in docs])
+
+    # Images can be rewritten in place, so files of unchanged documents are re-stat'ed as well
+    current: Dict[str, Optional[Tuple[int, int]]] = {}
+    for path in manifest.ref_paths():
+        try:
+            st = os.stat(path)
+            current[path] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            current[path] = None
+
+    with ProcessPoolExecutor(max_workers=max(1, NUM_WORKERS)) as pool:
+        scanned = list(tqdm(pool.map(scan_document, [(d, p) for d, p, _, _ in todo], chunksize=MAP_CHUNKSIZE),
+                            total=len(todo), desc="Scanning", unit="doc"))
+        for _, refs in scanned:
+            for r in refs:
+                current[r["path"]] = None if r["size"] is None else (r["size"], r["mtime_ns"])
+
+        # Only files that are new or whose (size, mtime) moved are hashed
+        to_probe = sorted(p for p, st in current.items()
+                          if st is not None and known_files.get(p, (None, None))[:2] != st)
+        hashes = {p: v[2] for p, v in known_files.items() if current.get(p) is not None}
+        for probe in tqdm(pool.map(probe_image, to_probe, chunksize=MAP_CHUNKSIZE),
+                          total=len(to_probe), desc="Probing", unit="img"):
+            manifest.put_file(probe)
+            hashes[probe["path"]] = probe["hash"]
+
+    for (doc_id, _, size, mtime_ns), (_, refs) in zip(todo, scanned):
+        for r in refs:
+            r["hash"] = hashes.get(r["path"])
+        manifest.put_doc(doc_id, size, mtime_ns, refs)
+    # References of unchanged documents follow files that were rewritten or removed
+    for path in to_probe:
+        manifest.set_file_hash(path, hashes[path])
+    for path in known_files:
+        if current.get(path) is None:
+            manifest.set_file_hash(path, None)
+    manifest.prune()
+    manifest.commit()
+
+    if LINK_DUPLICATES:
+        linked, freed = manifest.link_duplicates()
+        print(f"Linked {linked} duplicate files ({freed / 1e6:.1f} MB freed)")
+    s = manifest.stats()
+    manifest.close()
+
+    print(f"{s['refs']} image references ({s['missing']} missing files), {s['files']} files, "
+          f"{s['unique']} unique images; {s['bytes_total'] / 1e6:.1f} MB on disk, "
+          f"{s['bytes_unique'] / 1e6:.1f} MB unique; dropped {removed} documents in {time.time() - t0:.1f}s")
+    print(f"Saved to: {MANIFEST_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from tqdm import tqdm
+
+# ================= Configurations =================
+MINERU_DIR = "../mineru_pdf"                    # searched recursively for *_content_list.json
+OUTPUT_FILE = "MinerU-Protocols.jsonl"
+CACHE_FILE = "MinerU-Protocols.cache.sqlite"    # per-document records, digests and block index
+
+NUM_WORKERS = os.cpu_count() or 1
+MAP_CHUNKSIZE = 8
+COMMIT_EVERY = 256                              # cache commits, in converted documents
+READ_CHUNK_SIZE = 1 << 16
+
+# Bump when the segmentation below changes, so cached records are rebuilt
+CONVERTER_VERSION = 1
+CONTENT_LIST_SUFFIX = "_content_list.json"
+
+# ================= Sections =================
+# MinerU marks every heading as text_level 1, so the section a heading opens
+# is decided by its text. Headings not listed here (lettered sub-headings,
+# list items misdetected as headings) stay in the current section as text.
+SECTION_FIELDS = {
+    "abstract": "abstract",
+    "materials and reagents": "materials",
+    "materials": "materials",
+    "reagents": "materials",
+    "equipment": "equipments",
+    "equipments": "equipments",
+    "procedure": "procedures",
+    "procedures": "procedures",
+    "notes": "notes",
+}
+SKIPPED_SECTIONS = {
+    "graphic abstract", "background", "keywords", "software", "data analysis",
+    "recipes", "acknowledgments", "acknowledgements", "competing interests",
+    "ethics", "references",
+}
+ABSTRACT_TAG = re.compile(r"^\[\s*abstract\s*\]\s*", re.I)
+
+# "A. " section, "12. " step, "b. " sub-step
+OUTLINE_MARKER = re.compile(r"([A-Z]|\d{1,3}|[a-z])\.\s+")
+
+
+def _section_key(heading: str) -> str:
+    return re.sub(r"\s+", " ", heading).strip().rstrip(":").strip().lower()
+
+
+# ================= Streaming reader =================
+def iter_blocks(path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Stream the blocks of a MinerU content list (a JSON array) without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        while buf and not buf.strip():
+            buf = f.read(chunk_size)
+        buf = buf.lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array of blocks")
+
+        buf, pos, eof = buf[1:], 0, False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield obj
+            pos = end
+
+
+# ================= Segmentation =================
+def segment_blocks(blocks: List[Dict[str, Any]]) -> Tuple[str, Dict[str, List[str]]]:
+    """(title, field -> text lines) by walking the headings of a content list."""
+    title = ""
+    fields: Dict[str, List[str]] = {f: [] for f in set(SECTION_FIELDS.values())}
+    field: Optional[str] = "preamble"
+    for b in blocks:
+        if b.get("type") != "text":
+            continue
+        text = (b.get("text") or "").strip()
+        if not text:
+            continue
+        if b.get("text_level"):
+            if not title:
+                title = text
+                continue
+            key = _section_key(text)
+            if key in SECTION_FIELDS:
+                field = SECTION_FIELDS[key]
+                continue
+            if key in SKIPPED_SECTIONS:
+                field = None
+                continue
+        if field == "preamble":
+            # Before the first section only the tagged abstract is kept
+            if ABSTRACT_TAG.match(text):
+                fields["abstract"].append(ABSTRACT_TAG.sub("", text))
+            continue
+        if field is not None:
+            fields[field].extend(ln.strip() for ln in text.split("\n") if ln.strip())
+    return title, fields
+
+
+# Outline state: stack of [style, marker] of the open levels, outermost first.
+# Styles are "upper" (A.), "digit" (1.) and "lower" (a.); the order they nest
+# in varies between protocols, so each document's own order is followed.
+_Outline = Tuple[Tuple[str, str], ...]
+_FIRST_MARKER = {"upper": "A", "digit": "1", "lower": "a"}
+
+
+def _marker_style(marker: str) -> str:
+    if marker.isdigit():
+        return "digit"
+    return "upper" if marker.isupper() else "lower"
+
+
+def _successor(marker: str) -> str:
+    return str(int(marker) + 1) if marker.isdigit() else chr(ord(marker) + 1)
+
+
+def _advance(state: _Outline, style: str, marker: str) -> _Outline:
+    """Outline after an item; an unseen style opens a level (upper always restarts at the top)."""
+    if style == "text":
+        return state
+    for depth, (s, _) in enumerate(state):
+        if s == style:
+            return state[:depth] + ((style, marker),)
+    if style == "upper":
+        return ((style, marker),)
+    return state + ((style, marker),)
+
+
+def _continues(state: _Outline, style: str, marker: str) -> bool:
+    for s, m in state:
+        if s == style:
+            return marker == _successor(m)
+    return marker == _FIRST_MARKER[style]
+
+
+def split_outline(lines: List[str]) -> List[Tuple[str, str, str]]:
+    """(style, marker, text) items of numbered lines; unmarked lines have style "text".
+
+    PDF extraction often fuses several items into one line ("B. Title 1. First
+    step", "... DNase I. 2. Aliquot ..."). A marker inside a line only starts
+    a new item when it follows a sentence end (or is the first item after a
+    lettered heading) and continues the numbering in progress.
+    """
+    items: List[Tuple[str, str, str]] = []
+    state: _Outline = ()
+    for line in lines:
+        m = OUTLINE_MARKER.match(line)
+        style, marker, pos = ("text", "", 0) if m is None else (_marker_style(m.group(1)), m.group(1), m.end())
+        while True:
+            pending = _advance(state, style, marker)
+            cut = None
+            for c in OUTLINE_MARKER.finditer(line, pos):
+                i = c.start()
+                if i == 0 or not line[i - 1].isspace():
+                    continue
+                c_style, c_marker = _marker_style(c.group(1)), c.group(1)
+                after_heading = style == "upper" and c_marker == _FIRST_MARKER[c_style]
+                if not (line[:i].rstrip().endswith((".", ":", ";", ")")) or after_heading):
+                    continue
+                if _continues(pending, c_style, c_marker):
+                    cut = c
+                    break
+            end = len(line) if cut is None else cut.start()
+            items.append((style, marker, line[pos:end].strip()))
+            state = pending
+            if cut is None:
+                break
+            style, marker, pos = _marker_style(cut.group(1)), cut.group(1), cut.end()
+    return items
+
+
+def build_hierarchy(items: List[Tuple[str, str, str]]) -> Dict[str, Any]:
+    """Dotted-key outline of split_outline items: {"1": {"title": ...}, "1.1": "step", ...}.
+
+    Keys are renumbered in order of appearance, so steps lost at page breaks
+    leave no gaps. Lettered headings and items with children become
+    {"title": text}; leaves are their text. Unmarked text continues the
+    step before it; text right under a heading (an introduction) is left
+    to the flat `procedures` field.
+    """
+    nodes: Dict[str, List[Any]] = {}      # key -> [text, is_heading]
+    keys: List[str] = []                   # open keys, one per outline level
+    children: Dict[str, int] = {}          # key -> number of children so far
+    state: _Outline = ()
+    for style, marker, text in items:
+        if style == "text":
+            if keys and not nodes[keys[-1]][1]:
+                nodes[keys[-1]][0] = f"{nodes[keys[-1]][0]} {text}".strip()
+            continue
+        state = _advance(state, style, marker)
+        depth = len(state) - 1
+        parent = keys[depth - 1] if depth else ""
+        children[parent] = children.get(parent, 0) + 1
+        key = f"{parent}.{children[parent]}" if parent else str(children[parent])
+        nodes[key] = [text, style == "upper"]
+        if parent:
+            nodes[parent][1] = True
+        keys = keys[:depth] + [key]
+    return {k: {"title": text} if is_heading else text for k, (text, is_heading) in nodes.items()}
+
+
+def render_outline(items: List[Tuple[str, str, str]]) -> str:
+    return "\n".join(f"{marker}. {text}" if marker else text for _, marker, text in items)
+
+
+def build_record(doc_id: str, blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Problem-Solving / Protocol-Comprehension style record of one MinerU document."""
+    title, fields = segment_blocks(blocks)
+    items = split_outline(fields["procedures"])
+    return {
+        "id": doc_id,
+        "exp_name": title,
+        "abstract": " ".join(fields["abstract"]),
+        "materials": render_outline(split_outline(fields["materials"])),
+        "equipments": render_outline(split_outline(fields["equipments"])),
+        "procedures": render_outline(items),
+        "notes": "\n".join(fields["notes"]) or "None",
+        "hierarchical_protocol": build_hierarchy(items),
+    }
+
+
+# ================= Worker =================
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def convert_file(job: Tuple[str, str, Optional[str]]) -> Dict[str, Any]:
+    """Convert one content list; skip parsing when its digest matches `known_digest`."""
+    doc_id, path, known_digest = job
+    digest = file_digest(path)
+    st = os.stat(path)
+    out = {"doc_id": doc_id, "path": path, "digest": digest,
+           "size": st.st_size, "mtime_ns": st.st_mtime_ns, "record": None, "blocks": None}
+    if digest == known_digest:
+        return out
+    blocks = list(iter_blocks(path))
+    out["record"] = build_record(doc_id, blocks)
+    out["blocks"] = [
+        (i, b.get("page_idx"), b.get("type"), b.get("text"), b.get("text_level"))
+        for i, b in enumerate(blocks)
+    ]
+    return out
+
+
+def discover(root: str) -> List[Tuple[str, str]]:
+    """(doc_id, path) of every content list under `root`, in a stable order."""
+    found: Dict[str, str] = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.endswith(CONTENT_LIST_SUFFIX):
+                continue
+            doc_id = name[:-len(CONTENT_LIST_SUFFIX)]
+            path = os.path.join(dirpath, name)
+            if doc_id in found:
+                print(f"⚠️ Duplicate document id {doc_id!r}: keeping {found[doc_id]}, skipping {path}")
+                continue
+            found[doc_id] = path
+    return sorted(found.items())
+
+
+# ================= Cache =================
+class ConversionCache:
+    """SQLite store of converted records keyed by document id.
+
+    A document is reused when its (size, mtime) is unchanged, or when its
+    content hash still matches after a touch; CONVERTER_VERSION changes
+    invalidate everything. The `blocks` table keeps every block of each
+    document keyed by (doc_id, page_idx), so pages and sections can be
+    queried later without re-reading the MinerU JSON.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, version INTEGER NOT NULL,"
+            " record TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            " doc_id TEXT NOT NULL, seq INTEGER NOT NULL, page_idx INTEGER, type TEXT,"
+            " text TEXT, text_level INTEGER, PRIMARY KEY (doc_id, seq));"
+            "CREATE INDEX IF NOT EXISTS blocks_page ON blocks(doc_id, page_idx);"
+        )
+        self.conn.commit()
+
+    def states(self) -> Dict[str, Tuple[str, int, int, str, int]]:
+        return {row[0]: row[1:] for row in self.conn.execute(
+            "SELECT doc_id, path, size, mtime_ns, digest, version FROM docs")}
+
+    def record_json(self, doc_id: str) -> str:
+        return self.conn.execute("SELECT record FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+
+    def touch(self, res: Dict[str, Any]) -> None:
+        self.conn.execute("UPDATE docs SET path = ?, size = ?, mtime_ns = ? WHERE doc_id = ?",
+                          (res["path"], res["size"], res["mtime_ns"], res["doc_id"]))
+
+    def put(self, res: Dict[str, Any], record_json: str) -> None:
+        doc_id = res["doc_id"]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO docs (doc_id, path, size, mtime_ns, digest, version, record)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (doc_id, res["path"], res["size"], res["mtime_ns"], res["digest"], CONVERTER_VERSION, record_json),
+        )
+        self.conn.execute("DELETE FROM blocks WHERE doc_id = ?", (doc_id,))
+        self.conn.executemany(
+            "INSERT INTO blocks (doc_id, seq, page_idx, type, text, text_level) VALUES (?, ?, ?, ?, ?, ?)",
+            [(doc_id,) + b for b in res["blocks"]],
+        )
+
+    def drop_missing(self, keep: List[str]) -> int:
+        gone = set(self.states()) - set(keep)
+        for doc_id in gone:
+            self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM blocks WHERE doc_id = ?", (doc_id,))
+        return len(gone)
+
+    def page_blocks(self, doc_id: str, page_idx: int) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT seq, type, text, text_level FROM blocks WHERE doc_id = ? AND page_idx = ? ORDER BY seq",
+            (doc_id, page_idx),
+        )
+        return [{"seq": s, "type": t, "text": x, "text_level": lv, "page_idx": page_idx} for s, t, x, lv in rows]
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+# ================= Main =================
+def main():
+    t0 = time.time()
+    docs = discover(MINERU_DIR)
+    cache = ConversionCache(CACHE_FILE)
+    known = cache.states()
+
+    # Unchanged (size, mtime) → reuse without reading; otherwise a worker hashes
+    # the file and only parses it when the hash differs from the cached one
+    jobs, reuse = [], set()
+    for doc_id, path in docs:
+        st = os.stat(path)
+        prev = known.get(doc_id)
+        if prev and prev[4] == CONVERTER_VERSION and prev[1:3] == (st.st_size, st.st_mtime_ns):
+            reuse.add(doc_id)
+        else:
+            valid = prev is not None and prev[4] == CONVERTER_VERSION
+            jobs.append((doc_id, path, prev[3] if valid else None))
+    print(f"{len(docs)} documents: {len(reuse)} cached, {len(jobs)} to check")
+
+    converted = rehashed = 0
+    tmp_path = OUTPUT_FILE + ".tmp"
+    os.makedirs(os.path.dirname(OUTPUT_FILE) or ".", exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, NUM_WORKERS)) as pool, \
+            open(tmp_path, "w", encoding="utf-8") as out:
+        results = pool.map(convert_file, jobs, chunksize=MAP_CHUNKSIZE)
+        # Records are written in document order as they become available
+        for doc_id, _ in tqdm(docs, desc="Converting", unit="doc"):
+            if doc_id in reuse:
+                out.write(cache.record_json(doc_id) + "\n")
+                continue
+            res = next(results)
+            if res["record"] is None:
+                cache.touch(res)
+                rehashed += 1
+                line = cache.record_json(doc_id)
+            else:
+                line = json.dumps(res["record"], ensure_ascii=False)
+                cache.put(res, line)
+                converted += 1
+                if converted % COMMIT_EVERY == 0:
+                    cache.commit()
+            out.write(line + "\n")
+    os.replace(tmp_path, OUTPUT_FILE)
+    removed = cache.drop_missing([d for d, _ in docs])
+    cache.close()
+
+    print(f"Converted {converted}, unchanged {len(reuse) + rehashed} "
+          f"({rehashed} re-hashed), dropped {removed} in {time.time() - t0:.1f}s")
+    print(f"Saved to: {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
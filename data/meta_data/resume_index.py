@@ -0,0 +1,118 @@
+import os
+import json
+from typing import Any, List, Optional, Set, Tuple
+
+# ================= Resume sidecar index =================
+# <output>.ids holds one JSON line [start, end, id] per complete line of
+# <output> that has been indexed (id is null for lines without one). The
+# last entry doubles as the checkpoint: on load it is verified against the
+# output, and only bytes after its `end` are parsed.
+INDEX_SUFFIX = ".ids"
+
+
+def _parse_entries_slow(data: bytes) -> Tuple[List[Tuple[int, int, Any]], int]:
+    entries: List[Tuple[int, int, Any]] = []
+    good = 0
+    for raw in data.splitlines(keepends=True):
+        try:
+            start, end, rid = json.loads(raw)
+        except Exception:
+            break
+        if entries and start != entries[-1][1]:
+            break
+        entries.append((start, end, rid))
+        good += len(raw)
+    return entries, good
+
+
+def _read_entries(idx_path: str) -> Tuple[List[Tuple[int, int, Any]], int]:
+    """Valid sidecar entries and the byte length they span (a torn tail is dropped)."""
+    if not os.path.exists(idx_path):
+        return [], 0
+    with open(idx_path, "rb") as f:
+        data = f.read()
+    data = data[:data.rfind(b"\n") + 1]     # only newline-terminated entries count
+    if not data:
+        return [], 0
+    # Fast path: the whole sidecar as one JSON array; fall back line by line if damaged
+    try:
+        entries = [tuple(e) for e in json.loads(b"[" + data[:-1].replace(b"\n", b",") + b"]")]
+    except Exception:
+        return _parse_entries_slow(data)
+    if any(len(e) != 3 for e in entries) or any(
+            entries[i][0] != entries[i - 1][1] for i in range(1, len(entries))):
+        return _parse_entries_slow(data)
+    return entries, len(data)
+
+
+def _line_id(raw: bytes) -> Optional[Any]:
+    """Same rule as load_existing_ids: the "id" of a parseable non-empty line."""
+    line = raw.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line).get("id")
+    except Exception:
+        return None
+
+
+def _checkpoint_valid(f, size: int, entries: List[Tuple[int, int, Any]]) -> bool:
+    if not entries:
+        return True
+    start, end, rid = entries[-1]
+    if end > size:
+        return False                 # output truncated or replaced
+    f.seek(start)
+    raw = f.read(end - start)
+    return raw.endswith(b"\n") and _line_id(raw) == rid
+
+
+def load_ids(path: str) -> Set[Any]:
+    """Processed ids of one JSONL output, equal to a full rescan, parsing only unindexed bytes.
+
+    Complete new lines are appended to the sidecar. A final line without a
+    newline (a write cut short) is read but not indexed, so it is parsed
+    again next time and indexed once it is complete.
+    """
+    processed: Set[Any] = set()
+    if not path or not os.path.exists(path):
+        return processed
+
+    idx_path = path + INDEX_SUFFIX
+    entries, good = _read_entries(idx_path)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if not _checkpoint_valid(f, size, entries):
+            entries, good = [], 0
+        offset = entries[-1][1] if entries else 0
+        processed.update(rid for _, _, rid in entries if rid is not None)
+
+        new_lines = []
+        f.seek(offset)
+        for raw in f:
+            rid = _line_id(raw)
+            if rid is not None:
+                processed.add(rid)
+            if not raw.endswith(b"\n"):
+                break
+            new_lines.append(json.dumps([offset, offset + len(raw), rid], ensure_ascii=False) + "\n")
+            offset += len(raw)
+
+    with open(idx_path, "ab") as g:
+        g.truncate(good)             # drop a torn tail or a stale index
+        g.write("".join(new_lines).encode("utf-8"))
+    return processed
+
+
+def reset_index(path: str) -> None:
+    """Drop the sidecar of an output that is being cleared."""
+    idx_path = path + INDEX_SUFFIX
+    if os.path.exists(idx_path):
+        os.remove(idx_path)
+
+
+def load_existing_ids(*paths: str) -> Set[Any]:
+    processed: Set[Any] = set()
+    for p in paths:
+        processed |= load_ids(p)
+    return processed
@@ -5,8 +5,11 @@ from typing import List, Dict, Any, Tuple
 from tqdm import tqdm
 
 import torch
+import numpy as np
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from batch_infer import batch_generate, batch_next_token_logprobs, candidate_token_ids, iter_batch_generate
+
 # ============================================
 # Basic configuration
 # ============================================
@@ -24,6 +27,15 @@ TOP_P = 1.0
 DO_SAMPLE = False
 ENABLE_THINKING = False
 
+# Batched generation: left-padded batches bucketed by prompt length
+BATCH_SIZE = 64
+MAX_BATCH_TOKENS = 64 * 1024   # padded prompt tokens per batch
+
+# "generate": decode and parse the answer; "logits": one prefill per sample,
+# predicting whichever of "True"/"False" has the higher next-token log-prob
+SCORING_MODE = "generate"
+ANSWER_PREFIX = "[ANSWER_START]"   # assistant text forced before the scored token
+
 
 # ============================================
 # Dataset & Prompt Handling
@@ -60,29 +72,39 @@ def build_prompt(question: str) -> str:
 # ============================================
 # Inference
 # ============================================
+def _gen_cfg() -> Dict[str, Any]:
+    return {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "do_sample": DO_SAMPLE,
+    }
+
+
+def iter_inference_batches(model, tokenizer, prompts: List[str], desc="Generating"):
+    """Yield [(prompt index, response), ...] as each length-bucketed batch finishes."""
+    return iter_batch_generate(model, tokenizer, prompts, _gen_cfg(), ENABLE_THINKING,
+                               BATCH_SIZE, MAX_BATCH_TOKENS, desc=desc)
+
+
+def run_inference_batch(model, tokenizer, prompts: List[str], desc="Generating") -> List[str]:
+    """Greedy responses for many prompts (left-padded, length-bucketed batches)."""
+    return batch_generate(model, tokenizer, prompts, _gen_cfg(), ENABLE_THINKING,
+                          BATCH_SIZE, MAX_BATCH_TOKENS, desc=desc)
+
+
 def run_inference(model, tokenizer, prompt: str) -> str:
-    messages = [{"role": "user", "content": prompt}]
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        enable_thinking=ENABLE_THINKING,
-    )
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    return run_inference_batch(model, tokenizer, [prompt], desc=None)[0]
 
-    with torch.no_grad():
-        gen_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            do_sample=DO_SAMPLE,
-        )
 
-    gen_ids = [out[len(inp):] for inp, out in zip(model_inputs.input_ids, gen_ids)]
-    response = tokenizer.batch_decode(gen_ids, skip_special_tokens=True)[0]
-    print(f"####{response}")
-    return response.strip()
+def run_logit_scoring(model, tokenizer, prompts: List[str]) -> List[Tuple[bool, float]]:
+    """(prediction, softmax confidence over the two candidates) per prompt."""
+    cand_ids = candidate_token_ids(tokenizer, ["True", "False"])
+    logprobs = batch_next_token_logprobs(model, tokenizer, prompts, cand_ids, ENABLE_THINKING,
+                                         BATCH_SIZE, MAX_BATCH_TOKENS, answer_prefix=ANSWER_PREFIX)
+    probs = np.exp(logprobs - logprobs.max(axis=1, keepdims=True))
+    probs /= probs.sum(axis=1, keepdims=True)
+    return [(bool(p[0] >= p[1]), float(p.max())) for p in probs]
 
 
 # ============================================
@@ -119,14 +141,18 @@ def extract_binary_answer(generated_str):
 # ============================================
 # Evaluation
 # ============================================
+def _iter_records(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
 def evaluate_correction_task(output_file_path):
     preds, gts = [], []
     failed, total = 0, 0
 
-    with open(output_file_path, 'r', encoding="utf-8") as f:
-        data = json.load(f)
-
-    for item in tqdm(data, desc="Evaluating"):
+    for item in tqdm(_iter_records(output_file_path), desc="Evaluating"):
         if isinstance(item, dict) and "metrics" in item:
             continue
 
@@ -157,6 +183,45 @@ def compute_classification_metrics(preds, gts):
     return {"accuracy": accuracy, "precision": precision, "recall": recall, "f1": f1}
 
 
+# Running totals, updated as records are written
+def empty_cls_stats() -> Dict[str, int]:
+    return {"total": 0, "failed": 0, "evaluated": 0, "correct": 0, "tp": 0, "fp": 0, "fn": 0}
+
+
+def update_cls_stats(stats: Dict[str, int], generated_response: str, gt) -> None:
+    stats["total"] += 1
+    try:
+        p = extract_binary_answer(generated_response)
+    except Exception:
+        stats["failed"] += 1
+        return
+    stats["evaluated"] += 1
+    stats["correct"] += int(p == gt)
+    stats["tp"] += int(p is False and gt is False)
+    stats["fp"] += int(p is False and gt is True)
+    stats["fn"] += int(p is True and gt is False)
+
+
+def cls_metrics_from_stats(stats: Dict[str, int]) -> Dict[str, Any]:
+    """Same definitions as compute_classification_metrics, from running counts."""
+    TP, FP, FN = stats["tp"], stats["fp"], stats["fn"]
+    accuracy = stats["correct"] / stats["evaluated"] if stats["evaluated"] else 0
+    precision = TP / (TP + FP) if (TP + FP) > 0 else 0
+    recall = TP / (TP + FN) if (TP + FN) > 0 else 0
+    f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+    total = stats["total"]
+    return {
+        "total": total,
+        "evaluated": stats["evaluated"],
+        "failed": stats["failed"],
+        "failure_rate": (stats["failed"] / total) if total else 0.0,
+        "accuracy": accuracy,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+    }
+
+
 # ============================================
 # Main procedure
 # ============================================
@@ -171,67 +236,52 @@ def main():
         device_map="auto",
     )
 
-    outputs = []
-
-    for idx, sample in enumerate(tqdm(dataset, desc="Generating")):
-        question = get_question(sample)
-        gold_str = get_gold_str(sample)
-
-        try:
-            is_correct = gold_to_bool(gold_str)
-        except Exception:
-            is_correct = None
-
-        prompt = build_prompt(question)
-        gen_text = run_inference(model, tokenizer, prompt)
-
-        outputs.append({
-            "index": idx,
-            "question": question,
-            "gold_raw": gold_str,
-            "is_correct": is_correct,
-            "generated_response": gen_text
-        })
-
-    with open(OUTPUT_JSONL_PATH, "w", encoding="utf-8") as f:
-        json.dump(outputs, f, ensure_ascii=False, indent=2)
-
-    preds, gts, failed, total = evaluate_correction_task(OUTPUT_JSONL_PATH)
-    metrics = compute_classification_metrics(preds, gts)
-    failed_rate = (failed / total) if total else 0.0
+    prompts = [build_prompt(get_question(sample)) for sample in dataset]
+    scored = None
+    if SCORING_MODE == "logits":
+        scored = run_logit_scoring(model, tokenizer, prompts)
+        batches = [[(i, "True" if pred else "False") for i, (pred, _) in enumerate(scored)]]
+    else:
+        batches = iter_inference_batches(model, tokenizer, prompts)
+
+    stats = empty_cls_stats()
+    with open(OUTPUT_JSONL_PATH, "w", encoding="utf-8") as fout:
+        for done in batches:
+            for idx, gen_text in done:
+                sample = dataset[idx]
+                question = get_question(sample)
+                gold_str = get_gold_str(sample)
+
+                try:
+                    is_correct = gold_to_bool(gold_str)
+                except Exception:
+                    is_correct = None
+
+                rec = {
+                    "index": idx,
+                    "question": question,
+                    "gold_raw": gold_str,
+                    "is_correct": is_correct,
+                    "generated_response": gen_text
+                }
+                if scored is not None:
+                    rec["confidence"] = scored[idx][1]
+                fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                update_cls_stats(stats, gen_text, is_correct)
+            fout.flush()
+
+        metrics = cls_metrics_from_stats(stats)
+        fout.write(json.dumps({"metrics": metrics}, ensure_ascii=False) + "\n")
 
     print("\n=== Final Correction Evaluation ===")
     print(f"Accuracy      : {metrics['accuracy']:.4f}")
     print(f"Precision     : {metrics['precision']:.4f}")
     print(f"Recall        : {metrics['recall']:.4f}")
     print(f"F1 Score      : {metrics['f1']:.4f}")
-    print(f"Failed Parses : {failed}/{total} ({failed_rate*100:.2f}%)")
-    print(f"Total Samples : {total}")
+    print(f"Failed Parses : {metrics['failed']}/{metrics['total']} ({metrics['failure_rate']*100:.2f}%)")
+    print(f"Total Samples : {metrics['total']}")
     print("----------------------")
 
-    summary = {
-        "metrics": {
-            "total": total,
-            "evaluated": len(preds),
-            "failed": failed,
-            "failure_rate": failed_rate,
-            "accuracy": metrics["accuracy"],
-            "precision": metrics["precision"],
-            "recall": metrics["recall"],
-            "f1": metrics["f1"],
-        }
-    }
-
-    try:
-        with open(OUTPUT_JSONL_PATH, "r", encoding="utf-8") as f:
-            arr = json.load(f)
-        arr.append(summary)
-        with open(OUTPUT_JSONL_PATH, "w", encoding="utf-8") as f:
-            json.dump(arr, f, ensure_ascii=False, indent=2)
-    except Exception:
-        with open(OUTPUT_JSONL_PATH + ".metrics.json", "w", encoding="utf-8") as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
-
 
 if __name__ == "__main__":
     main()
@@ -2,13 +2,17 @@ import os
 import re
 import ast
 import json
-from typing import List, Dict, Any, Tuple
-from itertools import combinations
+from typing import List, Dict, Any, Optional, Tuple
 from tqdm import tqdm
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from batch_infer import batch_generate, iter_batch_generate
+from gen_backend import eos_token_ids
+from perm_grammar import PermutationLogitsProcessor, PermutationVocab, max_permutation_tokens
+from rank_corr import kendall_pair_counts, kendall_pair_counts_batch
+
 # ============================================
 # Basic configuration
 # ============================================
@@ -26,6 +30,14 @@ TOP_P = 1.0
 DO_SAMPLE = False
 ENABLE_THINKING = False
 
+# Batched generation: left-padded batches bucketed by prompt length
+BATCH_SIZE = 64
+MAX_BATCH_TOKENS = 64 * 1024   # padded prompt tokens per batch
+
+# Grammar-constrained decoding: only a permutation "[i1, ..., in]" of 1..n
+# can be emitted, and max_new_tokens is bounded by n instead of MAX_NEW_TOKENS
+CONSTRAINED_DECODING = False
+
 # Enforce 1-based strictness
 STRICT_ONE_BASED = True
 
@@ -78,30 +90,52 @@ def build_prompt(question: str, n_steps: int) -> str:
     return question + suffix
 
 
-def run_inference(model, tokenizer, prompt: str) -> str:
-    messages = [{"role": "user", "content": prompt}]
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        enable_thinking=ENABLE_THINKING,
-    )
+def _gen_cfg() -> Dict[str, Any]:
+    return {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "do_sample": DO_SAMPLE,
+    }
+
 
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+def _permutation_overrides(model, tokenizer, n_steps: Optional[List[int]]):
+    """Per-batch grammar constraint when CONSTRAINED_DECODING is on, else None."""
+    if not CONSTRAINED_DECODING or n_steps is None:
+        return None
+    vocab = PermutationVocab(tokenizer, eos_token_ids(model, tokenizer))
 
-    with torch.no_grad():
-        gen_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            do_sample=DO_SAMPLE,
-        )
+    def overrides(batch: List[int]) -> Dict[str, Any]:
+        ns = [n_steps[i] for i in batch]
+        return {
+            "logits_processor": [PermutationLogitsProcessor(vocab, ns)],
+            "max_new_tokens": max(max_permutation_tokens(n) for n in ns),
+        }
+    return overrides
+
+
+def iter_inference_batches(model, tokenizer, prompts: List[str], n_steps: Optional[List[int]] = None,
+                           desc="Generating"):
+    """Yield [(prompt index, response), ...] as each length-bucketed batch finishes.
+
+    `n_steps[i]` is the permutation size of prompt i, used by CONSTRAINED_DECODING.
+    """
+    return iter_batch_generate(model, tokenizer, prompts, _gen_cfg(), ENABLE_THINKING,
+                               BATCH_SIZE, MAX_BATCH_TOKENS, desc=desc,
+                               batch_overrides=_permutation_overrides(model, tokenizer, n_steps))
 
-    gen_ids = [out[len(inp):] for inp, out in zip(model_inputs.input_ids, gen_ids)]
-    response = tokenizer.batch_decode(gen_ids, skip_special_tokens=True)[0]
-    print(f"####{response}")
-    return response.strip()
+
+def run_inference_batch(model, tokenizer, prompts: List[str], n_steps: Optional[List[int]] = None,
+                        desc="Generating") -> List[str]:
+    """Greedy responses for many prompts (left-padded, length-bucketed batches)."""
+    return batch_generate(model, tokenizer, prompts, _gen_cfg(), ENABLE_THINKING,
+                          BATCH_SIZE, MAX_BATCH_TOKENS, desc=desc,
+                          batch_overrides=_permutation_overrides(model, tokenizer, n_steps))
+
+
+def run_inference(model, tokenizer, prompt: str, n_steps: Optional[int] = None) -> str:
+    ns = None if n_steps is None else [n_steps]
+    return run_inference_batch(model, tokenizer, [prompt], n_steps=ns, desc=None)[0]
 
 
 # ============================================
@@ -173,35 +207,60 @@ def calculate_exact_match_indices(gts_1b: List[List[int]], preds_1b: List[List[i
     return correct / len(gts_1b) if gts_1b else 0.0
 
 
-def calculate_kendall_tau_indices(gts_1b: List[List[int]], preds_1b: List[List[int]]) -> float:
-    total_pairs = 0
-    concordant_pairs = 0
-
-    for gt, pr in zip(gts_1b, preds_1b):
-        gt_rank = {v: i for i, v in enumerate(gt)}
-        pr_rank = {v: i for i, v in enumerate(pr)}
-
-        for a, b in combinations(gt, 2):
-            gt_order = gt_rank[a] - gt_rank[b]
-            pr_order = pr_rank[a] - pr_rank[b]
-            if gt_order * pr_order > 0:
-                concordant_pairs += 1
-            total_pairs += 1
-
+def tau_from_pair_counts(concordant_pairs: int, total_pairs: int) -> float:
     if total_pairs == 0:
         return 0.0
     return (2 * concordant_pairs - total_pairs) / total_pairs
 
 
-def evaluate_sorting_predictions_1based(output_file_path: str):
-    """Load results and compute preds/gts (1-based), failed count, total count."""
-    with open(output_file_path, 'r', encoding="utf-8") as f:
-        data = json.load(f)
+def calculate_kendall_tau_indices(gts_1b: List[List[int]], preds_1b: List[List[int]]) -> float:
+    concordant, total = kendall_pair_counts_batch(gts_1b, preds_1b)
+    return tau_from_pair_counts(int(concordant.sum()), int(total.sum()))
+
+
+# Running totals, updated as records are written
+def empty_sort_stats() -> Dict[str, int]:
+    return {"total": 0, "failed": 0, "evaluated": 0, "exact": 0, "concordant": 0, "pairs": 0}
+
+
+def update_sort_stats(stats: Dict[str, int], gold_1b: List[int], pred_1b) -> None:
+    stats["total"] += 1
+    if pred_1b is None:
+        stats["failed"] += 1
+        return
+    stats["evaluated"] += 1
+    stats["exact"] += int(gold_1b == pred_1b)
+    c, t = kendall_pair_counts(gold_1b, pred_1b)
+    stats["concordant"] += c
+    stats["pairs"] += t
+
+
+def sort_metrics_from_stats(stats: Dict[str, int]) -> Dict[str, Any]:
+    total, evaluated = stats["total"], stats["evaluated"]
+    return {
+        "index_base": "1-based",
+        "total": total,
+        "evaluated": evaluated,
+        "failed": stats["failed"],
+        "failure_rate": (stats["failed"] / total) if total else 0.0,
+        "exact_match": stats["exact"] / evaluated if evaluated else 0.0,
+        "kendall_tau": tau_from_pair_counts(stats["concordant"], stats["pairs"]),
+    }
+
+
+def _iter_records(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
 
+def evaluate_sorting_predictions_1based(output_file_path: str):
+    """Load results (JSONL) and compute preds/gts (1-based), failed count, total count."""
     preds_1b, gts_1b = [], []
     failed, total = 0, 0
 
-    for item in tqdm(data, desc="Evaluating"):
+    for item in tqdm(_iter_records(output_file_path), desc="Evaluating"):
         if isinstance(item, dict) and "metrics" in item:
             continue
         total += 1
@@ -233,7 +292,7 @@ def evaluate_sorting_predictions_1based(output_file_path: str):
 
 
 # ============================================
-# Main: inference -> write file -> evaluate
+# Main: inference -> stream records + running metrics
 # ============================================
 def main():
     dataset = load_dataset(INPUT_JSON_PATH)
@@ -246,68 +305,51 @@ def main():
         device_map="auto",
     )
 
-    outputs = []
-
-    for idx, sample in enumerate(tqdm(dataset, desc="Generating")):
+    parsed_samples = []
+    for sample in dataset:
         question = sample["conversations"][0]["value"]
         wrong_steps = parse_steps_from_question(question)
         gold_1based = gold_indices_from_sample(sample)
         correct_steps = reorder_by_indices_1based(wrong_steps, gold_1based)
-
-        prompt = build_prompt(question, n_steps=len(wrong_steps))
-        gen_text = run_inference(model, tokenizer, prompt)
-
-        try:
-            pred_1b, _ = extract_predicted_order_1based(gen_text, wrong_steps, len(wrong_steps))
-        except Exception:
-            pred_1b = None
-
-        outputs.append({
-            "index": idx,
-            "question": question,
-            "wrong_steps": wrong_steps,
-            "correct_steps": correct_steps,
-            "gold_indices_1based": gold_1based,
-            "generated_response": gen_text,
-            "pred_indices_1based": pred_1b
-        })
-
-    with open(OUTPUT_JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(outputs, f, ensure_ascii=False, indent=2)
-
-    preds_1b, gts_1b, failed, total = evaluate_sorting_predictions_1based(OUTPUT_JSON_PATH)
-    exact_match = calculate_exact_match_indices(gts_1b, preds_1b)
-    kendall_tau = calculate_kendall_tau_indices(gts_1b, preds_1b)
-
+        parsed_samples.append((question, wrong_steps, gold_1based, correct_steps))
+
+    prompts = [build_prompt(q, n_steps=len(ws)) for q, ws, _, _ in parsed_samples]
+    n_steps = [len(ws) for _, ws, _, _ in parsed_samples]
+
+    stats = empty_sort_stats()
+    with open(OUTPUT_JSON_PATH, "w", encoding="utf-8") as fout:
+        for done in iter_inference_batches(model, tokenizer, prompts, n_steps):
+            for idx, gen_text in done:
+                question, wrong_steps, gold_1based, correct_steps = parsed_samples[idx]
+                try:
+                    pred_1b, _ = extract_predicted_order_1based(gen_text, wrong_steps, len(wrong_steps))
+                except Exception:
+                    pred_1b = None
+
+                rec = {
+                    "index": idx,
+                    "question": question,
+                    "wrong_steps": wrong_steps,
+                    "correct_steps": correct_steps,
+                    "gold_indices_1based": gold_1based,
+                    "generated_response": gen_text,
+                    "pred_indices_1based": pred_1b
+                }
+                fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                update_sort_stats(stats, gold_1based, pred_1b)
+            fout.flush()
+
+        metrics = sort_metrics_from_stats(stats)
+        fout.write(json.dumps({"metrics": metrics}, ensure_ascii=False) + "\n")
+
+    total, failed = metrics["total"], metrics["failed"]
     print("\n=== Final Sorting Evaluation (1-based) ===")
-    print(f"Exact Match   : {exact_match:.4f}")
-    print(f"Kendall's Tau : {kendall_tau:.4f}")
+    print(f"Exact Match   : {metrics['exact_match']:.4f}")
+    print(f"Kendall's Tau : {metrics['kendall_tau']:.4f}")
     print(f"Failed Parses : {failed}/{total} ({(failed/total*100 if total else 0):.2f}%)")
     print(f"Total Samples : {total}")
     print("---------------------------")
 
-    summary = {
-        "metrics": {
-            "index_base": "1-based",
-            "total": total,
-            "evaluated": len(preds_1b),
-            "failed": failed,
-            "failure_rate": (failed / total) if total else 0.0,
-            "exact_match": exact_match,
-            "kendall_tau": kendall_tau,
-        }
-    }
-
-    try:
-        with open(OUTPUT_JSON_PATH, "r", encoding="utf-8") as f:
-            arr = json.load(f)
-        arr.append(summary)
-        with open(OUTPUT_JSON_PATH, "w", encoding="utf-8") as f:
-            json.dump(arr, f, ensure_ascii=False, indent=2)
-    except Exception:
-        with open(OUTPUT_JSON_PATH + ".metrics.json", "w", encoding="utf-8") as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
-
 
 if __name__ == "__main__":
     main()
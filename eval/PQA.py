@@ -1,13 +1,14 @@
 import os
 import json
 from typing import List, Dict, Any, Tuple
-from tqdm import tqdm
 
 import torch
 import numpy as np
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from sklearn.metrics import brier_score_loss
 
+from batch_infer import batch_generate, batch_next_token_logprobs, candidate_token_ids
+
 # ============================================
 # Basic configuration
 # ============================================
@@ -25,6 +26,16 @@ TOP_P = 1.0
 DO_SAMPLE = False
 ENABLE_THINKING = False
 
+# Batched generation: left-padded batches bucketed by prompt length
+BATCH_SIZE = 64
+MAX_BATCH_TOKENS = 64 * 1024   # padded prompt tokens per batch
+
+# "generate": decode "{full option} & {confidence}" and parse it; "logits": one
+# prefill per sample, scoring the option letters as the next token. Confidence
+# is then the softmax over the question's options instead of a self-report.
+SCORING_MODE = "generate"
+OPTION_LETTERS = "ABCDE"
+
 
 # ============================================
 # Utility functions
@@ -78,30 +89,42 @@ def build_prompt(question: str) -> str:
     return question + suffix
 
 
+def run_inference_batch(model, tokenizer, prompts: List[str], desc="Generating") -> List[str]:
+    """Greedy responses for many prompts (left-padded, length-bucketed batches)."""
+    gen_cfg = {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "do_sample": DO_SAMPLE,
+    }
+    return batch_generate(model, tokenizer, prompts, gen_cfg, ENABLE_THINKING,
+                          BATCH_SIZE, MAX_BATCH_TOKENS, desc=desc)
+
+
 def run_inference(model, tokenizer, question: str) -> str:
     """Run model inference and return generated text."""
-    messages = [{"role": "user", "content": build_prompt(question)}]
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        enable_thinking=ENABLE_THINKING,
-    )
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    return run_inference_batch(model, tokenizer, [build_prompt(question)], desc=None)[0]
+
 
-    with torch.no_grad():
-        gen_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=MAX_NEW_TOKENS,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            do_sample=DO_SAMPLE,
-        )
+def run_logit_scoring(model, tokenizer, questions: List[str]) -> List[Tuple[str, float]]:
+    """(option letter, confidence 0–100) per question from next-token letter log-probs.
 
-    gen_ids = [out[len(inp):] for inp, out in zip(model_inputs.input_ids, gen_ids)]
-    response = tokenizer.batch_decode(gen_ids, skip_special_tokens=True)[0]
-    print(f"####{response}")
-    return response.strip()
+    The softmax runs over the letters parse_choices finds in the question
+    (all of OPTION_LETTERS if none are found).
+    """
+    cand_ids = candidate_token_ids(tokenizer, list(OPTION_LETTERS))
+    logprobs = batch_next_token_logprobs(model, tokenizer, [build_prompt(q) for q in questions],
+                                         cand_ids, ENABLE_THINKING, BATCH_SIZE, MAX_BATCH_TOKENS)
+    out = []
+    for q, lp in zip(questions, logprobs):
+        choices_map = parse_choices(q)
+        present = [i for i, l in enumerate(OPTION_LETTERS) if l in choices_map] or list(range(len(OPTION_LETTERS)))
+        sub = lp[present]
+        probs = np.exp(sub - sub.max())
+        probs /= probs.sum()
+        k = int(probs.argmax())
+        out.append((OPTION_LETTERS[present[k]], float(probs[k] * 100)))
+    return out
 
 
 def parse_pred_and_conf(raw_resp: str, choices_map: Dict[str, str]) -> Tuple[str, int, bool]:
@@ -156,11 +179,11 @@ def parse_pred_and_conf(raw_resp: str, choices_map: Dict[str, str]) -> Tuple[str
     return pred_std, conf, False
 
 
-def evaluate_predictions(records_path: str) -> Tuple[List[int], List[int], int, int]:
+def evaluate_predictions(records_path: str) -> Tuple[List[int], List[float], int, int]:
     """
     Return:
       accs   — list of 0/1 for non-failure samples
-      cfds   — list of confidences
+      cfds   — list of confidences (0–100)
       failed — count of failures
       total  — total samples
     """
@@ -176,7 +199,7 @@ def evaluate_predictions(records_path: str) -> Tuple[List[int], List[int], int,
                 failed += 1
                 continue
             accs.append(1 if obj.get("correct", False) else 0)
-            cfds.append(int(obj.get("confidence", 0)))
+            cfds.append(float(obj.get("confidence", 0)))
     return accs, cfds, failed, total
 
 
@@ -195,13 +218,19 @@ def main():
     data = load_dataset(INPUT_JSON_PATH)
     fout = open(OUTPUT_JSONL_PATH, "w", encoding="utf-8")
 
-    for idx, sample in enumerate(tqdm(data, desc="Evaluating")):
-        q = question_from_sample(sample)
+    questions = [question_from_sample(sample) for sample in data]
+    scored = None
+    if SCORING_MODE == "logits":
+        scored = run_logit_scoring(model, tokenizer, questions)
+        responses = [letter for letter, _ in scored]
+    else:
+        responses = run_inference_batch(model, tokenizer, [build_prompt(q) for q in questions])
+
+    for idx, (sample, q, raw_resp) in enumerate(zip(data, questions, responses)):
         gold = gold_from_sample(sample)
         gold_norm = normalize(gold)
 
         choices_map = parse_choices(q)
-        raw_resp = run_inference(model, tokenizer, q)
 
         if raw_resp.strip() == "":
             rec = {
@@ -218,6 +247,8 @@ def main():
             continue
 
         pred_std, conf, _ = parse_pred_and_conf(raw_resp, choices_map)
+        if scored is not None:
+            conf = scored[idx][1]
         pred_norm = normalize(pred_std)
         correct = (pred_norm == gold_norm)
 
@@ -0,0 +1,117 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from batching import plan_token_budget_batches
+from gen_backend import HFGenerateBackend
+
+
+# ======================================================
+# Batched single-turn inference for the benchmark scripts
+# ======================================================
+def chat_text(tokenizer, prompt: str, enable_thinking: bool) -> str:
+    messages = [{"role": "user", "content": prompt}]
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+        enable_thinking=enable_thinking,
+    )
+
+
+def iter_batch_generate(model, tokenizer, prompts: List[str], gen_cfg: Dict[str, Any],
+                        enable_thinking: bool, batch_size: int, max_batch_tokens: int,
+                        desc: Optional[str] = "Generating",
+                        batch_overrides: Optional[Callable[[List[int]], Dict[str, Any]]] = None,
+                        ) -> Iterator[List[Tuple[int, str]]]:
+    """Yield [(prompt index, response), ...] as each generation batch finishes.
+
+    Prompts are bucketed by token length (see batching.py) and run as
+    left-padded `model.generate` batches, so indices arrive out of input
+    order. `gen_cfg` holds max_new_tokens, temperature, top_p and
+    do_sample. Responses are decoded without special tokens and stripped,
+    as the per-sample `run_inference` did. `desc=None` hides the progress bar.
+    `batch_overrides(batch indices)` may return per-batch `logits_processor`
+    / `max_new_tokens` arguments for HFGenerateBackend.generate_ids.
+    """
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    backend = HFGenerateBackend(model, tokenizer, **gen_cfg)
+
+    prompt_ids = tokenizer([chat_text(tokenizer, p, enable_thinking) for p in prompts])["input_ids"]
+    batches = plan_token_budget_batches([len(ids) for ids in prompt_ids], max_batch_tokens, batch_size)
+
+    with tqdm(total=len(prompts), desc=desc, disable=desc is None) as pbar:
+        for batch in batches:
+            overrides = batch_overrides(batch) if batch_overrides is not None else {}
+            gen = backend.generate_ids([prompt_ids[i] for i in batch], **overrides)
+            texts = tokenizer.batch_decode(gen, skip_special_tokens=True)
+            pbar.update(len(batch))
+            yield [(i, text.strip()) for i, text in zip(batch, texts)]
+
+
+def batch_generate(model, tokenizer, prompts: List[str], gen_cfg: Dict[str, Any],
+                   enable_thinking: bool, batch_size: int, max_batch_tokens: int,
+                   desc: Optional[str] = "Generating",
+                   batch_overrides: Optional[Callable[[List[int]], Dict[str, Any]]] = None) -> List[str]:
+    """Responses for single-turn user prompts, in input order (see iter_batch_generate)."""
+    outputs: List[str] = [""] * len(prompts)
+    for done in iter_batch_generate(model, tokenizer, prompts, gen_cfg, enable_thinking,
+                                    batch_size, max_batch_tokens, desc, batch_overrides):
+        for i, text in done:
+            outputs[i] = text
+    return outputs
+
+
+# ======================================================
+# Single-prefill candidate scoring
+# ======================================================
+def candidate_token_ids(tokenizer, candidates: List[str]) -> List[int]:
+    """First token id of each candidate answer; they must be distinct."""
+    ids = [tokenizer.encode(c, add_special_tokens=False)[0] for c in candidates]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Candidates {candidates} share a first token; cannot score them apart.")
+    return ids
+
+
+def batch_next_token_logprobs(model, tokenizer, prompts: List[str], token_ids: List[int],
+                              enable_thinking: bool, batch_size: int, max_batch_tokens: int,
+                              answer_prefix: str = "", desc: Optional[str] = "Scoring") -> np.ndarray:
+    """Log-probs of `token_ids` as the next token after each prompt, shape (N, len(token_ids)).
+
+    One forward pass per left-padded batch replaces decoding. `answer_prefix`
+    is appended after the generation prompt, for answers the question asks
+    to be wrapped in a fixed opening (e.g. "[ANSWER_START]").
+    """
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    texts = [chat_text(tokenizer, p, enable_thinking) + answer_prefix for p in prompts]
+    prompt_ids = tokenizer(texts)["input_ids"]
+    batches = plan_token_budget_batches([len(ids) for ids in prompt_ids], max_batch_tokens, batch_size)
+    cand = torch.tensor(token_ids, dtype=torch.long, device=model.device)
+
+    out = np.zeros((len(prompts), len(token_ids)), dtype=np.float32)
+    with torch.inference_mode(), tqdm(total=len(prompts), desc=desc, disable=desc is None) as pbar:
+        for batch in batches:
+            width = max(len(prompt_ids[i]) for i in batch)
+            input_ids = torch.full((len(batch), width), tokenizer.pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+            for r, i in enumerate(batch):
+                input_ids[r, width - len(prompt_ids[i]):] = torch.tensor(prompt_ids[i], dtype=torch.long)
+                attention_mask[r, width - len(prompt_ids[i]):] = 1
+            # Positions count real tokens only, as generate() does under left padding
+            position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+
+            logits = model(
+                input_ids=input_ids.to(model.device),
+                attention_mask=attention_mask.to(model.device),
+                position_ids=position_ids.to(model.device),
+                use_cache=False,
+                logits_to_keep=1,
+            ).logits[:, -1, :]
+            logprobs = torch.log_softmax(logits.float(), dim=-1).index_select(1, cand)
+            out[batch] = logprobs.cpu().numpy()
+            pbar.update(len(batch))
+    return out
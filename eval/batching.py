@@ -0,0 +1,31 @@
+from typing import List
+
+
+# ======================================================
+# Length-bucketed batch planning
+# ======================================================
+def plan_token_budget_batches(lengths: List[int], max_batch_tokens: int,
+                              max_batch_size: int) -> List[List[int]]:
+    """Group sample indices into batches of similar prompt length.
+
+    Indices are sorted by length (longest first) and packed greedily while
+    `len(batch) * longest_prompt_in_batch` stays within `max_batch_tokens`
+    and the batch has at most `max_batch_size` rows. A prompt longer than
+    the budget still gets a batch of its own. Callers restore input order
+    from the returned indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_max = 0
+    for i in order:
+        L = lengths[i]
+        new_max = max(cur_max, L)
+        if cur and (len(cur) >= max_batch_size or (len(cur) + 1) * new_max > max_batch_tokens):
+            batches.append(cur)
+            cur, new_max = [], L
+        cur.append(i)
+        cur_max = new_max
+    if cur:
+        batches.append(cur)
+    return batches
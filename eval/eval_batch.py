@@ -5,15 +5,25 @@ import math
 import random
 from typing import Any, Dict, List, Optional, Tuple
 import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from tqdm import tqdm
 from sacrebleu.metrics import BLEU
 from nltk.translate.meteor_score import meteor_score
 from rouge_score import rouge_scorer
-from bert_score import score as bert_score
+from bert_score import BERTScorer
 from keybert import KeyBERT
 from sentence_transformers import SentenceTransformer
+from ref_cache import ReferenceCache, score_with_ref_cache
+from batching import plan_token_budget_batches
+from rank_corr import kendall_tau_from_pairs
+from gen_backend import GenerationBackend, make_backend
+from prefix_cache import PrefixCache, chat_prefix_ids
+from response_cache import ResponseCache
 
 import nltk
 NLTK_DATA_DIR = os.getenv("NLTK_DATA_DIR", "").strip()
@@ -21,12 +31,17 @@ if NLTK_DATA_DIR:
     nltk.data.path.append(NLTK_DATA_DIR)
 
 # KeyBERT local embedding model
-KW_MODEL = KeyBERT(model=SentenceTransformer(
-    "sentence-transformers/all-MiniLM-L6-v2"
-))
+KW_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+KW_MODEL = KeyBERT(model=SentenceTransformer(KW_MODEL_NAME))
 
 BERTSCORE_MODEL = os.getenv("BERTSCORE_MODEL", "roberta-large")
 BERTSCORE_DEVICE = os.getenv("BERTSCORE_DEVICE", "cuda")
+BERTSCORE_BATCH_SIZE = int(os.getenv("BERTSCORE_BATCH_SIZE", "64"))
+BERTSCORE_NUM_LAYERS = 24
+# Gold-reference embedding/keyword cache shared across runs ("" disables)
+REF_CACHE_DIR = os.getenv("REF_CACHE_DIR", "").strip()
+# CPU workers for BLEU/METEOR/ROUGE (0 = score inline in the main process)
+TEXT_METRIC_WORKERS = int(os.getenv("TEXT_METRIC_WORKERS", str(os.cpu_count() or 1)))
 # ======================================================
 # User configuration
 # ======================================================
@@ -42,9 +57,37 @@ MAX_NEW_TOKENS = 1024
 TEMPERATURE    = 0.6
 TOP_P          = 0.95
 DO_SAMPLE      = False
-BATCH_SIZE     = 32
+BATCH_SIZE     = 32    # max rows per generation batch
+# Padded prompt-token budget per batch (rows x longest prompt); batches are length-bucketed
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", str(BATCH_SIZE * 512)))
+# Samples sorted by prompt length together; output order is restored per window
+SCHEDULE_WINDOW  = int(os.getenv("SCHEDULE_WINDOW", str(BATCH_SIZE * 8)))
+# "hf": model.generate per static batch; "continuous": BATCH_SIZE slots refilled as rows finish
+GEN_BACKEND      = os.getenv("GEN_BACKEND", "hf")
+# Prefill the shared SYSTEM_PROMPT chat prefix once and reuse its KV for every request
+PREFIX_CACHE     = os.getenv("PREFIX_CACHE", "1") == "1"
+
+# Exact-match response cache (SQLite path, "" disables); LRU-evicted past
+# either limit (0 = unbounded). Sampled generations are only cached with
+# RESPONSE_CACHE_SAMPLED=1.
+RESPONSE_CACHE         = os.getenv("RESPONSE_CACHE", "").strip()
+RESPONSE_CACHE_MAX_MB  = float(os.getenv("RESPONSE_CACHE_MAX_MB", "0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "0"))
+RESPONSE_CACHE_SAMPLED = os.getenv("RESPONSE_CACHE_SAMPLED", "0") == "1"
 
 PRINT_EACH = True
+# Append to an existing OUTPUT_JSONL, skipping ids it already holds and
+# rebuilding aggregates from their stored metrics
+RESUME = os.getenv("RESUME", "0") == "1"
+
+# "generate": infer then score; "score_only": re-score the rows of SCORE_INPUT_JSONL
+EVAL_MODE        = os.getenv("EVAL_MODE", "generate")
+SCORE_INPUT_JSONL = os.getenv("SCORE_INPUT_JSONL", "")
+
+# SCORE settings: position-decay exponent of m_x, and how predicted steps are
+# paired with gold steps for order_tau/content ("greedy" or "lcs")
+LAMBDA_DECAY = float(os.getenv("LAMBDA_DECAY", "1.5"))
+PAIR_MODE    = os.getenv("PAIR_MODE", "greedy")
 SEED = 42  # used only for deterministic action set shuffling
 EVAL_SAMPLE_N = 0
 
@@ -166,22 +209,34 @@ def pair_by_action_sequence(pred_actions: List[str], gt_actions: List[str]) -> L
     return pairs
 
 
-from itertools import combinations
+def pair_by_lcs(pred_actions: List[str], gt_actions: List[str]) -> List[Tuple[int, int]]:
+    """Alignment along one longest common subsequence of the two action lists."""
+    n, m = len(pred_actions), len(gt_actions)
+    dp = [[0]*(m+1) for _ in range(n+1)]
+    for i in range(1, n+1):
+        ai = pred_actions[i-1]
+        for j in range(1, m+1):
+            if ai == gt_actions[j-1]:
+                dp[i][j] = dp[i-1][j-1] + 1
+            else:
+                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
 
-def _kendall_tau_from_pairs(pairs: List[Tuple[int, int]]) -> float:
-    """Compute Kendall tau on the aligned pairs."""
-    n = len(pairs)
-    if n <= 1:
-        return 0.0
-    gt_seq = [gi for _, gi in pairs]
-    concord, discord = 0, 0
-    for i, j in combinations(range(n), 2):
-        if gt_seq[i] < gt_seq[j]:
-            concord += 1
-        elif gt_seq[i] > gt_seq[j]:
-            discord += 1
-    total = concord + discord
-    return (concord - discord) / total if total else 0.0
+    pairs, i, j = [], n, m
+    while i > 0 and j > 0:
+        if pred_actions[i-1] == gt_actions[j-1] and dp[i][j] == dp[i-1][j-1] + 1:
+            pairs.append((i-1, j-1))
+            i, j = i-1, j-1
+        elif dp[i-1][j] >= dp[i][j-1]:
+            i -= 1
+        else:
+            j -= 1
+    return pairs[::-1]
+
+
+PAIRING_FUNCS = {
+    "greedy": pair_by_action_sequence,
+    "lcs": pair_by_lcs,
+}
 
 
 def _set_iou(a, b) -> float:
@@ -212,9 +267,8 @@ def compute_keyword_iou(ref_text: str, gen_text: str, top_k: int = 64) -> float:
     return len(ref_kw & gen_kw) / len(ref_kw | gen_kw)
 
 
-def _compute_step_scores(pred_step, gt_step, pred_idx, gt_idx, gt_len,
-                         lambda_decay=1.5):
-    """Compute content alignment for a step pair."""
+def _step_obj_para(pred_step, gt_step) -> Tuple[float, float]:
+    """Object IoU (with keyword fallback) and object-gated parameter score."""
     obj_iou = _set_iou(pred_step["objects"], gt_step["objects"])
     if obj_iou == 0.0:
         obj_iou = compute_keyword_iou(" ".join(gt_step["objects"]),
@@ -228,6 +282,13 @@ def _compute_step_scores(pred_step, gt_step, pred_idx, gt_idx, gt_len,
         elif pred_params and gt_params:
             para_score = compute_keyword_iou(" ".join(gt_params),
                                              " ".join(pred_params))
+    return obj_iou, para_score
+
+
+def _compute_step_scores(pred_step, gt_step, pred_idx, gt_idx, gt_len,
+                         lambda_decay=1.5):
+    """Compute content alignment for a step pair."""
+    obj_iou, para_score = _step_obj_para(pred_step, gt_step)
 
     x = abs(pred_idx - gt_idx)
     D = max(1, gt_len)
@@ -237,7 +298,9 @@ def _compute_step_scores(pred_step, gt_step, pred_idx, gt_idx, gt_len,
     return float(step_score), float(obj_iou), float(para_score), float(m_x)
 
 
-def compute_structured_metrics(pred_key_block: str, gt_key_block: str) -> Dict[str, float]:
+def compute_structured_metrics(pred_key_block: str, gt_key_block: str,
+                               lambda_decay: float = LAMBDA_DECAY,
+                               pair_mode: str = PAIR_MODE) -> Dict[str, float]:
     """Compute all structured metrics based on <key> block."""
     try:
         step_match = 1.0 if len(step_lines(pred_key_block)) == len(step_lines(gt_key_block)) else 0.0
@@ -251,7 +314,7 @@ def compute_structured_metrics(pred_key_block: str, gt_key_block: str) -> Dict[s
         order_strict = compute_order_score(pred_actions, gt_actions, mode="strict_subseq")
         order_lcs    = compute_order_score(pred_actions, gt_actions, mode="lcs")
 
-        pairs = pair_by_action_sequence(pred_actions, gt_actions)
+        pairs = PAIRING_FUNCS[pair_mode](pred_actions, gt_actions)
         if not pairs:
             return {
                 "step_match": step_match,
@@ -266,13 +329,14 @@ def compute_structured_metrics(pred_key_block: str, gt_key_block: str) -> Dict[s
 
         scores, obj_vals, para_vals, mx_vals = [], [], [], []
         for (pi, gi) in pairs:
-            s, o, p, mx = _compute_step_scores(pred_steps[pi], gt_steps[gi], pi, gi, len(gt_steps))
+            s, o, p, mx = _compute_step_scores(pred_steps[pi], gt_steps[gi], pi, gi, len(gt_steps),
+                                               lambda_decay=lambda_decay)
             scores.append(s)
             obj_vals.append(o)
             para_vals.append(p)
             mx_vals.append(mx)
 
-        tau = _kendall_tau_from_pairs(pairs)
+        tau = kendall_tau_from_pairs(pairs)
         denom = max(1, len(pairs))
 
         return {
@@ -293,6 +357,129 @@ def compute_structured_metrics(pred_key_block: str, gt_key_block: str) -> Dict[s
         }
 
 
+# ======================================================
+# Batched structured metrics
+# ======================================================
+STRUCT_METRICS = [
+    "step_match","order_strict","order_lcs","order_tau",
+    "content_score","avg_obj","avg_para","avg_mx"
+]
+
+
+def _intern_actions(seq: List[str], vocab: Dict[str, int]) -> np.ndarray:
+    """Map action strings to integer ids shared across the batch."""
+    return np.fromiter((vocab.setdefault(a, len(vocab)) for a in seq),
+                       dtype=np.int64, count=len(seq))
+
+
+def _lcs_len_batch(preds: List[np.ndarray], gts: List[np.ndarray]) -> np.ndarray:
+    """Row-vectorized LCS lengths for a batch of interned action sequences.
+
+    Each DP row is max(dp_prev[j], match * (dp_prev[j-1] + 1)) followed by a
+    running maximum along j, which is equivalent to the scalar recurrence.
+    Sequences are padded with ids that never match, so one pass over the
+    longest prediction serves the whole batch.
+    """
+    B = len(preds)
+    n = max((len(a) for a in preds), default=0)
+    m = max((len(b) for b in gts), default=0)
+    A = np.full((B, n), -1, dtype=np.int64)
+    G = np.full((B, m), -2, dtype=np.int64)
+    for k, (a, b) in enumerate(zip(preds, gts)):
+        A[k, :len(a)] = a
+        G[k, :len(b)] = b
+
+    dp = np.zeros((B, m + 1), dtype=np.int64)
+    for i in range(n):
+        match = G == A[:, i:i+1]
+        cand = np.maximum(dp[:, 1:], np.where(match, dp[:, :-1] + 1, 0))
+        dp[:, 1:] = np.maximum.accumulate(cand, axis=1)
+
+    gt_lens = np.fromiter((len(b) for b in gts), dtype=np.int64, count=B)
+    return dp[np.arange(B), gt_lens]
+
+
+def compute_structured_metrics_batch(pred_key_blocks: List[str],
+                                     gt_key_blocks: List[str],
+                                     lambda_decay: float = LAMBDA_DECAY,
+                                     pair_mode: str = PAIR_MODE) -> Dict[str, np.ndarray]:
+    """Batched compute_structured_metrics.
+
+    Returns a columnar dict mapping each name in STRUCT_METRICS to a float64
+    array of length N. Samples whose blocks fail to parse score all zeros,
+    as in the scalar version. `pair_mode` selects the step alignment from
+    PAIRING_FUNCS, with the same LAMBDA_DECAY/PAIR_MODE defaults as the
+    scalar version.
+    """
+    pair_fn = PAIRING_FUNCS[pair_mode]
+    N = len(pred_key_blocks)
+    cols = {k: np.zeros(N, dtype=np.float64) for k in STRUCT_METRICS}
+
+    vocab: Dict[str, int] = {}
+    ok_idx, pred_ids, gt_ids = [], [], []
+    pred_lens, gt_lens = [], []
+    # flattened per-pair columns across the whole batch
+    pair_owner, pair_pi, pair_gi, pair_gt_len, pair_obj, pair_para = [], [], [], [], [], []
+
+    for k, (pred_block, gt_block) in enumerate(zip(pred_key_blocks, gt_key_blocks)):
+        try:
+            step_match = 1.0 if len(step_lines(pred_block)) == len(step_lines(gt_block)) else 0.0
+            pred_steps = _parse_key_steps_lower(pred_block)
+            gt_steps   = _parse_key_steps_lower(gt_block)
+            pred_actions = _actions_from_steps(pred_steps)
+            gt_actions   = _actions_from_steps(gt_steps)
+
+            pairs = pair_fn(pred_actions, gt_actions)
+            obj_para = [_step_obj_para(pred_steps[pi], gt_steps[gi]) for pi, gi in pairs]
+            tau = kendall_tau_from_pairs(pairs) if pairs else 0.0
+        except Exception:
+            continue
+
+        cols["step_match"][k] = step_match
+        cols["order_strict"][k] = 1.0 if pred_actions == gt_actions else 0.0
+        cols["order_tau"][k] = tau
+
+        ok_idx.append(k)
+        pred_ids.append(_intern_actions(pred_actions, vocab))
+        gt_ids.append(_intern_actions(gt_actions, vocab))
+        pred_lens.append(len(pred_actions))
+        gt_lens.append(len(gt_actions))
+
+        for (pi, gi), (o, p) in zip(pairs, obj_para):
+            pair_owner.append(k)
+            pair_pi.append(pi)
+            pair_gi.append(gi)
+            pair_gt_len.append(len(gt_steps))
+            pair_obj.append(o)
+            pair_para.append(p)
+
+    # Order (LCS-F1)
+    if ok_idx:
+        idx = np.asarray(ok_idx, dtype=np.int64)
+        lcs = _lcs_len_batch(pred_ids, gt_ids).astype(np.float64)
+        tot = np.asarray(pred_lens, dtype=np.int64) + np.asarray(gt_lens, dtype=np.int64)
+        cols["order_lcs"][idx] = np.where(tot == 0, 1.0, 2.0 * lcs / np.maximum(1, tot))
+
+    # Content over aligned pairs
+    if pair_owner:
+        owner = np.asarray(pair_owner, dtype=np.int64)
+        x = np.abs(np.asarray(pair_pi, dtype=np.float64) - np.asarray(pair_gi, dtype=np.float64))
+        D = np.maximum(1, np.asarray(pair_gt_len, dtype=np.int64)).astype(np.float64)
+        mx = np.where(x >= D, 0.0, np.maximum(0.0, 1.0 - (x / D) ** lambda_decay))
+        obj = np.asarray(pair_obj, dtype=np.float64)
+        para = np.asarray(pair_para, dtype=np.float64)
+        score = mx * (obj + 0.5 * para)
+
+        counts = np.bincount(owner, minlength=N)
+        denom = np.maximum(1, counts).astype(np.float64)
+        cols["content_score"] = np.bincount(owner, weights=score, minlength=N) / denom
+        cols["avg_obj"] = np.bincount(owner, weights=obj, minlength=N) / denom
+        cols["avg_para"] = np.bincount(owner, weights=para, minlength=N) / denom
+        cols["avg_mx"] = np.bincount(owner, weights=mx, minlength=N) / denom
+
+    return cols
+
+
 # ======================================================
 # Text metrics (for <orc>)
 # ======================================================
@@ -302,19 +489,17 @@ rouge = rouge_scorer.RougeScorer(
     use_stemmer=True
 )
 
+TEXT_METRICS = [
+    "bleu1","bleu2","bleu3","bleu4","bleu_avg",
+    "meteor","rouge1","rouge2","rougeL",
+    "kw_precision","kw_recall","kw_f1",
+    "bertscore_p","bertscore_r","bertscore_f1"
+]
+
 
-def compute_text_metrics(ref: str, pred: str, lang: str = "en") -> Dict[str, float]:
-    """Compute BLEU/METEOR/ROUGE/Keyword/BERTScore metrics."""
+def compute_lexical_metrics(ref: str, pred: str) -> Dict[str, float]:
+    """BLEU/METEOR/ROUGE on non-empty, stripped texts (CPU only)."""
     metrics = {}
-    ref, pred = (ref or "").strip(), (pred or "").strip()
-
-    if not ref or not pred:
-        return {m: 0.0 for m in [
-            "bleu1","bleu2","bleu3","bleu4","bleu_avg",
-            "meteor","rouge1","rouge2","rougeL",
-            "kw_precision","kw_recall","kw_f1",
-            "bertscore_p","bertscore_r","bertscore_f1"
-        ]}
 
     # BLEU
     bleu = bleu_metric.sentence_score(pred, [ref])
@@ -335,46 +520,226 @@ def compute_text_metrics(ref: str, pred: str, lang: str = "en") -> Dict[str, flo
     metrics["rouge1"] = r["rouge1"].fmeasure
     metrics["rouge2"] = r["rouge2"].fmeasure
     metrics["rougeL"] = r["rougeL"].fmeasure
+    return metrics
 
-    # Keyword F1
-    try:
-        ref_kw = set([kw for kw,_ in KW_MODEL.extract_keywords(ref, top_n=64)])
-        gen_kw = set([kw for kw,_ in KW_MODEL.extract_keywords(pred, top_n=64)])
-        inter  = ref_kw & gen_kw
-        prec   = len(inter) / len(gen_kw) if gen_kw else 0.0
-        rec    = len(inter) / len(ref_kw) if ref_kw else 0.0
-        f1     = 2 * prec * rec / (prec + rec + 1e-8) if (prec + rec) else 0.0
-        metrics["kw_precision"] = prec
-        metrics["kw_recall"]    = rec
-        metrics["kw_f1"]        = f1
-    except Exception:
-        metrics["kw_precision"] = metrics["kw_recall"] = metrics["kw_f1"] = 0.0
 
-    # BERTScore
-    try:
-        strip_header = lambda s: re.sub(r"(?im)^step\s*\d+\s*:\s*", "", s)
-        ref_clean  = strip_header(ref)
-        pred_clean = strip_header(pred)
+_BERT_SCORER = None
+
 
-        P, R, F1 = bert_score(
-            [pred_clean], [ref_clean],
+def get_bert_scorer() -> BERTScorer:
+    """Load the BERTScore model once and keep it resident."""
+    global _BERT_SCORER
+    if _BERT_SCORER is None:
+        _BERT_SCORER = BERTScorer(
+            model_type=BERTSCORE_MODEL,
+            num_layers=BERTSCORE_NUM_LAYERS,
             lang="en",
             rescale_with_baseline=False,
             device=BERTSCORE_DEVICE,
-            model_type=BERTSCORE_MODEL,
-            num_layers=24
+            batch_size=BERTSCORE_BATCH_SIZE,
         )
+    return _BERT_SCORER
+
+
+def _strip_step_header(s: str) -> str:
+    return re.sub(r"(?im)^step\s*\d+\s*:\s*", "", s)
+
+
+_REF_CACHE = None
+
+
+def get_ref_cache() -> Optional[ReferenceCache]:
+    global _REF_CACHE
+    if _REF_CACHE is None and REF_CACHE_DIR:
+        _REF_CACHE = ReferenceCache(REF_CACHE_DIR, BERTSCORE_MODEL,
+                                    BERTSCORE_NUM_LAYERS, KW_MODEL_NAME)
+    return _REF_CACHE
+
 
+def _keywords_batch(docs: List[str]) -> List[set]:
+    """KeyBERT keywords for many documents with one extract_keywords call."""
+    if not docs:
+        return []
+    kws = KW_MODEL.extract_keywords(docs, top_n=64)
+    if len(docs) == 1:
+        kws = [kws]
+    if len(kws) != len(docs):  # KeyBERT returns [] when no document has candidates
+        kws = [[] for _ in docs]
+    return [set([kw for kw, _ in doc_kws]) for doc_kws in kws]
 
-        metrics["bertscore_p"]  = float(P.mean())
-        metrics["bertscore_r"]  = float(R.mean())
-        metrics["bertscore_f1"] = float(F1.mean())
 
+def _ref_and_pred_keywords(refs: List[str], preds: List[str]) -> Tuple[List[set], List[set]]:
+    """Keyword sets for references and predictions; cached references are not re-extracted."""
+    cache = get_ref_cache()
+    if cache is None:
+        kw_sets = _keywords_batch(refs + preds)
+        return kw_sets[:len(refs)], kw_sets[len(refs):]
+
+    ref_sets = [cache.get_keywords(r) for r in refs]
+    missing = sorted(set(r for r, kw in zip(refs, ref_sets) if kw is None))
+    kw_sets = _keywords_batch(missing + preds)
+    fresh = dict(zip(missing, kw_sets[:len(missing)]))
+    cache.put_keywords_many(list(fresh.items()))
+    ref_sets = [kw if kw is not None else fresh[r] for r, kw in zip(refs, ref_sets)]
+    return ref_sets, kw_sets[len(missing):]
+
+
+def compute_text_metrics_batch(refs: List[str], preds: List[str],
+                               lexical: Optional[List[Optional[Dict[str, float]]]] = None
+                               ) -> List[Dict[str, float]]:
+    """Compute BLEU/METEOR/ROUGE/Keyword/BERTScore metrics for a batch of pairs.
+
+    KeyBERT runs once over all references and predictions, and BERTScore runs
+    as padded batches of BERTSCORE_BATCH_SIZE on a resident model. `lexical`
+    may carry BLEU/METEOR/ROUGE values already computed by the text-metric
+    pool; only the model-based metrics are computed here then.
+    """
+    refs  = [(r or "").strip() for r in refs]
+    preds = [(p or "").strip() for p in preds]
+    results = [{m: 0.0 for m in TEXT_METRICS} for _ in refs]
+    valid = [i for i, (r, p) in enumerate(zip(refs, preds)) if r and p]
+    if not valid:
+        return results
+
+    for i in valid:
+        lex = lexical[i] if lexical is not None else None
+        results[i].update(lex if lex is not None else compute_lexical_metrics(refs[i], preds[i]))
+
+    # Keyword F1
+    try:
+        ref_sets, gen_sets = _ref_and_pred_keywords([refs[i] for i in valid],
+                                                    [preds[i] for i in valid])
+        for r, i in enumerate(valid):
+            ref_kw, gen_kw = ref_sets[r], gen_sets[r]
+            inter  = ref_kw & gen_kw
+            prec   = len(inter) / len(gen_kw) if gen_kw else 0.0
+            rec    = len(inter) / len(ref_kw) if ref_kw else 0.0
+            f1     = 2 * prec * rec / (prec + rec + 1e-8) if (prec + rec) else 0.0
+            results[i]["kw_precision"] = prec
+            results[i]["kw_recall"]    = rec
+            results[i]["kw_f1"]        = f1
+    except Exception:
+        for i in valid:
+            results[i]["kw_precision"] = results[i]["kw_recall"] = results[i]["kw_f1"] = 0.0
+
+    # BERTScore
+    try:
+        cands_clean = [_strip_step_header(preds[i]) for i in valid]
+        refs_clean  = [_strip_step_header(refs[i]) for i in valid]
+        cache = get_ref_cache()
+        if cache is not None:
+            P, R, F1 = score_with_ref_cache(get_bert_scorer(), cands_clean, refs_clean,
+                                            cache, batch_size=BERTSCORE_BATCH_SIZE)
+        else:
+            P, R, F1 = get_bert_scorer().score(cands_clean, refs_clean,
+                                               batch_size=BERTSCORE_BATCH_SIZE)
+        for r, i in enumerate(valid):
+            results[i]["bertscore_p"]  = float(P[r])
+            results[i]["bertscore_r"]  = float(R[r])
+            results[i]["bertscore_f1"] = float(F1[r])
     except Exception:
         traceback.print_exc()
-        metrics["bertscore_p"] = metrics["bertscore_r"] = metrics["bertscore_f1"] = 0.0
+        for i in valid:
+            results[i]["bertscore_p"] = results[i]["bertscore_r"] = results[i]["bertscore_f1"] = 0.0
 
-    return metrics
+    return results
+
+
+def compute_text_metrics(ref: str, pred: str, lang: str = "en",
+                         lexical: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Compute BLEU/METEOR/ROUGE/Keyword/BERTScore metrics for one pair."""
+    return compute_text_metrics_batch([ref], [pred], lexical=[lexical])[0]
+
+
+# ======================================================
+# Text-metric worker pool
+# ======================================================
+def _init_text_worker():
+    """Build the lexical scorers once per worker process."""
+    global bleu_metric, rouge
+    if NLTK_DATA_DIR and NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_DIR)
+    bleu_metric = BLEU(effective_order=True)
+    rouge = rouge_scorer.RougeScorer(['rouge1','rouge2','rougeL'], use_stemmer=True)
+    try:
+        meteor_score([["warmup"]], ["warmup"])  # loads WordNet up front
+    except Exception:
+        pass
+
+
+def _lexical_metrics_chunk(pairs: List[Tuple[str, str]]) -> List[Optional[Dict[str, float]]]:
+    out = []
+    for ref, pred in pairs:
+        ref, pred = (ref or "").strip(), (pred or "").strip()
+        out.append(compute_lexical_metrics(ref, pred) if ref and pred else None)
+    return out
+
+
+_text_pool_workers = 0     # size of the pool made by make_text_metric_pool
+
+
+def make_text_metric_pool(workers: int = TEXT_METRIC_WORKERS) -> Optional[ProcessPoolExecutor]:
+    """Process pool for lexical metrics. Uses fork so workers skip the
+    module-level model loading; create it before the generation model.
+
+    A fork pool starts all its workers on the first submit, so one trivial
+    task here forks them before CUDA or the model exist.
+    """
+    global _text_pool_workers
+    if workers <= 0:
+        return None
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_text_worker,
+    )
+    pool.submit(os.getpid).result()
+    _text_pool_workers = workers
+    return pool
+
+
+def submit_lexical_metrics(pool: Optional[ProcessPoolExecutor],
+                           pairs: List[Tuple[str, str]]):
+    """Fan (ref, pred) pairs out to the pool; returns futures (or None if no pool)."""
+    if pool is None or not pairs:
+        return None
+    n_chunks = min(len(pairs), _text_pool_workers)
+    size = math.ceil(len(pairs) / n_chunks)
+    return [pool.submit(_lexical_metrics_chunk, pairs[i:i+size])
+            for i in range(0, len(pairs), size)]
+
+
+def collect_lexical_metrics(futures, pairs: List[Tuple[str, str]]) -> List[Optional[Dict[str, float]]]:
+    if futures is None:
+        return _lexical_metrics_chunk(pairs)
+    out = []
+    for fut in futures:
+        out.extend(fut.result())
+    return out
+
+
+def _structured_metrics_chunk(args) -> Dict[str, np.ndarray]:
+    return compute_structured_metrics_batch(*args)
+
+
+def submit_structured_metrics(pool: Optional[ProcessPoolExecutor], pred_key_blocks: List[str],
+                              gt_key_blocks: List[str], lambda_decay: float, pair_mode: str):
+    """Split a batch of <key> blocks across the pool; returns futures (or None)."""
+    if pool is None or not pred_key_blocks:
+        return None
+    n_chunks = min(len(pred_key_blocks), _text_pool_workers)
+    size = math.ceil(len(pred_key_blocks) / n_chunks)
+    return [pool.submit(_structured_metrics_chunk,
+                        (pred_key_blocks[i:i+size], gt_key_blocks[i:i+size], lambda_decay, pair_mode))
+            for i in range(0, len(pred_key_blocks), size)]
+
+
+def collect_structured_metrics(futures, pred_key_blocks: List[str], gt_key_blocks: List[str],
+                               lambda_decay: float, pair_mode: str) -> Dict[str, np.ndarray]:
+    if futures is None:
+        return compute_structured_metrics_batch(pred_key_blocks, gt_key_blocks, lambda_decay, pair_mode)
+    parts = [fut.result() for fut in futures]
+    return {m: np.concatenate([p[m] for p in parts]) for m in STRUCT_METRICS}
 
 
 # ======================================================
@@ -430,7 +795,8 @@ def load_model_and_tokenizer():
     return model, tokenizer
 
 
-def generate_response(model, tokenizer, system_prompt: str, user_prompt: str) -> str:
+def generate_response(model, tokenizer, system_prompt: str, user_prompt: str,
+                      prefix_cache: Optional[PrefixCache] = None) -> str:
     """Single-sample generation (not used in batch path)."""
     messages = [
         {"role": "system", "content": system_prompt},
@@ -442,7 +808,11 @@ def generate_response(model, tokenizer, system_prompt: str, user_prompt: str) ->
         add_generation_prompt=True,
         enable_thinking=True
     )
-    inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    inputs = None
+    if prefix_cache is not None:
+        inputs = prefix_cache.generate_inputs(tokenizer([text])["input_ids"], tokenizer.pad_token_id)
+    if inputs is None:
+        inputs = tokenizer([text], return_tensors="pt").to(model.device)
 
     outputs = model.generate(
         **inputs,
@@ -452,53 +822,75 @@ def generate_response(model, tokenizer, system_prompt: str, user_prompt: str) ->
         do_sample=DO_SAMPLE
     )
 
-    gen_ids = outputs[0][inputs.input_ids.shape[1]:]
+    gen_ids = outputs[0][inputs["input_ids"].shape[1]:]
     return tokenizer.decode(gen_ids, skip_special_tokens=True)
 
 
-def batch_generate_responses(model, tokenizer, sys_prompt: str,
-                             user_prompts: List[str]) -> List[str]:
-    """Batched inference for efficiency."""
-    texts = []
-    for up in user_prompts:
-        messages = [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user",   "content": up},
-        ]
-        texts.append(tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-            enable_thinking=True
-        ))
-
-    enc = tokenizer(
-        texts,
-        return_tensors="pt",
-        padding=True,
-        truncation=False
-    ).to(model.device)
-
-    with torch.inference_mode():
-        out = model.generate(
-            **enc,
-            max_new_tokens=MAX_NEW_TOKENS,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            do_sample=DO_SAMPLE,
-            pad_token_id=tokenizer.pad_token_id,
-            return_dict_in_generate=True
-        )
+def build_chat_text(tokenizer, sys_prompt: str, user_prompt: str) -> str:
+    messages = [
+        {"role": "system", "content": sys_prompt},
+        {"role": "user",   "content": user_prompt},
+    ]
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+        enable_thinking=True
+    )
+
+
+def prompt_token_lengths(tokenizer, sys_prompt: str, user_prompts: List[str]) -> List[int]:
+    texts = [build_chat_text(tokenizer, sys_prompt, up) for up in user_prompts]
+    return [len(ids) for ids in tokenizer(texts)["input_ids"]]
 
-    seqs = out.sequences
-    attn = enc.attention_mask
-    prompt_lens = attn.sum(dim=1).tolist()
 
-    res = []
-    for i, pl in enumerate(prompt_lens):
-        gen_ids = seqs[i, pl:]
-        res.append(tokenizer.decode(gen_ids, skip_special_tokens=True))
-    return res
+def build_prefix_cache(model, tokenizer, sys_prompt: str) -> PrefixCache:
+    return PrefixCache(model, chat_prefix_ids(
+        tokenizer, lambda up: build_chat_text(tokenizer, sys_prompt, up)
+    ))
+
+
+def make_generation_backend(model, tokenizer) -> GenerationBackend:
+    prefix_cache = build_prefix_cache(model, tokenizer, SYSTEM_PROMPT) if PREFIX_CACHE else None
+    return make_backend(
+        GEN_BACKEND, model, tokenizer,
+        max_slots=BATCH_SIZE,
+        prefix_cache=prefix_cache,
+        max_new_tokens=MAX_NEW_TOKENS,
+        temperature=TEMPERATURE,
+        top_p=TOP_P,
+        do_sample=DO_SAMPLE,
+    )
+
+
+def make_response_cache(model) -> Optional[ResponseCache]:
+    if not RESPONSE_CACHE:
+        return None
+    gen_cfg = {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "do_sample": DO_SAMPLE,
+    }
+    return ResponseCache(
+        RESPONSE_CACHE, model, gen_cfg,
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+        cache_sampled=RESPONSE_CACHE_SAMPLED,
+    )
+
+
+def batch_generate_responses(model, tokenizer, sys_prompt: str,
+                             user_prompts: List[str],
+                             backend: Optional[GenerationBackend] = None,
+                             response_cache: Optional[ResponseCache] = None) -> List[str]:
+    """Batched inference for efficiency; cached prompts skip the model."""
+    if backend is None:
+        backend = make_generation_backend(model, tokenizer)
+    texts = [build_chat_text(tokenizer, sys_prompt, up) for up in user_prompts]
+    if response_cache is not None:
+        return response_cache.generate(texts, backend.generate)
+    return backend.generate(texts)
 
 
 # ======================================================
@@ -535,125 +927,132 @@ def _finalize_agg(entry: Dict[str, float]) -> Dict[str, float]:
     return out
 
 
-# ======================================================
-# Main
-# ======================================================
-def main():
-    samples = []
-    with open(INPUT_JSONL, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                samples.append(json.loads(line))
-
-    if isinstance(EVAL_SAMPLE_N, int) and EVAL_SAMPLE_N > 0 and EVAL_SAMPLE_N < len(samples):
-        rnd = random.Random(SEED)
-        idxs = rnd.sample(range(len(samples)), EVAL_SAMPLE_N)
-        idxs.sort()
-        samples = [samples[i] for i in idxs]
-
-    model, tokenizer = load_model_and_tokenizer()
-    fout = open(OUTPUT_JSONL, "w", encoding="utf-8")
-
-    overall = _empty_agg()
-    by_level = {}
-    by_type  = {}
-
-    for start in tqdm(range(0, len(samples), BATCH_SIZE), desc="Infer+Eval (batched)"):
-        chunk = samples[start:start+BATCH_SIZE]
-
-        user_prompts = []
-        metas = []
-
-        for i, item in enumerate(chunk):
-            sid    = item.get("id", f"sample_{start+i}")
-            stype  = str(item.get("type","unknown"))
-            slevel = str(item.get("level","unknown"))
-
-            question     = str(item.get("question","")).strip()
-            gt_key_block = str(item.get("key","")).strip()
-            gt_orc       = str(item.get("orc","")).strip()
-
-            actions_new  = item.get("action_new", None)
-            actions      = actions_new if isinstance(actions_new, list) else item.get("action", [])
-
-            if not question or not isinstance(actions, list):
-                metas.append(None)
-                continue
-
-            shuffle_flag = not isinstance(actions_new, list)
-            user_prompt = build_user_prompt(question, actions, do_shuffle=shuffle_flag)
-
-            metas.append({
-                "id": sid,
-                "type": stype,
-                "level": slevel,
-                "question": question,
-                "gt_key_block": gt_key_block,
-                "gt_orc": gt_orc,
-                "actions_prompt_tail": user_prompt.split(
-                    "Please note that you can only use the following actions:"
-                )[-1].strip()
-            })
+def _prepare_sample(item: Dict[str, Any], pos: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Build the row metadata and user prompt for one input sample."""
+    sid    = item.get("id", f"sample_{pos}")
+    stype  = str(item.get("type","unknown"))
+    slevel = str(item.get("level","unknown"))
+
+    question     = str(item.get("question","")).strip()
+    gt_key_block = str(item.get("key","")).strip()
+    gt_orc       = str(item.get("orc","")).strip()
+
+    actions_new  = item.get("action_new", None)
+    actions      = actions_new if isinstance(actions_new, list) else item.get("action", [])
+
+    if not question or not isinstance(actions, list):
+        return None, None
+
+    shuffle_flag = not isinstance(actions_new, list)
+    user_prompt = build_user_prompt(question, actions, do_shuffle=shuffle_flag)
+
+    meta = {
+        "pos": pos,
+        "id": sid,
+        "type": stype,
+        "level": slevel,
+        "question": question,
+        "gt_key_block": gt_key_block,
+        "gt_orc": gt_orc,
+        "actions_prompt_tail": user_prompt.split(
+            "Please note that you can only use the following actions:"
+        )[-1].strip()
+    }
+    return meta, user_prompt
 
-            user_prompts.append(user_prompt)
 
-        if not user_prompts:
-            continue
+def _score_and_write(pending, aggs, fout):
+    """Finish scoring one submitted group of rows, update aggregates and write them."""
+    parsed, pairs, lex_futures, struct_futures = pending
+    overall, by_level, by_type = aggs
 
-        try:
-            outputs = batch_generate_responses(model, tokenizer, SYSTEM_PROMPT, user_prompts)
-        except Exception as e:
-            outputs = [f"[ERROR during generation] {e}"] * len(user_prompts)
-
-        k = 0
-        for i in range(len(chunk)):
-            meta = metas[i]
-            if meta is None:
-                continue
+    lexical = collect_lexical_metrics(lex_futures, pairs)
+    struct_cols = collect_structured_metrics(
+        struct_futures, [p[3] for p in parsed], [p[1]["gt_key_block"] for p in parsed],
+        LAMBDA_DECAY, PAIR_MODE
+    )
 
-            model_output = outputs[k]
-            k += 1
+    text_rows = compute_text_metrics_batch(
+        [p[1]["gt_orc"] for p in parsed], [p[4] for p in parsed], lexical=lexical
+    )
 
-            blocks = extract_blocks(model_output)
-            pred_key_block = blocks["key"] if (blocks and isinstance(blocks.get("key"), str)) else model_output
-            pred_orc       = blocks["orc"] if blocks else ""
+    for r, (pos, meta, model_output, pred_key_block, pred_orc) in enumerate(parsed):
+        struct_metrics = {m: float(struct_cols[m][r]) for m in STRUCT_METRICS}
+        text_metrics   = text_rows[r]
+        row_metrics    = {**struct_metrics, **text_metrics}
+
+        _add_to_agg({"overall": overall}, "overall", row_metrics)
+        _add_to_agg(by_level, meta["level"], row_metrics)
+        _add_to_agg(by_type,  meta["type"],  row_metrics)
+
+        if PRINT_EACH:
+            sm, tm = struct_metrics, text_metrics
+            print(
+                f"[{pos+1}] id={meta['id']} level={meta['level']} type={meta['type']} | "
+                f"step={sm['step_match']:.2f} strict={sm['order_strict']:.2f} "
+                f"lcs={sm['order_lcs']:.2f} content={sm['content_score']:.2f} "
+                f"(obj={sm['avg_obj']:.2f}, para={sm['avg_para']:.2f}, mx={sm['avg_mx']:.2f}) | "
+                f"BLEU4={tm['bleu4']:.3f} METEOR={tm['meteor']:.3f} "
+                f"R1={tm['rouge1']:.3f} R2={tm['rouge2']:.3f} RL={tm['rougeL']:.3f} "
+                f"KW_F1={tm['kw_f1']:.3f} BERT_F1={tm['bertscore_f1']:.3f}"
+            )
+
+        out_line = {
+            "id": meta["id"],
+            "type": meta["type"],
+            "level": meta["level"],
+            "question": meta["question"],
+            "actions_prompt_tail": meta["actions_prompt_tail"],
+            "model_output": model_output,
+            "pred_key_block": pred_key_block,
+            "gt_key_block": meta["gt_key_block"],
+            "pred_orc": pred_orc,
+            "gt_orc": meta["gt_orc"],
+            "metrics": row_metrics
+        }
+        fout.write(json.dumps(out_line, ensure_ascii=False) + "\n")
+
+
+def load_resume_state(path: str, aggs) -> set:
+    """Replay completed rows of a previous run into `aggs` and return their ids.
+
+    Rows are read in file order, which is the order an uninterrupted run
+    adds them, so the final sums are identical. Only the last line can be
+    torn by a crash (or be the report of a finished run); it is truncated
+    away, while an unreadable row anywhere else raises ValueError.
+    """
+    overall, by_level, by_type = aggs
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    keep = 0
+    with open(path, "rb") as f:
+        for lineno, raw in enumerate(f, 1):
+            try:
+                row = json.loads(raw) if raw.endswith(b"\n") else None
+            except ValueError:
+                row = None
+            if not (isinstance(row, dict) and "id" in row and "metrics" in row):
+                if f.readline():
+                    raise ValueError(f"{path}:{lineno}: unreadable row before the end of the file; "
+                                     "repair it or set RESUME=0")
+                break
+            row_metrics = row["metrics"]
+            _add_to_agg({"overall": overall}, "overall", row_metrics)
+            _add_to_agg(by_level, str(row.get("level", "unknown")), row_metrics)
+            _add_to_agg(by_type,  str(row.get("type", "unknown")),  row_metrics)
+            done.add(row["id"])
+            keep += len(raw)
 
-            struct_metrics = compute_structured_metrics(pred_key_block, meta["gt_key_block"])
-            text_metrics   = compute_text_metrics(meta["gt_orc"], pred_orc)
-            row_metrics    = {**struct_metrics, **text_metrics}
+    with open(path, "r+b") as f:
+        f.truncate(keep)
+    return done
 
-            _add_to_agg({"overall": overall}, "overall", row_metrics)
-            _add_to_agg(by_level, meta["level"], row_metrics)
-            _add_to_agg(by_type,  meta["type"],  row_metrics)
-
-            if PRINT_EACH:
-                sm, tm = struct_metrics, text_metrics
-                print(
-                    f"[{start+i+1}] id={meta['id']} level={meta['level']} type={meta['type']} | "
-                    f"step={sm['step_match']:.2f} strict={sm['order_strict']:.2f} "
-                    f"lcs={sm['order_lcs']:.2f} content={sm['content_score']:.2f} "
-                    f"(obj={sm['avg_obj']:.2f}, para={sm['avg_para']:.2f}, mx={sm['avg_mx']:.2f}) | "
-                    f"BLEU4={tm['bleu4']:.3f} METEOR={tm['meteor']:.3f} "
-                    f"R1={tm['rouge1']:.3f} R2={tm['rouge2']:.3f} RL={tm['rougeL']:.3f} "
-                    f"KW_F1={tm['kw_f1']:.3f} BERT_F1={tm['bertscore_f1']:.3f}"
-                )
-
-            out_line = {
-                "id": meta["id"],
-                "type": meta["type"],
-                "level": meta["level"],
-                "question": meta["question"],
-                "actions_prompt_tail": meta["actions_prompt_tail"],
-                "model_output": model_output,
-                "pred_key_block": pred_key_block,
-                "gt_key_block": meta["gt_key_block"],
-                "pred_orc": pred_orc,
-                "gt_orc": meta["gt_orc"],
-                "metrics": row_metrics
-            }
-            fout.write(json.dumps(out_line, ensure_ascii=False) + "\n")
 
-    # Final reports
+def _write_report(aggs, fout):
+    """Print the final averages and append the {"report": ...} line."""
+    overall, by_level, by_type = aggs
     overall_report = _finalize_agg(overall) if overall["count"] > 0 else {}
     level_report   = {k: _finalize_agg(v) for k, v in by_level.items()}
     type_report    = {k: _finalize_agg(v) for k, v in by_type.items()}
@@ -686,8 +1085,189 @@ def main():
         print(f"[{k}] {stats}")
 
     fout.write(json.dumps({"report": report}, ensure_ascii=False) + "\n")
+
+
+def _submit_window(pool, parsed):
+    """Start CPU-side scoring of a group of rows in the pool; finished by _score_and_write."""
+    pairs = [(p[1]["gt_orc"], p[4]) for p in parsed]
+    struct_futures = submit_structured_metrics(
+        pool, [p[3] for p in parsed], [p[1]["gt_key_block"] for p in parsed],
+        LAMBDA_DECAY, PAIR_MODE
+    )
+    return (parsed, pairs, submit_lexical_metrics(pool, pairs), struct_futures)
+
+
+def _scored(pending) -> bool:
+    futures = (pending[2] or []) + (pending[3] or [])
+    return all(f.done() for f in futures)
+
+
+def _sync(fout):
+    fout.flush()
+    os.fsync(fout.fileno())
+
+
+# ======================================================
+# Main
+# ======================================================
+def main():
+    samples = []
+    with open(INPUT_JSONL, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                samples.append(json.loads(line))
+
+    if isinstance(EVAL_SAMPLE_N, int) and EVAL_SAMPLE_N > 0 and EVAL_SAMPLE_N < len(samples):
+        rnd = random.Random(SEED)
+        idxs = rnd.sample(range(len(samples)), EVAL_SAMPLE_N)
+        idxs.sort()
+        samples = [samples[i] for i in idxs]
+
+    text_pool = make_text_metric_pool()
+    model, tokenizer = load_model_and_tokenizer()
+    backend = make_generation_backend(model, tokenizer)
+    response_cache = make_response_cache(model)
+    overall = _empty_agg()
+    by_level = {}
+    by_type  = {}
+    aggs = (overall, by_level, by_type)
+    pending = deque()
+
+    done_ids = load_resume_state(OUTPUT_JSONL, aggs) if RESUME else set()
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} rows already in {OUTPUT_JSONL}")
+    fout = open(OUTPUT_JSONL, "a" if RESUME else "w", encoding="utf-8")
+
+    # Build prompts up front so batches can be bucketed by prompt length
+    metas = []
+    user_prompts = []
+    for pos, item in enumerate(samples):
+        meta, user_prompt = _prepare_sample(item, pos)
+        if meta is None or meta["id"] in done_ids:
+            continue
+        metas.append(meta)
+        user_prompts.append(user_prompt)
+
+    prompt_lens = prompt_token_lengths(tokenizer, SYSTEM_PROMPT, user_prompts)
+    pbar = tqdm(total=len(metas), desc="Infer+Eval (bucketed)")
+
+    for wstart in range(0, len(metas), SCHEDULE_WINDOW):
+        window = range(wstart, min(wstart + SCHEDULE_WINDOW, len(metas)))
+        if backend.refills_slots:
+            # The backend keeps its slots busy itself; hand over the whole window
+            batches = [list(range(len(window)))]
+        else:
+            batches = plan_token_budget_batches([prompt_lens[i] for i in window],
+                                                MAX_BATCH_TOKENS, BATCH_SIZE)
+        for batch in batches:
+            ids = [wstart + b for b in batch]
+            try:
+                outs = batch_generate_responses(model, tokenizer, SYSTEM_PROMPT,
+                                                [user_prompts[i] for i in ids], backend, response_cache)
+            except Exception as e:
+                outs = [f"[ERROR during generation] {e}"] * len(ids)
+            pbar.update(len(ids))
+
+            parsed = []
+            for i, model_output in zip(ids, outs):
+                blocks = extract_blocks(model_output)
+                pred_key_block = blocks["key"] if (blocks and isinstance(blocks.get("key"), str)) else model_output
+                pred_orc       = blocks["orc"] if blocks else ""
+                parsed.append((metas[i]["pos"], metas[i], model_output, pred_key_block, pred_orc))
+            pending.append(_submit_window(text_pool, parsed))
+
+            # Each batch is written and fsync'd once the pool has scored it; only the
+            # newest batch may still be scoring while the next one generates
+            while pending and (len(pending) > 1 or _scored(pending[0])):
+                _score_and_write(pending.popleft(), aggs, fout)
+                _sync(fout)
+
+    pbar.close()
+    while pending:
+        _score_and_write(pending.popleft(), aggs, fout)
+        _sync(fout)
+    if text_pool is not None:
+        text_pool.shutdown()
+
+    _write_report(aggs, fout)
+    _sync(fout)
+    fout.close()
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
+        response_cache.close()
+
+
+def _iter_saved_rows(path: str):
+    """Stream (meta, model_output, pred_key_block, pred_orc) from a previous output JSONL."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # torn final line of an interrupted run
+            if "report" in row or "model_output" not in row:
+                continue
+            meta = {
+                "id": row.get("id"),
+                "type": str(row.get("type", "unknown")),
+                "level": str(row.get("level", "unknown")),
+                "question": row.get("question", ""),
+                "gt_key_block": row.get("gt_key_block", ""),
+                "gt_orc": row.get("gt_orc", ""),
+                "actions_prompt_tail": row.get("actions_prompt_tail", ""),
+            }
+            yield meta, row["model_output"], row.get("pred_key_block", ""), row.get("pred_orc", "")
+
+
+def _windowed(rows, size: int):
+    """Group streamed rows into lists of `size` (pos, meta, output, key, orc) tuples."""
+    window = []
+    for pos, row in enumerate(rows):
+        window.append((pos, *row))
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def score_only():
+    """Re-score saved model outputs with the current SCORE settings, no generation."""
+    if not SCORE_INPUT_JSONL:
+        raise ValueError("EVAL_MODE=score_only needs SCORE_INPUT_JSONL")
+    if os.path.abspath(SCORE_INPUT_JSONL) == os.path.abspath(OUTPUT_JSONL):
+        raise ValueError("SCORE_INPUT_JSONL and OUTPUT_JSONL must differ")
+    print(f"Re-scoring {SCORE_INPUT_JSONL} (lambda_decay={LAMBDA_DECAY}, pair_mode={PAIR_MODE})")
+
+    text_pool = make_text_metric_pool()
+    fout = open(OUTPUT_JSONL, "w", encoding="utf-8")
+    aggs = (_empty_agg(), {}, {})
+    pending = None
+    pbar = tqdm(desc="Re-score")
+
+    for window in _windowed(_iter_saved_rows(SCORE_INPUT_JSONL), SCHEDULE_WINDOW):
+        # The pool works on this window while the previous one gets BERTScore/KeyBERT
+        nxt = _submit_window(text_pool, window)
+        if pending is not None:
+            _score_and_write(pending, aggs, fout)
+            pbar.update(len(pending[0]))
+        pending = nxt
+    if pending is not None:
+        _score_and_write(pending, aggs, fout)
+        pbar.update(len(pending[0]))
+    pbar.close()
+    if text_pool is not None:
+        text_pool.shutdown()
+
+    _write_report(aggs, fout)
+    _sync(fout)
     fout.close()
 
 
 if __name__ == "__main__":
-    main()
+    if EVAL_MODE == "score_only":
+        score_only()
+    else:
+        main()
@@ -0,0 +1,244 @@
+from collections import deque
+from typing import Dict, List, Optional
+
+import torch
+
+from kv_cache import cache_kv, set_cache_kv, left_pad
+from prefix_cache import PrefixCache
+
+
+# ======================================================
+# Helpers
+# ======================================================
+def eos_token_ids(model, tokenizer) -> List[int]:
+    eos = getattr(model.generation_config, "eos_token_id", None)
+    if eos is None:
+        eos = tokenizer.eos_token_id
+    if eos is None:
+        return []
+    return [int(e) for e in (eos if isinstance(eos, (list, tuple)) else [eos])]
+
+
+# ======================================================
+# Backends
+# ======================================================
+class GenerationBackend:
+    """Turns chat-templated prompt texts into decoded completions.
+
+    Subclasses implement `generate_ids` on token ids; `generate` handles
+    tokenization and decoding so every backend sees identical inputs.
+    `refills_slots` tells the caller whether to hand over a whole schedule
+    window at once (the backend keeps its own slots busy) or pre-planned
+    static batches. With a `prefix_cache`, prompts starting with its tokens
+    only prefill their suffix.
+    """
+
+    refills_slots = False
+
+    def __init__(self, model, tokenizer, max_new_tokens: int, temperature: float,
+                 top_p: float, do_sample: bool, prefix_cache: Optional[PrefixCache] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.do_sample = do_sample
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.eos_ids = eos_token_ids(model, tokenizer)
+        self.prefix_cache = prefix_cache
+
+    def generate_ids(self, prompt_ids: List[List[int]]) -> List[List[int]]:
+        raise NotImplementedError
+
+    def generate(self, texts: List[str]) -> List[str]:
+        prompt_ids = self.tokenizer(texts)["input_ids"]
+        gen = self.generate_ids(prompt_ids)
+        return self.tokenizer.batch_decode(gen, skip_special_tokens=True)
+
+    def _trim_at_eos(self, ids: List[int]) -> List[int]:
+        for j, t in enumerate(ids):
+            if t in self.eos_ids:
+                return ids[:j + 1]
+        return ids
+
+
+class HFGenerateBackend(GenerationBackend):
+    """Reference backend: one left-padded `model.generate` call per batch."""
+
+    def _padded_inputs(self, prompt_ids: List[List[int]]) -> Dict[str, object]:
+        width = max(len(p) for p in prompt_ids)
+        input_ids = torch.full((len(prompt_ids), width), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompt_ids), width), dtype=torch.long)
+        for i, p in enumerate(prompt_ids):
+            input_ids[i, width - len(p):] = torch.tensor(p, dtype=torch.long)
+            attention_mask[i, width - len(p):] = 1
+        return {
+            "input_ids": input_ids.to(self.model.device),
+            "attention_mask": attention_mask.to(self.model.device),
+        }
+
+    def generate_ids(self, prompt_ids: List[List[int]], logits_processor=None,
+                     max_new_tokens: Optional[int] = None) -> List[List[int]]:
+        """`logits_processor` / `max_new_tokens` override the backend defaults for this batch."""
+        inputs = None
+        if self.prefix_cache is not None:
+            inputs = self.prefix_cache.generate_inputs(prompt_ids, self.pad_id)
+        if inputs is None:
+            inputs = self._padded_inputs(prompt_ids)
+        width = inputs["input_ids"].size(1)
+
+        with torch.inference_mode():
+            seqs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens or self.max_new_tokens,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                do_sample=self.do_sample,
+                pad_token_id=self.pad_id,
+                logits_processor=logits_processor,
+            )
+        # Every row's completion starts right after the shared padded width
+        return [self._trim_at_eos(row) for row in seqs[:, width:].tolist()]
+
+
+class ContinuousBatchingBackend(GenerationBackend):
+    """Decode loop that refills a finished slot with the next pending prompt.
+
+    Active sequences share one left-padded DynamicCache. A new prompt is
+    prefilled on its own and spliced into the batch; finished rows are
+    dropped from the cache and leading columns that became pure padding
+    are trimmed, so the batch never waits for its slowest member.
+    """
+
+    refills_slots = True
+
+    def __init__(self, model, tokenizer, max_new_tokens: int, temperature: float,
+                 top_p: float, do_sample: bool, prefix_cache: Optional[PrefixCache] = None,
+                 max_slots: int = 32):
+        super().__init__(model, tokenizer, max_new_tokens, temperature, top_p, do_sample, prefix_cache)
+        self.max_slots = max_slots
+
+    def _next_tokens(self, logits: torch.Tensor) -> torch.Tensor:
+        if not self.do_sample:
+            return logits.argmax(dim=-1)
+        logits = logits.float() / max(self.temperature, 1e-5)
+        if self.top_p < 1.0:
+            sorted_logits, sorted_idx = logits.sort(dim=-1, descending=True)
+            cum = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+            drop = cum - sorted_logits.softmax(dim=-1) > self.top_p
+            sorted_logits = sorted_logits.masked_fill(drop, float("-inf"))
+            logits = torch.full_like(logits, float("-inf")).scatter(-1, sorted_idx, sorted_logits)
+        return torch.multinomial(logits.softmax(dim=-1), 1).squeeze(-1)
+
+    def _prefill(self, ids: List[int]):
+        pc = self.prefix_cache
+        if pc is not None and pc.matches(ids):
+            out = self.model(
+                input_ids=torch.tensor([ids[pc.length:]], dtype=torch.long, device=self.model.device),
+                position_ids=torch.arange(pc.length, len(ids), device=self.model.device).unsqueeze(0),
+                past_key_values=pc.cache_for(1),
+                use_cache=True,
+            )
+        else:
+            input_ids = torch.tensor([ids], dtype=torch.long, device=self.model.device)
+            out = self.model(input_ids=input_ids, use_cache=True)
+        return out.past_key_values, self._next_tokens(out.logits[:, -1, :])
+
+    def generate_ids(self, prompt_ids: List[List[int]]) -> List[List[int]]:
+        device = self.model.device
+        queue = deque(range(len(prompt_ids)))
+        results: List[Optional[List[int]]] = [None] * len(prompt_ids)
+
+        cache = None                  # batched DynamicCache, rows aligned with `active`
+        mask = None                   # (rows, width) 1 for real cached tokens
+        active: List[int] = []        # prompt index per row
+        gen: Dict[int, List[int]] = {}
+        last = None                   # (rows,) sampled token not yet fed to the model
+
+        with torch.inference_mode():
+            while queue or active:
+                # ---- admit pending prompts into free slots ----
+                while queue and len(active) < self.max_slots:
+                    idx = queue.popleft()
+                    new_cache, tok = self._prefill(prompt_ids[idx])
+                    gen[idx] = [int(tok.item())]
+                    if self._finished(gen[idx]):
+                        results[idx] = gen[idx]
+                        continue
+                    new_mask = torch.ones((1, len(prompt_ids[idx])), dtype=torch.long, device=device)
+                    if cache is None:
+                        cache, mask, last = new_cache, new_mask, tok
+                    else:
+                        width, new_width = mask.size(1), new_mask.size(1)
+                        kv = []
+                        for (k, v), (nk, nv) in zip(cache_kv(cache), cache_kv(new_cache)):
+                            kv.append((
+                                torch.cat([left_pad(k, max(0, new_width - width)),
+                                           left_pad(nk, max(0, width - new_width))], dim=0),
+                                torch.cat([left_pad(v, max(0, new_width - width)),
+                                           left_pad(nv, max(0, width - new_width))], dim=0),
+                            ))
+                        set_cache_kv(cache, kv)
+                        mask = torch.cat([left_pad(mask, max(0, new_width - width)),
+                                          left_pad(new_mask, max(0, width - new_width))], dim=0)
+                        last = torch.cat([last, tok], dim=0)
+                    active.append(idx)
+
+                if not active:
+                    continue
+
+                # ---- one decode step for every active row ----
+                # Position of the fed token = number of real tokens already cached
+                position_ids = mask.sum(dim=1, keepdim=True)
+                mask = torch.cat([mask, mask.new_ones((mask.size(0), 1))], dim=1)
+                out = self.model(
+                    input_ids=last.unsqueeze(1),
+                    attention_mask=mask,
+                    position_ids=position_ids,
+                    past_key_values=cache,
+                    use_cache=True,
+                )
+                cache = out.past_key_values
+                last = self._next_tokens(out.logits[:, -1, :])
+
+                keep = []
+                for row, (idx, tok) in enumerate(zip(active, last.tolist())):
+                    gen[idx].append(tok)
+                    if self._finished(gen[idx]):
+                        results[idx] = gen[idx]
+                    else:
+                        keep.append(row)
+                if len(keep) == len(active):
+                    continue
+
+                # ---- evict finished rows, trim all-padding columns ----
+                active = [active[r] for r in keep]
+                if not active:
+                    cache, mask, last = None, None, None
+                    continue
+                rows = torch.tensor(keep, dtype=torch.long, device=device)
+                mask = mask.index_select(0, rows)
+                start = int(mask.any(dim=0).nonzero()[0])
+                mask = mask[:, start:]
+                set_cache_kv(cache, [(k.index_select(0, rows)[:, :, start:], v.index_select(0, rows)[:, :, start:])
+                                      for k, v in cache_kv(cache)])
+                last = last.index_select(0, rows)
+
+        return results
+
+    def _finished(self, ids: List[int]) -> bool:
+        return ids[-1] in self.eos_ids or len(ids) >= self.max_new_tokens
+
+
+GEN_BACKENDS = {
+    "hf": HFGenerateBackend,
+    "continuous": ContinuousBatchingBackend,
+}
+
+
+def make_backend(name: str, model, tokenizer, max_slots: int, **gen_kwargs) -> GenerationBackend:
+    if name not in GEN_BACKENDS:
+        raise ValueError(f"Unknown generation backend {name!r}; expected one of {sorted(GEN_BACKENDS)}")
+    if name == "continuous":
+        return ContinuousBatchingBackend(model, tokenizer, max_slots=max_slots, **gen_kwargs)
+    return GEN_BACKENDS[name](model, tokenizer, **gen_kwargs)
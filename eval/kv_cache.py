@@ -0,0 +1,41 @@
+from typing import List, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+# ======================================================
+# KV-cache access (DynamicCache layout differs across transformers versions)
+# ======================================================
+def cache_kv(cache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """Per-layer (keys, values), each shaped (batch, kv_heads, seq, head_dim)."""
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def set_cache_kv(cache, kv: List[Tuple[torch.Tensor, torch.Tensor]]):
+    if hasattr(cache, "layers"):
+        for layer, (k, v) in zip(cache.layers, kv):
+            layer.keys, layer.values = k, v
+    else:
+        cache.key_cache[:] = [k for k, _ in kv]
+        cache.value_cache[:] = [v for _, v in kv]
+
+
+def cache_from_kv(kv: List[Tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    """New DynamicCache holding copies of `kv` (update() concatenates into fresh tensors)."""
+    cache = DynamicCache()
+    for layer_idx, (k, v) in enumerate(kv):
+        cache.update(k, v, layer_idx)
+    return cache
+
+
+def left_pad(t: torch.Tensor, n: int) -> torch.Tensor:
+    """Left-pad the sequence axis (dim -2 of a KV tensor, dim -1 of a mask)."""
+    if n == 0:
+        return t
+    dim = -2 if t.dim() == 4 else -1
+    shape = list(t.shape)
+    shape[dim] = n
+    return torch.cat([t.new_zeros(shape), t], dim=dim)
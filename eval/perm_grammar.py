@@ -0,0 +1,131 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+
+# ======================================================
+# Grammar: "[" i1 ", " i2 ", " ... in "]" over a permutation of 1..n
+# ======================================================
+# Parser state: (phase, used bitmask, digits of the number being typed, items closed)
+START, ITEM, SPACE, DONE = range(4)
+State = Tuple[int, int, str, int]
+
+ALPHABET = frozenset("[]0123456789, ")
+
+
+def initial_state() -> State:
+    return (START, 0, "", 0)
+
+
+def _can_extend(digits: str, used: int, n: int) -> bool:
+    """Some unused index in 1..n is spelled starting with `digits`."""
+    if digits.startswith("0"):
+        return False
+    return any(not used >> v & 1 and str(v).startswith(digits) for v in range(1, n + 1))
+
+
+def advance(state: State, text: str, n: int) -> Optional[State]:
+    """State after reading `text`, or None if it leaves the grammar."""
+    phase, used, digits, count = state
+    for ch in text:
+        if phase == START:
+            if ch != "[":
+                return None
+            phase = ITEM
+        elif phase == ITEM:
+            if ch.isdigit():
+                if not _can_extend(digits + ch, used, n):
+                    return None
+                digits += ch
+                continue
+            if ch not in ",]" or not digits:
+                return None
+            v = int(digits)
+            if v > n or used >> v & 1:
+                return None
+            used |= 1 << v
+            count += 1
+            digits = ""
+            if ch == "]":
+                if count != n:
+                    return None
+                phase = DONE
+            else:
+                if count == n:
+                    return None
+                phase = SPACE
+        elif phase == SPACE:
+            if ch != " ":
+                return None
+            phase = ITEM
+        else:
+            return None
+    return (phase, used, digits, count)
+
+
+def max_permutation_tokens(n: int) -> int:
+    """Upper bound on generated tokens: one per character of the longest list, plus EOS."""
+    return len(str(list(range(1, n + 1)))) + 1
+
+
+# ======================================================
+# Token-level constraint
+# ======================================================
+class PermutationVocab:
+    """Token ids whose decoded text uses only the list alphabet, computed once per tokenizer."""
+
+    def __init__(self, tokenizer, eos_ids: Sequence[int]):
+        texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+        self.tokens: List[Tuple[int, str]] = [
+            (i, t) for i, t in enumerate(texts) if t and set(t) <= ALPHABET
+        ]
+        self.text: Dict[int, str] = dict(self.tokens)
+        self.eos_ids = list(eos_ids)
+
+
+class PermutationLogitsProcessor(LogitsProcessor):
+    """Masks every token that cannot continue a valid 1..n permutation list.
+
+    Row b of the batch must emit a permutation of 1..ns[b] written as
+    "[3, 1, 2]"; EOS is the only token allowed after the closing bracket.
+    The prompt width is taken from the first call, after which each call
+    advances every row by its last sampled token.
+    """
+
+    def __init__(self, vocab: PermutationVocab, ns: Sequence[int]):
+        self.vocab = vocab
+        self.ns = list(ns)
+        self.states: List[Optional[State]] = [initial_state() for _ in ns]
+        self.started = False
+        self._allowed: Dict[Tuple[State, int], List[int]] = {}
+
+    def _allowed_ids(self, state: State, n: int) -> List[int]:
+        key = (state, n)
+        if key not in self._allowed:
+            if state[0] == DONE:
+                ids = self.vocab.eos_ids
+            else:
+                ids = [i for i, t in self.vocab.tokens if advance(state, t, n) is not None]
+            self._allowed[key] = ids
+        return self._allowed[key]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.started:
+            for b, tok in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[b]
+                if state is None:
+                    continue
+                if state[0] == DONE or tok not in self.vocab.text:
+                    self.states[b] = None   # finished (EOS) — HF pads the row from here on
+                else:
+                    self.states[b] = advance(state, self.vocab.text[tok], self.ns[b])
+        self.started = True
+
+        mask = torch.full_like(scores, float("-inf"))
+        for b, state in enumerate(self.states):
+            if state is None:
+                mask[b] = 0
+            else:
+                mask[b, self._allowed_ids(state, self.ns[b])] = 0
+        return scores + mask
@@ -0,0 +1,83 @@
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from kv_cache import cache_kv, cache_from_kv
+
+
+# ======================================================
+# Shared-prefix KV cache
+# ======================================================
+def chat_prefix_ids(tokenizer, render: Callable[[str], str]) -> List[int]:
+    """Token ids every rendered prompt starts with.
+
+    `render` maps a user prompt to the full chat-template text. Two renderings
+    with different user text share exactly the system block and the opening
+    of the user turn; their longest common token prefix is what gets cached.
+    """
+    a = tokenizer(render("a"))["input_ids"]
+    b = tokenizer(render("b"))["input_ids"]
+    n = 0
+    while n < min(len(a), len(b)) and a[n] == b[n]:
+        n += 1
+    return a[:n]
+
+
+class PrefixCache:
+    """KV of a prompt prefix shared by all requests, prefilled once per model load.
+
+    Prompts that do not start with the cached token ids (e.g. a template
+    that tokenizes differently across the boundary) are reported by
+    `matches` so callers fall back to a full prefill.
+    """
+
+    def __init__(self, model, prefix_ids: List[int]):
+        self.prefix_ids = list(prefix_ids)
+        self.device = model.device
+        with torch.inference_mode():
+            out = model(
+                input_ids=torch.tensor([self.prefix_ids], dtype=torch.long, device=model.device),
+                use_cache=True,
+            )
+        self.kv = [(k.clone(), v.clone()) for k, v in cache_kv(out.past_key_values)]
+
+    @property
+    def length(self) -> int:
+        return len(self.prefix_ids)
+
+    def matches(self, ids: List[int]) -> bool:
+        return len(ids) > self.length and ids[:self.length] == self.prefix_ids
+
+    def cache_for(self, batch_size: int):
+        """Fresh DynamicCache with the prefix KV repeated over `batch_size` rows."""
+        return cache_from_kv([
+            (k.expand(batch_size, -1, -1, -1), v.expand(batch_size, -1, -1, -1))
+            for k, v in self.kv
+        ])
+
+    def generate_inputs(self, prompt_ids: List[List[int]], pad_id: int) -> Optional[Dict[str, object]]:
+        """`model.generate` kwargs that skip prefilling the prefix, or None if any prompt misses it.
+
+        Rows are laid out as [prefix][padding][suffix]; the padding is masked
+        out, so position ids (cumsum of the mask) and attention match a
+        left-padded batch of the full prompts.
+        """
+        if not all(self.matches(p) for p in prompt_ids):
+            return None
+        P = self.length
+        suffix_width = max(len(p) for p in prompt_ids) - P
+        width = P + suffix_width
+
+        input_ids = torch.full((len(prompt_ids), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompt_ids), width), dtype=torch.long)
+        input_ids[:, :P] = torch.tensor(self.prefix_ids, dtype=torch.long)
+        attention_mask[:, :P] = 1
+        for i, p in enumerate(prompt_ids):
+            input_ids[i, width - (len(p) - P):] = torch.tensor(p[P:], dtype=torch.long)
+            attention_mask[i, width - (len(p) - P):] = 1
+
+        return {
+            "input_ids": input_ids.to(self.device),
+            "attention_mask": attention_mask.to(self.device),
+            "past_key_values": self.cache_for(len(prompt_ids)),
+        }
@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+# ======================================================
+# Pair counting in O(n log n)
+# ======================================================
+def count_inversions(seq: Sequence[int]) -> int:
+    """Count strict inversions (i < j, seq[i] > seq[j]) by merge sort."""
+    def _sort(xs):
+        if len(xs) <= 1:
+            return xs, 0
+        mid = len(xs) // 2
+        left, inv_l = _sort(xs[:mid])
+        right, inv_r = _sort(xs[mid:])
+        merged, inv = [], inv_l + inv_r
+        i = j = 0
+        while i < len(left) and j < len(right):
+            if left[i] <= right[j]:
+                merged.append(left[i])
+                i += 1
+            else:
+                merged.append(right[j])
+                inv += len(left) - i
+                j += 1
+        merged.extend(left[i:])
+        merged.extend(right[j:])
+        return merged, inv
+    return _sort(list(seq))[1]
+
+
+def count_concordant(xs: Sequence[int], ys: Sequence[int]) -> int:
+    """Pairs i < j with (xs[i] - xs[j]) * (ys[i] - ys[j]) > 0, via a Fenwick tree.
+
+    Points are visited in increasing x; a group of equal x is queried before
+    it is inserted, so ties in either coordinate never count.
+    """
+    y_rank = {y: r + 1 for r, y in enumerate(sorted(set(ys)))}
+    tree = [0] * (len(y_rank) + 1)
+
+    def _add(i):
+        while i < len(tree):
+            tree[i] += 1
+            i += i & -i
+
+    def _prefix(i):  # number of inserted points with y-rank <= i
+        s = 0
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    order = sorted(range(len(xs)), key=lambda k: xs[k])
+    concordant = 0
+    g = 0
+    while g < len(order):
+        h = g
+        while h < len(order) and xs[order[h]] == xs[order[g]]:
+            h += 1
+        for k in order[g:h]:
+            concordant += _prefix(y_rank[ys[k]] - 1)
+        for k in order[g:h]:
+            _add(y_rank[ys[k]])
+        g = h
+    return concordant
+
+
+# ======================================================
+# Kendall tau variants used by the benchmarks
+# ======================================================
+def kendall_tau_from_pairs(pairs: List[Tuple[int, int]]) -> float:
+    """Tau of aligned (pred_idx, gt_idx) pairs as in eval_batch.py (ties count neither way)."""
+    n = len(pairs)
+    if n <= 1:
+        return 0.0
+    gt_seq = [gi for _, gi in pairs]
+    discord = count_inversions(gt_seq)
+    ties = sum(c * (c - 1) // 2 for c in Counter(gt_seq).values())
+    concord = n * (n - 1) // 2 - discord - ties
+    total = concord + discord
+    return (concord - discord) / total if total else 0.0
+
+
+def _order_ranks(gt: Sequence[int], pr: Sequence[int]) -> Tuple[List[int], List[int]]:
+    gt_rank = {v: i for i, v in enumerate(gt)}
+    pr_rank = {v: i for i, v in enumerate(pr)}
+    return [gt_rank[v] for v in gt], [pr_rank[v] for v in gt]
+
+
+def kendall_pair_counts(gt: Sequence[int], pr: Sequence[int]) -> Tuple[int, int]:
+    """(concordant, total) over all position pairs of `gt`, as ORD.py defines them.
+
+    A pair is concordant when gt and pr order its two values the same way.
+    """
+    xs, ys = _order_ranks(gt, pr)
+    n = len(gt)
+    return count_concordant(xs, ys), n * (n - 1) // 2
+
+
+def kendall_pair_counts_batch(gts: List[Sequence[int]], preds: List[Sequence[int]],
+                              max_elems: int = 1 << 24) -> Tuple[np.ndarray, np.ndarray]:
+    """kendall_pair_counts for many samples at once.
+
+    Samples of equal length share one vectorised sign comparison over all
+    n*(n-1)/2 position pairs; `max_elems` bounds the work array per chunk.
+    """
+    N = len(gts)
+    concordant = np.zeros(N, dtype=np.int64)
+    total = np.zeros(N, dtype=np.int64)
+
+    by_len = defaultdict(list)
+    ranks = []
+    for k, (gt, pr) in enumerate(zip(gts, preds)):
+        ranks.append(_order_ranks(gt, pr))
+        by_len[len(gt)].append(k)
+
+    for n, ks in by_len.items():
+        total[ks] = n * (n - 1) // 2
+        if n < 2:
+            continue
+        iu, ju = np.triu_indices(n, 1)
+        step = max(1, max_elems // (n * n))
+        for s in range(0, len(ks), step):
+            chunk = ks[s:s+step]
+            X = np.asarray([ranks[k][0] for k in chunk], dtype=np.int64)
+            Y = np.asarray([ranks[k][1] for k in chunk], dtype=np.int64)
+            dx = np.sign(X[:, iu] - X[:, ju])
+            dy = np.sign(Y[:, iu] - Y[:, ju])
+            concordant[chunk] = (dx * dy > 0).sum(axis=1)
+    return concordant, total
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+
+
+# ======================================================
+# Gold-side reference cache
+# ======================================================
+def _slug(name: str) -> str:
+    return name.strip("/").replace("/", "--")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ReferenceCache:
+    """On-disk cache of everything eval_batch.py derives from gold <orc> texts.
+
+    Layout under `root`:
+      bertscore__<model>__L<layers>/<sha256>.emb.npy   token embeddings (float32)
+      bertscore__<model>__L<layers>/<sha256>.idf.npy   token weights
+      keybert__<model>.jsonl                          {"hash": ..., "keywords": [...]}
+
+    Embeddings are opened with mmap_mode="r", so a run only pages in the
+    references it actually scores.
+    """
+
+    def __init__(self, root: str, bert_model: str, num_layers: int, kw_model: str):
+        self.bert_dir = os.path.join(root, f"bertscore__{_slug(bert_model)}__L{num_layers}")
+        self.kw_path = os.path.join(root, f"keybert__{_slug(kw_model)}.jsonl")
+        os.makedirs(self.bert_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+        self._keywords: Dict[str, List[str]] = {}
+        if os.path.exists(self.kw_path):
+            with open(self.kw_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        obj = json.loads(line)
+                        self._keywords[obj["hash"]] = obj["keywords"]
+                    except Exception:
+                        continue  # tolerate a torn final line
+
+    # ---------------- BERTScore embeddings ----------------
+    def get_embedding(self, text: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        base = os.path.join(self.bert_dir, text_hash(text))
+        try:
+            emb = np.load(base + ".emb.npy", mmap_mode="r")
+            idf = np.load(base + ".idf.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return emb, idf
+
+    def put_embedding(self, text: str, emb: np.ndarray, idf: np.ndarray):
+        base = os.path.join(self.bert_dir, text_hash(text))
+        # idf first: a present .emb.npy always has its weights next to it
+        for suffix, arr in ((".idf.npy", idf), (".emb.npy", emb)):
+            tmp = f"{base}{suffix}.tmp{os.getpid()}"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, base + suffix)
+
+    # ---------------- KeyBERT keywords ----------------
+    def get_keywords(self, text: str) -> Optional[Set[str]]:
+        kws = self._keywords.get(text_hash(text))
+        if kws is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return set(kws)
+
+    def put_keywords_many(self, items: List[Tuple[str, Set[str]]]):
+        if not items:
+            return
+        with open(self.kw_path, "a", encoding="utf-8") as f:
+            for text, kws in items:
+                h = text_hash(text)
+                self._keywords[h] = sorted(kws)
+                f.write(json.dumps({"hash": h, "keywords": self._keywords[h]}, ensure_ascii=False) + "\n")
+
+
+# ======================================================
+# BERTScore with cached references
+# ======================================================
+def _idf_dict(tokenizer):
+    # Same weights BERTScorer uses with idf=False
+    idf_dict = defaultdict(lambda: 1.0)
+    idf_dict[tokenizer.sep_token_id] = 0
+    idf_dict[tokenizer.cls_token_id] = 0
+    return idf_dict
+
+
+def _embed_sentences(scorer, sents: List[str], batch_size: int) -> Dict[str, Tuple[torch.Tensor, torch.Tensor]]:
+    """Per-sentence (embedding, idf) tensors, built as bert_cos_score_idf does."""
+    idf_dict = _idf_dict(scorer._tokenizer)
+    uniq = sorted(set(sents), key=lambda x: len(x.split(" ")), reverse=True)
+    stats = {}
+    for i in range(0, len(uniq), batch_size):
+        batch = uniq[i:i+batch_size]
+        embs, masks, padded_idf = get_bert_embedding(
+            batch, scorer._model, scorer._tokenizer, idf_dict, device=scorer.device
+        )
+        embs, masks, padded_idf = embs.cpu(), masks.cpu(), padded_idf.cpu()
+        for j, sen in enumerate(batch):
+            L = masks[j].sum().item()
+            stats[sen] = (embs[j, :L], padded_idf[j, :L])
+    return stats
+
+
+def _pad_stats(stats: List[Tuple[torch.Tensor, torch.Tensor]], device):
+    emb = [e.to(device) for e, _ in stats]
+    idf = [i.to(device) for _, i in stats]
+    lens = torch.tensor([e.size(0) for e in emb], dtype=torch.long)
+    emb_pad = pad_sequence(emb, batch_first=True, padding_value=2.0)
+    idf_pad = pad_sequence(idf, batch_first=True)
+    mask = torch.arange(int(lens.max())).expand(len(lens), -1) < lens.unsqueeze(1)
+    return emb_pad, mask.to(device), idf_pad
+
+
+def score_with_ref_cache(scorer, cands: List[str], refs: List[str],
+                         cache: ReferenceCache, batch_size: int = 64):
+    """BERTScore (P, R, F) like BERTScorer.score, encoding only uncached refs."""
+    ref_stats = {}
+    missing = []
+    for r in set(refs):
+        hit = cache.get_embedding(r)
+        if hit is None:
+            missing.append(r)
+        else:
+            ref_stats[r] = (torch.from_numpy(np.array(hit[0])), torch.from_numpy(np.array(hit[1])))
+    for r, (emb, idf) in _embed_sentences(scorer, missing, batch_size).items():
+        cache.put_embedding(r, emb.numpy(), idf.numpy())
+        ref_stats[r] = (emb, idf)
+
+    hyp_stats = _embed_sentences(scorer, cands, batch_size)
+
+    device = next(scorer._model.parameters()).device
+    preds = []
+    with torch.no_grad():
+        for s in range(0, len(refs), batch_size):
+            P, R, F1 = greedy_cos_idf(
+                *_pad_stats([ref_stats[r] for r in refs[s:s+batch_size]], device),
+                *_pad_stats([hyp_stats[c] for c in cands[s:s+batch_size]], device),
+                False,
+            )
+            preds.append(torch.stack((P, R, F1), dim=-1).cpu())
+    out = torch.cat(preds, dim=0)
+    return out[:, 0], out[:, 1], out[:, 2]
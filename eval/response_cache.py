@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Any, Callable, Dict, List, Optional
+
+
+# ======================================================
+# Persistent exact-match response cache
+# ======================================================
+_WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".json")
+
+
+def model_fingerprint(model) -> str:
+    """Identify the loaded checkpoint without hashing its weights.
+
+    Local checkpoints are fingerprinted by (name, size, mtime) of their
+    weight and config files, hub checkpoints by repo id and commit; the
+    parameter dtype is included since it changes greedy outputs.
+    """
+    cfg = model.config
+    path = getattr(cfg, "_name_or_path", "") or ""
+    parts: List[Any] = [path, str(getattr(model, "dtype", ""))]
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(_WEIGHT_SUFFIXES):
+                st = os.stat(os.path.join(path, name))
+                parts.append((name, st.st_size, st.st_mtime_ns))
+    else:
+        parts.append(getattr(cfg, "_commit_hash", None))
+        parts.append(cfg.to_json_string(use_diff=False))
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of generated responses keyed by everything that determines them.
+
+    The key is sha256(model fingerprint, generation config, chat-templated
+    prompt text); the prompt text already carries the system prompt and
+    template flags such as enable_thinking. Entries are evicted least
+    recently used once `max_entries` or `max_bytes` is exceeded (0 = no
+    limit). Sampled generation (`do_sample=True`) bypasses the cache unless
+    `cache_sampled` is set, since a stored sample would be replayed forever.
+    """
+
+    def __init__(self, path: str, model, gen_cfg: Dict[str, Any], max_entries: int = 0,
+                 max_bytes: int = 0, cache_sampled: bool = False):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "nbytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+        self.conn.commit()
+        self.namespace = json.dumps(
+            {"model": model_fingerprint(model), "gen": gen_cfg}, sort_keys=True
+        )
+        self.enabled = cache_sampled or not gen_cfg.get("do_sample", False)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[str]]:
+        if not self.enabled:
+            self.misses += len(texts)
+            return [None] * len(texts)
+        keys = [self._key(t) for t in texts]
+        found: Dict[str, str] = {}
+        for s in range(0, len(keys), 500):   # stay under SQLite's bound-parameter limit
+            chunk = keys[s:s + 500]
+            rows = self.conn.execute(
+                f"SELECT key, response FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                  [(now, k) for k in found])
+            self.conn.commit()
+        out = [found.get(k) for k in keys]
+        self.hits += sum(o is not None for o in out)
+        self.misses += sum(o is None for o in out)
+        return out
+
+    def put_many(self, texts: List[str], responses: List[str]) -> None:
+        if not self.enabled or not texts:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, response, nbytes, last_access) VALUES (?, ?, ?, ?)",
+            [(self._key(t), r, len(r.encode("utf-8")), now) for t, r in zip(texts, responses)],
+        )
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.max_entries > 0:
+            n = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if n > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)", (n - self.max_entries,)
+                )
+        if self.max_bytes > 0:
+            total = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                drop = []
+                for key, nbytes in self.conn.execute(
+                        "SELECT key, nbytes FROM responses ORDER BY last_access ASC"):
+                    if total <= self.max_bytes:
+                        break
+                    drop.append((key,))
+                    total -= nbytes
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", drop)
+
+    def generate(self, texts: List[str], generate_fn: Callable[[List[str]], List[str]]) -> List[str]:
+        """Serve cached texts, run `generate_fn` on the misses only, and store its outputs."""
+        if not self.enabled:
+            self.misses += len(texts)
+            return generate_fn(texts)
+        out = self.get_many(texts)
+        # Duplicate prompts within the call are generated once
+        todo = list(dict.fromkeys(t for t, o in zip(texts, out) if o is None))
+        if todo:
+            fresh = dict(zip(todo, generate_fn(todo)))
+            self.put_many(todo, [fresh[t] for t in todo])
+            out = [fresh[t] if o is None else o for t, o in zip(texts, out)]
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "enabled": self.enabled}
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,111 @@
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+# ======================================================
+# Incremental <think>/<key>/<orc>/<note> parser
+# ======================================================
+BLOCK_TAGS = ("think", "key", "orc", "note")
+
+# Same line shape as eval_batch.STEP_JSON_PAT
+STEP_JSON_PAT = re.compile(
+    r"^Step\s+(\d+)\s*:\s*(\{.*\})\s*$",
+    flags=re.IGNORECASE
+)
+
+
+def _hold_partial(buf: str, tokens: Tuple[str, ...]) -> Tuple[str, str]:
+    """Split off the longest suffix of `buf` that may still grow into one of `tokens`."""
+    low = buf.lower()
+    for k in range(min(max(len(t) for t in tokens) - 1, len(buf)), 0, -1):
+        if any(t.startswith(low[-k:]) for t in tokens):
+            return buf[:-k], buf[-k:]
+    return buf, ""
+
+
+def parse_step_line(line: str) -> Optional[Tuple[int, Optional[Dict]]]:
+    """(step number, JSON object or None if malformed) for a 'Step N: {...}' line."""
+    m = STEP_JSON_PAT.match(line.strip())
+    if not m:
+        return None
+    try:
+        obj = json.loads(m.group(2))
+    except Exception:
+        obj = None
+    return int(m.group(1)), obj if isinstance(obj, dict) else None
+
+
+class BlockStreamParser:
+    """Turns streamed text chunks into structured events.
+
+    feed() returns the events completed by a chunk:
+      {"event": "open",  "tag": "key"}
+      {"event": "step",  "number": 2, "step": {...} or None, "line": "Step 2: {...}"}
+      {"event": "close", "tag": "key", "content": "..."}
+    Tags may be split across chunks; text between blocks is ignored. A
+    step is emitted as soon as its line in <key> ends (newline or </key>).
+    finish() flushes a block left open when generation stopped early.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.tag: Optional[str] = None
+        self.content: List[str] = []
+        self.line = ""
+
+    def _key_text(self, text: str, final: bool = False) -> List[Dict]:
+        events = []
+        lines = (self.line + text).split("\n")
+        self.line = "" if final else lines.pop()
+        for ln in lines:
+            parsed = parse_step_line(ln)
+            if parsed is not None:
+                events.append({"event": "step", "number": parsed[0], "step": parsed[1], "line": ln.strip()})
+        return events
+
+    def _block_text(self, text: str) -> List[Dict]:
+        if not text:
+            return []
+        self.content.append(text)
+        return self._key_text(text) if self.tag == "key" else []
+
+    def _close(self) -> List[Dict]:
+        events = self._key_text("", final=True) if self.tag == "key" else []
+        events.append({"event": "close", "tag": self.tag, "content": "".join(self.content)})
+        self.tag, self.content, self.line = None, [], ""
+        return events
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.buf += chunk
+        events: List[Dict] = []
+        while self.buf:
+            low = self.buf.lower()
+            if self.tag is None:
+                hits = [(low.find(f"<{t}>"), t) for t in BLOCK_TAGS]
+                hits = [(i, t) for i, t in hits if i >= 0]
+                if not hits:
+                    _, self.buf = _hold_partial(self.buf, tuple(f"<{t}>" for t in BLOCK_TAGS))
+                    break
+                i, tag = min(hits)
+                self.buf = self.buf[i + len(tag) + 2:]
+                self.tag = tag
+                events.append({"event": "open", "tag": tag})
+            else:
+                close = f"</{self.tag}>"
+                i = low.find(close)
+                if i < 0:
+                    text, self.buf = _hold_partial(self.buf, (close,))
+                    events.extend(self._block_text(text))
+                    break
+                events.extend(self._block_text(self.buf[:i]))
+                self.buf = self.buf[i + len(close):]
+                events.extend(self._close())
+        return events
+
+    def finish(self) -> List[Dict]:
+        if self.tag is None:
+            self.buf = ""
+            return []
+        events = self._block_text(self.buf)
+        self.buf = ""
+        return events + self._close()
@@ -1,20 +1,36 @@
 import os
+import sys
+import json
+from threading import Thread
+from typing import Dict, Iterator, List, Optional, Tuple
+
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval"))
+from prefix_cache import PrefixCache, chat_prefix_ids
+from response_cache import ResponseCache
+from stream_parser import BlockStreamParser
 
 # ======================================================
 # Fixed configuration
 # ======================================================
 MODEL_PATH = os.getenv("MODEL_PATH")  
 DTYPE = "bfloat16"
-ATTN_IMPL = "flash_attention_2"
-DEVICE_MAP = "auto"
+ATTN_IMPL = os.getenv("ATTN_IMPL", "flash_attention_2")   # "sdpa" on CPU
+DEVICE_MAP = os.getenv("DEVICE_MAP", "auto")         # "" loads without a device map (CPU, no accelerate)
 
 MAX_NEW_TOKENS = 1024
 TEMPERATURE    = 0.6
 TOP_P          = 0.95
 DO_SAMPLE      = True
 
+STREAM = os.getenv("STREAM", "0") == "1"   # print tokens and block/step events as they arrive
+# Exact-match response cache (SQLite path, "" disables); sampled outputs are
+# only cached with RESPONSE_CACHE_SAMPLED=1
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "").strip()
+RESPONSE_CACHE_SAMPLED = os.getenv("RESPONSE_CACHE_SAMPLED", "0") == "1"
+
 
 # ======================================================
 # Prompts — USER ONLY EDITS THESE TWO
@@ -32,7 +48,7 @@ def load_model_and_tokenizer(model_path: str):
         model_path,
         torch_dtype=dtype,
         attn_implementation=ATTN_IMPL,
-        device_map=DEVICE_MAP,
+        device_map=DEVICE_MAP or None,
     )
     tokenizer = AutoTokenizer.from_pretrained(model_path)
 
@@ -44,19 +60,60 @@ def load_model_and_tokenizer(model_path: str):
 # ======================================================
 # Single inference
 # ======================================================
-def generate(model, tokenizer, system_prompt: str, user_prompt: str) -> str:
+def build_chat_text(tokenizer, system_prompt: str, user_prompt: str) -> str:
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user",   "content": user_prompt},
     ]
-    text = tokenizer.apply_chat_template(
+    return tokenizer.apply_chat_template(
         messages,
         tokenize=False,
         add_generation_prompt=True,
         enable_thinking=True,
     )
 
-    inputs = tokenizer([text], return_tensors="pt").to(model.device)
+
+def build_prefix_cache(model, tokenizer, system_prompt: str) -> PrefixCache:
+    """KV of the system-prompt chat prefix; build once and pass to every generate() call."""
+    return PrefixCache(model, chat_prefix_ids(
+        tokenizer, lambda up: build_chat_text(tokenizer, system_prompt, up)
+    ))
+
+
+def _model_inputs(model, tokenizer, text: str, prefix_cache: Optional[PrefixCache]):
+    inputs = None
+    if prefix_cache is not None:
+        inputs = prefix_cache.generate_inputs(tokenizer([text])["input_ids"], tokenizer.pad_token_id)
+    if inputs is None:
+        inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    return inputs
+
+
+def make_response_cache(model) -> Optional[ResponseCache]:
+    if not RESPONSE_CACHE:
+        return None
+    gen_cfg = {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "do_sample": DO_SAMPLE,
+    }
+    return ResponseCache(RESPONSE_CACHE, model, gen_cfg, cache_sampled=RESPONSE_CACHE_SAMPLED)
+
+
+def generate(model, tokenizer, system_prompt: str, user_prompt: str,
+             prefix_cache: Optional[PrefixCache] = None,
+             response_cache: Optional[ResponseCache] = None) -> str:
+    text = build_chat_text(tokenizer, system_prompt, user_prompt)
+    if response_cache is not None:
+        return response_cache.generate(
+            [text], lambda texts: [_generate_text(model, tokenizer, t, prefix_cache) for t in texts]
+        )[0]
+    return _generate_text(model, tokenizer, text, prefix_cache)
+
+
+def _generate_text(model, tokenizer, text: str, prefix_cache: Optional[PrefixCache]) -> str:
+    inputs = _model_inputs(model, tokenizer, text, prefix_cache)
 
     with torch.inference_mode():
         output_ids = model.generate(
@@ -68,10 +125,58 @@ def generate(model, tokenizer, system_prompt: str, user_prompt: str) -> str:
             pad_token_id=tokenizer.pad_token_id,
         )
 
-    gen_ids = output_ids[0][inputs.input_ids.shape[1]:]
+    gen_ids = output_ids[0][inputs["input_ids"].shape[1]:]
     return tokenizer.decode(gen_ids, skip_special_tokens=True)
 
 
+# ======================================================
+# Streaming inference
+# ======================================================
+def stream_generate(model, tokenizer, system_prompt: str, user_prompt: str,
+                    prefix_cache: Optional[PrefixCache] = None) -> Iterator[str]:
+    """Like generate(), but yields decoded text pieces as tokens are produced."""
+    text = build_chat_text(tokenizer, system_prompt, user_prompt)
+    inputs = _model_inputs(model, tokenizer, text, prefix_cache)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    error: List[BaseException] = []
+
+    def _run():
+        try:
+            with torch.inference_mode():
+                model.generate(
+                    **inputs,
+                    max_new_tokens=MAX_NEW_TOKENS,
+                    temperature=TEMPERATURE,
+                    top_p=TOP_P,
+                    do_sample=DO_SAMPLE,
+                    pad_token_id=tokenizer.pad_token_id,
+                    streamer=streamer,
+                )
+        except BaseException as e:  # surface in the consumer instead of hanging it
+            error.append(e)
+            streamer.end()
+
+    worker = Thread(target=_run, daemon=True)
+    worker.start()
+    for piece in streamer:
+        if piece:
+            yield piece
+    worker.join()
+    if error:
+        raise error[0]
+
+
+def stream_events(model, tokenizer, system_prompt: str, user_prompt: str,
+                  prefix_cache: Optional[PrefixCache] = None) -> Iterator[Tuple[str, List[Dict]]]:
+    """Yield (text piece, events completed by it); see stream_parser.BlockStreamParser."""
+    parser = BlockStreamParser()
+    for piece in stream_generate(model, tokenizer, system_prompt, user_prompt, prefix_cache):
+        yield piece, parser.feed(piece)
+    tail = parser.finish()
+    if tail:
+        yield "", tail
+
+
 # ======================================================
 # Main
 # ======================================================
@@ -80,7 +185,20 @@ def main():
     model, tokenizer = load_model_and_tokenizer(MODEL_PATH)
     print("Model loaded.\n")
 
-    result = generate(model, tokenizer, SYSTEM_PROMPT, USER_PROMPT)
+    prefix_cache = build_prefix_cache(model, tokenizer, SYSTEM_PROMPT)
+    if STREAM:
+        for piece, events in stream_events(model, tokenizer, SYSTEM_PROMPT, USER_PROMPT, prefix_cache):
+            print(piece, end="", flush=True)
+            for ev in events:
+                if ev["event"] == "step":
+                    print(f"\n[step {ev['number']} ready] {json.dumps(ev['step'], ensure_ascii=False)}", flush=True)
+        print()
+        return
+
+    response_cache = make_response_cache(model)
+    result = generate(model, tokenizer, SYSTEM_PROMPT, USER_PROMPT, prefix_cache, response_cache)
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
 
     print("=== Model Output ===")
     print(result)
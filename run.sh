@@ -5,7 +5,11 @@ set -e
 export TRAIN_DATA="${TRAIN_DATA:-xxx/train.parquet}"
 export TEST_DATA="${TEST_DATA:-xxx/test.parquet}"
 export MODEL_PATH="${MODEL_PATH:-xxx}"
-export REWARD_PATH="${REWARD_PATH:-./verl/verl/utils/reward_score/SCORE.py}"
+export REWARD_PATH="${REWARD_PATH:-./train/SCORE.py}"
+
+# Prompt length (allow override); train/build_rl_parquet.py filters with the same MAX_PROMPT_LENGTH
+export MAX_PROMPT_LENGTH="${MAX_PROMPT_LENGTH:-1024}"
+export FILTER_OVERLONG_PROMPTS="${FILTER_OVERLONG_PROMPTS:-True}"   # False for pre-filtered parquet
 
 export PROJECT_NAME="${PROJECT_NAME:-Thoth}"
 export EXPERIMENT_NAME="${EXPERIMENT_NAME:-Thoth_exp1}"
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from infer import (
+    MODEL_PATH, SYSTEM_PROMPT, MAX_NEW_TOKENS, TEMPERATURE, TOP_P, DO_SAMPLE,
+    load_model_and_tokenizer, build_chat_text, build_prefix_cache,
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval"))
+from gen_backend import HFGenerateBackend
+
+# ======================================================
+# Server configuration
+# ======================================================
+HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVE_PORT", "8000"))
+UNIX_SOCKET = os.getenv("SERVE_UNIX_SOCKET", "")         # serve on this path instead of HOST:PORT
+
+MAX_BATCH_SIZE = int(os.getenv("SERVE_MAX_BATCH", "8"))  # requests per generate call
+MAX_WAIT_MS = float(os.getenv("SERVE_MAX_WAIT_MS", "20"))  # how long the first request waits for company
+REQUEST_TIMEOUT_S = float(os.getenv("SERVE_REQUEST_TIMEOUT_S", "600"))
+LATENCY_WINDOW = 1024                                     # recent requests kept for percentiles
+
+
+# ======================================================
+# Metrics
+# ======================================================
+class ServerMetrics:
+    """Thread-safe counters plus a window of recent end-to-end latencies."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record_batch(self, size: int) -> None:
+        with self.lock:
+            self.batches += 1
+            self.batched_requests += size
+
+    def record_request(self, latency_s: float, ok: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.errors += int(not ok)
+            if ok:
+                self.latencies.append(latency_s)
+
+    def snapshot(self, queue_depth: int) -> Dict[str, float]:
+        with self.lock:
+            lat = sorted(self.latencies)
+            pct = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+            return {
+                "uptime_s": time.time() - self.started,
+                "requests_total": self.requests,
+                "errors_total": self.errors,
+                "batches_total": self.batches,
+                "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+                "queue_depth": queue_depth,
+                "latency_ms_mean": sum(lat) / len(lat) * 1000 if lat else 0.0,
+                "latency_ms_p50": pct(0.50),
+                "latency_ms_p95": pct(0.95),
+                "latency_ms_max": lat[-1] * 1000 if lat else 0.0,
+            }
+
+
+# ======================================================
+# Micro-batching scheduler
+# ======================================================
+class MicroBatcher:
+    """Collects concurrent requests and runs them through one resident model.
+
+    A single worker thread owns the model. It blocks for the first queued
+    request, then keeps collecting for up to `max_wait_ms` or until
+    `max_batch_size` requests are in hand, and generates them as one
+    left-padded batch. Requests using the default system prompt share its
+    prefix KV cache.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.tokenizer = tokenizer
+        self.backend = HFGenerateBackend(
+            model, tokenizer,
+            max_new_tokens=MAX_NEW_TOKENS,
+            temperature=TEMPERATURE,
+            top_p=TOP_P,
+            do_sample=DO_SAMPLE,
+            prefix_cache=build_prefix_cache(model, tokenizer, SYSTEM_PROMPT),
+        )
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.metrics = ServerMetrics()
+        self.worker = threading.Thread(target=self._loop, name="generate-worker", daemon=True)
+        self.worker.start()
+
+    def submit(self, user_prompt: str, system_prompt: Optional[str] = None) -> Future:
+        text = build_chat_text(self.tokenizer, system_prompt or SYSTEM_PROMPT, user_prompt)
+        fut: Future = Future()
+        self.queue.put((text, fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            self.metrics.record_batch(len(batch))
+            try:
+                outputs = self.backend.generate([text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), out in zip(batch, outputs):
+                fut.set_result(out)
+
+
+# ======================================================
+# HTTP front end
+# ======================================================
+class GenerateHandler(BaseHTTPRequestHandler):
+    """POST /generate {"prompt": ..., "system": optional}; GET /metrics; GET /health."""
+
+    batcher: MicroBatcher = None   # set by make_server
+
+    def _send_json(self, code: int, payload: Dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, self.batcher.metrics.snapshot(self.batcher.queue.qsize()))
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        t0 = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+            prompt = req["prompt"]
+            if not isinstance(prompt, str):
+                raise ValueError("'prompt' must be a string")
+        except Exception as e:
+            self.batcher.metrics.record_request(time.perf_counter() - t0, ok=False)
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        try:
+            response = self.batcher.submit(prompt, req.get("system")).result(timeout=REQUEST_TIMEOUT_S)
+        except Exception as e:
+            self.batcher.metrics.record_request(time.perf_counter() - t0, ok=False)
+            self._send_json(500, {"error": repr(e)})
+            return
+        latency = time.perf_counter() - t0
+        self.batcher.metrics.record_request(latency, ok=True)
+        self._send_json(200, {"response": response, "latency_ms": latency * 1000})
+
+    def address_string(self):
+        # Unix-socket peers have no (host, port) address
+        return self.client_address[0] if self.client_address else UNIX_SOCKET
+
+    def log_message(self, fmt, *args):
+        sys.stderr.write(f"[serve] {self.address_string()} - {fmt % args}\n")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher: MicroBatcher, host: str = HOST, port: int = PORT,
+                unix_socket: str = UNIX_SOCKET):
+    handler = type("BoundGenerateHandler", (GenerateHandler,), {"batcher": batcher})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# ======================================================
+# Main
+# ======================================================
+def main():
+    print("Loading model...")
+    model, tokenizer = load_model_and_tokenizer(MODEL_PATH)
+    print("Model loaded.\n")
+
+    batcher = MicroBatcher(model, tokenizer)
+    server = make_server(batcher)
+    where = UNIX_SOCKET or f"http://{HOST}:{PORT}"
+    print(f"Serving on {where} (max batch {MAX_BATCH_SIZE}, max wait {MAX_WAIT_MS:g} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if UNIX_SOCKET and os.path.exists(UNIX_SOCKET):
+            os.unlink(UNIX_SOCKET)
+
+
+if __name__ == "__main__":
+    main()
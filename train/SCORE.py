@@ -0,0 +1,380 @@
+import os
+import re
+import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+# ======================================================
+# SCORE configuration
+# ======================================================
+ORDER_MODE = os.getenv("GRPO_ORDER_MODE", "strict_subseq")      # or "lcs"
+COMBINE_MODE = os.getenv("GRPO_COMBINE_MODE", "sum")             # order x content: "sum" or "product"
+CONTENT_DENOM = os.getenv("GRPO_CONTENT_DENOM", "matched")       # or "max_len"
+FINAL_COMBINE = os.getenv("GRPO_FINAL_COMBINE", "product")       # scale x semantics: "product" or "sum"
+LAMBDA_DECAY = float(os.getenv("LAMBDA_DECAY", "1.5"))
+GOLD_CACHE_SIZE = int(os.getenv("GOLD_CACHE_SIZE", "65536"))     # parsed gold keys kept per process
+REWARD_WORKERS = int(os.getenv("REWARD_WORKERS", str(min(8, os.cpu_count() or 1))))
+REWARD_MIN_PARALLEL = int(os.getenv("REWARD_MIN_PARALLEL", "256"))  # smaller batches are scored inline
+
+# ======================================================
+# Parsing (same rules as eval/eval_batch.py)
+# ======================================================
+TAG_PATTERN = re.compile(
+    r"^\s*<think>(?P<think>.*?)</think>\s*"
+    r"<key>(?P<key>.*?)</key>\s*"
+    r"<orc>(?P<orc>.*?)</orc>\s*"
+    r"<note>(?P<note>.*?)</note>\s*$",
+    flags=re.DOTALL | re.IGNORECASE
+)
+KEY_PATTERN = re.compile(r"<key>(.*?)</key>", flags=re.DOTALL | re.IGNORECASE)
+STEP_JSON_PAT = re.compile(r"^Step\s+(\d+)\s*:\s*(\{.*\})\s*$", flags=re.IGNORECASE)
+STEP_TEXT_PAT = re.compile(r"^Step\s+(\d+)\s*:\s*\S", flags=re.IGNORECASE)
+
+
+def step_lines(block: str) -> List[str]:
+    return [ln.strip() for ln in block.strip().splitlines() if ln.strip()]
+
+
+def _lower_list_str(lst: Any) -> List[str]:
+    if not isinstance(lst, list):
+        return []
+    return [x.strip().lower() for x in lst if isinstance(x, str) and x.strip()]
+
+
+def _keyword_set(text: str) -> FrozenSet[str]:
+    if not text:
+        return frozenset()
+    return frozenset(t for t in re.split(r"[^a-z0-9%µμ\-\._]+", text.lower()) if t)
+
+
+def parse_key_steps(block: str, strict: bool = True) -> Optional[List[Dict[str, Any]]]:
+    """Steps of a <key> block.
+
+    strict (predictions): None if any line is not a well-formed step object.
+    Lenient (gold): malformed lines are skipped, as in train/build_rl_parquet.py.
+    """
+    steps = []
+    for ln in step_lines(block):
+        m = STEP_JSON_PAT.match(ln)
+        try:
+            obj = json.loads(m.group(2)) if m else None
+        except Exception:
+            obj = None
+        well_formed = (isinstance(obj, dict) and isinstance(obj.get("action"), str)
+                       and isinstance(obj.get("objects"), list) and isinstance(obj.get("parameters"), list))
+        if strict and not well_formed:
+            return None
+        if not isinstance(obj, dict):
+            continue
+        action = obj.get("action", "")
+        steps.append({
+            "number": int(m.group(1)),
+            "action": action.strip().lower() if isinstance(action, str) else "",
+            "objects": _lower_list_str(obj.get("objects", [])),
+            "parameters": _lower_list_str(obj.get("parameters", [])),
+        })
+    return steps
+
+
+# ======================================================
+# Gold cache
+# ======================================================
+class StepFeatures:
+    """What the semantics reward reads from one step, precomputed once."""
+
+    __slots__ = ("objects", "object_kw", "has_params", "param_kw")
+
+    def __init__(self, objects: List[str], parameters: List[str]):
+        self.objects = frozenset(objects)
+        self.object_kw = _keyword_set(" ".join(objects))
+        self.has_params = bool(parameters)
+        self.param_kw = _keyword_set(" ".join(parameters))
+
+
+class GoldKey:
+    __slots__ = ("action_ids", "steps")
+
+    def __init__(self, action_ids: Tuple[int, ...], steps: Tuple[StepFeatures, ...]):
+        self.action_ids = action_ids
+        self.steps = steps
+
+
+class GoldCache:
+    """Bounded LRU of parsed ground-truth <key> blocks.
+
+    Entries are keyed by a digest of the ground-truth text, so a hit can
+    never serve another sample's gold. Actions are interned into ids that
+    are only compared with each other; the vocabulary holds gold actions
+    only and is kept across evictions. Each reward process owns one cache;
+    batch workers fill theirs from the groups they score and keep it for
+    the life of the pool.
+    """
+
+    def __init__(self, max_entries: int = GOLD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[bytes, Optional[GoldKey]]" = OrderedDict()
+        self.action_vocab: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _intern(self, actions: List[str]) -> Tuple[int, ...]:
+        return tuple(self.action_vocab.setdefault(a, len(self.action_vocab)) for a in actions)
+
+    def action_ids(self, actions: List[str]) -> Tuple[int, ...]:
+        """Ids of predicted actions; actions absent from every gold key map to -1."""
+        return tuple(self.action_vocab.get(a, -1) for a in actions)
+
+    def _build(self, actions: List[str], objects: List[List[str]], parameters: List[List[str]]) -> GoldKey:
+        return GoldKey(self._intern(actions),
+                       tuple(StepFeatures(o, p) for o, p in zip(objects, parameters)))
+
+    def _from_extra_info(self, extra_info: Optional[Dict[str, Any]]) -> Optional[GoldKey]:
+        """Gold steps pre-parsed by train/build_rl_parquet.py, when the row carries them."""
+        if not isinstance(extra_info, dict) or extra_info.get("gold_actions") is None \
+                or len(extra_info["gold_actions"]) == 0:
+            return None
+        actions = [str(a) for a in extra_info["gold_actions"]]
+        objects = [[str(x) for x in o] for o in extra_info["gold_objects"]]
+        parameters = [[str(x) for x in p] for p in extra_info["gold_parameters"]]
+        return self._build(actions, objects, parameters)
+
+    def _parse(self, ground_truth: str) -> Optional[GoldKey]:
+        m = KEY_PATTERN.search(ground_truth or "")
+        steps = parse_key_steps(m.group(1), strict=False) if m else None
+        if not steps:
+            return None
+        return self._build([s["action"] for s in steps], [s["objects"] for s in steps],
+                           [s["parameters"] for s in steps])
+
+    def get(self, ground_truth: str, extra_info: Optional[Dict[str, Any]] = None) -> Optional[GoldKey]:
+        key = hashlib.blake2b((ground_truth or "").encode("utf-8"), digest_size=16).digest()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        gold = self._from_extra_info(extra_info) or self._parse(ground_truth)
+        self.entries[key] = gold
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return gold
+
+
+_GOLD_CACHE = GoldCache()
+
+
+# ======================================================
+# Reward components
+# ======================================================
+def format_gate(solution_str: str) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    """(<key> steps, <orc> block) if all four blocks are present in order and <key> is well formed."""
+    m = TAG_PATTERN.match(solution_str or "")
+    if not m:
+        return None
+    steps = parse_key_steps(m.group("key"))
+    if not steps:
+        return None
+    return steps, m.group("orc")
+
+
+def consistency_gate(steps: List[Dict[str, Any]], orc_block: str) -> bool:
+    """<key> and <orc> number the same steps 1..n, one line each."""
+    orc_numbers = []
+    for ln in step_lines(orc_block):
+        m = STEP_TEXT_PAT.match(ln)
+        if not m:
+            return False
+        orc_numbers.append(int(m.group(1)))
+    expected = list(range(1, len(steps) + 1))
+    return [s["number"] for s in steps] == expected and orc_numbers == expected
+
+
+def step_scale_reward(n_pred: int, n_gold: int) -> float:
+    """1 at the gold step count, decreasing linearly with the relative gap either way."""
+    if n_gold == 0:
+        return 1.0 if n_pred == 0 else 0.0
+    return max(0.0, 1.0 - abs(n_pred - n_gold) / n_gold)
+
+
+def _lcs_len(a: Tuple[int, ...], b: Tuple[int, ...]) -> int:
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+        prev = cur
+    return prev[-1]
+
+
+def order_score(pred_ids: Tuple[int, ...], gold_ids: Tuple[int, ...], mode: str = ORDER_MODE) -> float:
+    if mode == "strict_subseq":
+        return 1.0 if pred_ids == gold_ids else 0.0
+    if not pred_ids and not gold_ids:
+        return 1.0
+    return 2.0 * _lcs_len(pred_ids, gold_ids) / max(1, len(pred_ids) + len(gold_ids))
+
+
+def _pair_greedy(pred_ids: Tuple[int, ...], gold_ids: Tuple[int, ...]) -> List[Tuple[int, int]]:
+    pairs, j = [], 0
+    for i, a in enumerate(pred_ids):
+        while j < len(gold_ids) and gold_ids[j] != a:
+            j += 1
+        if j < len(gold_ids):
+            pairs.append((i, j))
+            j += 1
+    return pairs
+
+
+def _iou(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def content_score(pred: List[StepFeatures], gold: GoldKey, pairs: List[Tuple[int, int]],
+                  denom_mode: str = CONTENT_DENOM, lambda_decay: float = LAMBDA_DECAY) -> float:
+    """Mean position-decayed object/parameter agreement over aligned steps, scaled to [0, 1]."""
+    if not pairs:
+        return 0.0
+    n_gold = len(gold.steps)
+    total = 0.0
+    for pi, gi in pairs:
+        p, g = pred[pi], gold.steps[gi]
+        obj = _iou(p.objects, g.objects)
+        if obj == 0.0:
+            obj = _iou(p.object_kw, g.object_kw)
+        para = 0.0
+        if obj >= 0.5:
+            if not p.has_params and not g.has_params:
+                para = 1.0
+            elif p.has_params and g.has_params:
+                para = _iou(p.param_kw, g.param_kw)
+        x, D = abs(pi - gi), max(1, n_gold)
+        m_x = 0.0 if x >= D else max(0.0, 1.0 - (x / float(D)) ** lambda_decay)
+        total += m_x * (obj + 0.5 * para) / 1.5
+    denom = len(pairs) if denom_mode == "matched" else max(len(pred), n_gold)
+    return total / max(1, denom)
+
+
+def _combine(a: float, b: float, mode: str) -> float:
+    return a * b if mode == "product" else (a + b) / 2.0
+
+
+def current_modes() -> Dict[str, Any]:
+    """The four GRPO_* modes and the decay, as read from the environment at import."""
+    return {"order_mode": ORDER_MODE, "combine_mode": COMBINE_MODE, "content_denom": CONTENT_DENOM,
+            "final_combine": FINAL_COMBINE, "lambda_decay": LAMBDA_DECAY}
+
+
+def score_with_gold(solution_str: str, gold: Optional[GoldKey], modes: Dict[str, Any]) -> float:
+    """SCORE reward in [0, 1]: format and consistency gates, then step scale x step semantics."""
+    if gold is None:
+        return 0.0
+    gated = format_gate(solution_str)
+    if gated is None:
+        return 0.0
+    steps, orc_block = gated
+    if not consistency_gate(steps, orc_block):
+        return 0.0
+
+    pred_ids = _GOLD_CACHE.action_ids([s["action"] for s in steps])
+    pred = [StepFeatures(s["objects"], s["parameters"]) for s in steps]
+    scale = step_scale_reward(len(steps), len(gold.steps))
+    semantics = _combine(
+        order_score(pred_ids, gold.action_ids, modes["order_mode"]),
+        content_score(pred, gold, _pair_greedy(pred_ids, gold.action_ids),
+                      modes["content_denom"], modes["lambda_decay"]),
+        modes["combine_mode"],
+    )
+    return float(_combine(scale, semantics, modes["final_combine"]))
+
+
+# ======================================================
+# verl entry points
+# ======================================================
+def compute_score(data_source: str, solution_str: str, ground_truth: str,
+                  extra_info: Optional[Dict[str, Any]] = None) -> float:
+    """Per-sample reward for verl's naive reward manager."""
+    return score_with_gold(solution_str, _GOLD_CACHE.get(ground_truth, extra_info), current_modes())
+
+
+def _score_groups(groups: List[Tuple[str, Any, List[Tuple[int, str]]]],
+                  modes: Dict[str, Any]) -> List[Tuple[int, float]]:
+    """Pool task: resolve each group's gold once (via this worker's cache) and score its rollouts."""
+    out = []
+    for ground_truth, extra_info, rollouts in groups:
+        gold = _GOLD_CACHE.get(ground_truth, extra_info)
+        out.extend((idx, score_with_gold(sol, gold, modes)) for idx, sol in rollouts)
+    return out
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # Kept for the whole run so worker gold caches stay warm across steps
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(max_workers=workers)
+    return _POOL
+
+
+def _drop_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def _map_groups(tasks: List[List[Tuple[str, Any, List[Tuple[int, str]]]]],
+                modes: Dict[str, Any]) -> List[Tuple[int, float]]:
+    pool = _get_pool(REWARD_WORKERS)
+    return [r for part in pool.map(_score_groups, tasks, [modes] * len(tasks)) for r in part]
+
+
+def compute_score_batch(data_sources: List[str], solution_strs: List[str], ground_truths: List[str],
+                        extra_infos: Optional[List[Optional[Dict[str, Any]]]] = None,
+                        **kwargs) -> np.ndarray:
+    """Rewards for a whole rollout batch, for verl's batch reward manager.
+
+    Rollouts sharing a ground truth (the n samples of one prompt) form one
+    group whose gold is resolved once. Groups are spread over
+    REWARD_WORKERS processes in about four tasks per worker; small batches
+    (or REWARD_WORKERS <= 1) are scored inline. A worker dying breaks the
+    pool, so it is replaced and the batch retried once, then scored inline.
+    Values equal compute_score on each item.
+    """
+    n = len(solution_strs)
+    extra_infos = extra_infos if extra_infos is not None else [None] * n
+    modes = current_modes()
+
+    grouped: "OrderedDict[str, Tuple[Any, List[Tuple[int, str]]]]" = OrderedDict()
+    for i, (sol, gt, ei) in enumerate(zip(solution_strs, ground_truths, extra_infos)):
+        grouped.setdefault(gt, (ei, []))[1].append((i, sol))
+    groups = [(gt, ei, rollouts) for gt, (ei, rollouts) in grouped.items()]
+
+    rewards = np.zeros(n, dtype=np.float64)
+    if REWARD_WORKERS <= 1 or n < REWARD_MIN_PARALLEL:
+        results = _score_groups(groups, modes)
+    else:
+        n_tasks = min(len(groups), REWARD_WORKERS * 4)
+        tasks = [groups[k::n_tasks] for k in range(n_tasks)]
+        try:
+            results = _map_groups(tasks, modes)
+        except BrokenProcessPool:
+            _drop_pool()
+            try:
+                results = _map_groups(tasks, modes)
+            except BrokenProcessPool:
+                _drop_pool()
+                results = _score_groups(groups, modes)
+    for idx, score in results:
+        rewards[idx] = score
+    return rewards
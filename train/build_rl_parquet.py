@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from transformers import AutoTokenizer
+
+# ======================================================
+# Configuration
+# ======================================================
+INPUT_JSONL = os.getenv("RL_INPUT_JSONL", "data/train_data/demo_rl.jsonl")    # {"system", "query", "response"} rows
+TRAIN_PARQUET = os.getenv("TRAIN_DATA", "data/train_data/rl_train.parquet")
+TEST_PARQUET = os.getenv("TEST_DATA", "data/train_data/rl_test.parquet")
+MODEL_PATH = os.getenv("MODEL_PATH", "Qwen/Qwen3-8B")                          # tokenizer for prompt lengths
+
+TEST_RATIO = float(os.getenv("RL_TEST_RATIO", "0.05"))     # by hash of the query, so splits are stable
+MAX_PROMPT_LENGTH = int(os.getenv("MAX_PROMPT_LENGTH", "1024"))   # same as data.max_prompt_length
+ROW_GROUP_SIZE = int(os.getenv("RL_ROW_GROUP_SIZE", "4096"))
+DATA_SOURCE = "scirecipe"
+ABILITY = "bio_protocol"
+
+# Repeated strings are stored once per column chunk. The system prompt repeats in
+# prompt.content as well, so that column is dictionary-encoded too; its page limit
+# fits a row group of unique queries, or the writer would fall back to PLAIN
+DICTIONARY_COLUMNS = ["data_source", "ability", "system", "reward_model.style", "extra_info.split",
+                      "prompt.list.element.role", "prompt.list.element.content"]
+DICTIONARY_PAGE_LIMIT = int(os.getenv("RL_DICTIONARY_PAGE_LIMIT", str(64 << 20)))
+ACTION_VOCAB_KEY = "scirecipe.action_vocab"
+
+
+# ======================================================
+# Gold <key> parsing (same rules as eval/eval_batch.py)
+# ======================================================
+KEY_PATTERN = re.compile(r"<key>(.*?)</key>", flags=re.DOTALL | re.IGNORECASE)
+STEP_JSON_PAT = re.compile(r"^Step\s+(\d+)\s*:\s*(\{.*\})\s*$", flags=re.IGNORECASE)
+
+
+def _lower_list_str(lst: Any) -> List[str]:
+    if not isinstance(lst, list):
+        return []
+    return [x.strip().lower() for x in lst if isinstance(x, str) and x.strip()]
+
+
+def parse_gold_key(response: str) -> Optional[Dict[str, List]]:
+    """Step numbers and lowercased action/objects/parameters of the <key> block, or None."""
+    m = KEY_PATTERN.search(response or "")
+    if not m:
+        return None
+    steps = {"step_ids": [], "actions": [], "objects": [], "parameters": []}
+    for ln in m.group(1).strip().splitlines():
+        sm = STEP_JSON_PAT.match(ln.strip())
+        if not sm:
+            continue
+        try:
+            obj = json.loads(sm.group(2))
+        except Exception:
+            continue
+        if not isinstance(obj, dict):
+            continue
+        action = obj.get("action", "")
+        steps["step_ids"].append(int(sm.group(1)))
+        steps["actions"].append(action.strip().lower() if isinstance(action, str) else "")
+        steps["objects"].append(_lower_list_str(obj.get("objects", [])))
+        steps["parameters"].append(_lower_list_str(obj.get("parameters", [])))
+    return steps if steps["step_ids"] else None
+
+
+# ======================================================
+# Schema
+# ======================================================
+MESSAGE = pa.struct([("role", pa.string()), ("content", pa.string())])
+SCHEMA = pa.schema([
+    ("data_source", pa.string()),
+    ("prompt", pa.list_(MESSAGE)),
+    ("ability", pa.string()),
+    ("reward_model", pa.struct([("style", pa.string()), ("ground_truth", pa.string())])),
+    ("extra_info", pa.struct([
+        ("split", pa.string()),
+        ("index", pa.int64()),
+        ("prompt_length", pa.int32()),
+        ("gold_step_ids", pa.list_(pa.int32())),
+        ("gold_action_ids", pa.list_(pa.int32())),
+        ("gold_actions", pa.list_(pa.string())),
+        ("gold_objects", pa.list_(pa.list_(pa.string()))),
+        ("gold_parameters", pa.list_(pa.list_(pa.string()))),
+    ])),
+    ("system", pa.string()),
+    ("prompt_length", pa.int32()),
+])
+
+
+def _split_of(query: str) -> str:
+    bucket = zlib.crc32(query.encode("utf-8")) / 0xFFFFFFFF
+    return "test" if bucket < TEST_RATIO else "train"
+
+
+def iter_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                yield i, json.loads(line)
+
+
+def _messages(row: Dict[str, Any]) -> List[Dict[str, str]]:
+    msgs = [{"role": "system", "content": row["system"]}] if row.get("system") else []
+    return msgs + [{"role": "user", "content": row["query"]}]
+
+
+def prompt_lengths(tokenizer, prompts: List[List[Dict[str, str]]]) -> List[int]:
+    """Token counts exactly as verl's filter_overlong_prompts computes them."""
+    texts = [tokenizer.apply_chat_template(p, add_generation_prompt=True, tokenize=False) for p in prompts]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+
+class SplitWriter:
+    """Buffers rows of one split and writes them as Parquet row groups."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.writer = pq.ParquetWriter(path, SCHEMA, compression="zstd",
+                                       use_dictionary=DICTIONARY_COLUMNS,
+                                       dictionary_pagesize_limit=DICTIONARY_PAGE_LIMIT)
+        self.rows: List[Dict[str, Any]] = []
+        self.count = 0
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=SCHEMA))
+            self.count += len(self.rows)
+            self.rows = []
+
+    def close(self, metadata: Dict[str, str]) -> None:
+        self.flush()
+        self.writer.add_key_value_metadata(metadata)
+        self.writer.close()
+
+
+# ======================================================
+# Main
+# ======================================================
+def process_chunk(tokenizer, chunk: List[Tuple[int, Dict[str, Any]]], vocab: Dict[str, int],
+                  writers: Dict[str, SplitWriter], stats: Dict[str, int]) -> None:
+    prompts = [_messages(row) for _, row in chunk]
+    lengths = prompt_lengths(tokenizer, prompts)
+    for (index, row), prompt, length in zip(chunk, prompts, lengths):
+        if length > MAX_PROMPT_LENGTH:
+            stats["overlong"] += 1
+            continue
+        gold = parse_gold_key(row.get("response", ""))
+        if gold is None:
+            stats["no_key"] += 1
+            continue
+        split = _split_of(row["query"])
+        writers[split].add({
+            "data_source": DATA_SOURCE,
+            "prompt": prompt,
+            "ability": ABILITY,
+            "reward_model": {"style": "rule", "ground_truth": row["response"]},
+            "extra_info": {
+                "split": split,
+                "index": index,
+                "prompt_length": length,
+                "gold_step_ids": gold["step_ids"],
+                "gold_action_ids": [vocab.setdefault(a, len(vocab)) for a in gold["actions"]],
+                "gold_actions": gold["actions"],
+                "gold_objects": gold["objects"],
+                "gold_parameters": gold["parameters"],
+            },
+            "system": row.get("system") or "",
+            "prompt_length": length,
+        })
+
+
+def main():
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
+    writers = {"train": SplitWriter(TRAIN_PARQUET), "test": SplitWriter(TEST_PARQUET)}
+    vocab: Dict[str, int] = {}
+    stats = {"rows": 0, "overlong": 0, "no_key": 0}
+
+    chunk: List[Tuple[int, Dict[str, Any]]] = []
+    for item in iter_rows(INPUT_JSONL):
+        chunk.append(item)
+        stats["rows"] += 1
+        if len(chunk) >= ROW_GROUP_SIZE:
+            process_chunk(tokenizer, chunk, vocab, writers, stats)
+            chunk = []
+    if chunk:
+        process_chunk(tokenizer, chunk, vocab, writers, stats)
+
+    # Both splits share one action vocabulary, stored in each file's footer
+    metadata = {ACTION_VOCAB_KEY: json.dumps(list(vocab), ensure_ascii=False),
+                "max_prompt_length": str(MAX_PROMPT_LENGTH)}
+    for w in writers.values():
+        w.close(metadata)
+
+    print(f"Read {stats['rows']} rows: {writers['train'].count} train, {writers['test'].count} test; "
+          f"dropped {stats['overlong']} over {MAX_PROMPT_LENGTH} prompt tokens, "
+          f"{stats['no_key']} without a parsable <key>")
+    print(f"Saved to: {TRAIN_PARQUET}, {TEST_PARQUET}")
+
+
+if __name__ == "__main__":
+    main()
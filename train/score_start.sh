@@ -9,15 +9,18 @@ reward=${REWARD_PATH:?REWARD_PATH not set}
 project_name=${PROJECT_NAME:?PROJECT_NAME not set}
 experiment_name=${EXPERIMENT_NAME:?EXPERIMENT_NAME not set}
 ckpt_dir=${CKPT_DIR:?CKPT_DIR not set}
+max_prompt_length=${MAX_PROMPT_LENGTH:-1024}
+# Parquet from train/build_rl_parquet.py is already filtered to max_prompt_length
+filter_overlong_prompts=${FILTER_OVERLONG_PROMPTS:-True}
 
 python3 -m verl.trainer.main_ppo \
     algorithm.adv_estimator=grpo \
     data.train_files=$train_data \
     data.val_files=$test_data \
     data.train_batch_size=1024 \
-    data.max_prompt_length=1024 \
+    data.max_prompt_length=$max_prompt_length \
     data.max_response_length=1024 \
-    data.filter_overlong_prompts=True \
+    data.filter_overlong_prompts=$filter_overlong_prompts \
     data.truncation='error' \
     actor_rollout_ref.model.path=$model \
     actor_rollout_ref.actor.optim.lr=5e-6 \